@@ -1,11 +1,92 @@
 # api_utils.py
-import os, requests, datetime
+import os, re, json, base64, queue, random, threading, time, requests, datetime
+from collections import OrderedDict
+from PIL import features
+from local_store import LocalStore
+from prefetch import Prefetcher, NORMAL, LOW
+from storage import KEY_RE
 
 API_URL      = "http://127.0.0.1:3000"
 TOKEN_FILE   = "token.txt"
 TOKEN: str | None = None          
 CURRENT_USER_EMAIL: str | None = None
 
+MIRROR_FILE    = "mirror.db"
+MIRROR_FRESH_S = 30          # mirrored GETs younger than this are served without the network
+SYNC_INTERVAL  = 30
+MIRRORED       = re.compile(r"^/api/(profile|images|albums|albums/\d+/images)(/sprite\?page=\d+&size=\d+)?$")
+OFFLINE_ERRORS = (requests.ConnectionError, requests.Timeout)
+RETRY_STATUSES = (429, 503)
+RETRY_BUDGET_S = 5.0         # longest a background call waits in total before handing the 429/503 back
+BLOB_CACHE_BYTES = 64 * 1024 * 1024     # prefetched images/sprite sheets kept in memory
+BLOB_MAX_BYTES   = 8 * 1024 * 1024      # larger files aren't worth prefetching
+EVENTS_READ_TIMEOUT = 45     # the server sends a heartbeat every 15 s; silence this long means a dead link
+EVENTS_RETRY_S      = 3.0
+EXPORT_RETRIES      = 8      # dropped connections an export survives before giving up
+AVATAR_PREFIX       = "/avatars/"   # immutable URLs; kept in the mirror and never revalidated
+AVATAR_URL          = re.compile(r"^(?P<owner>/avatars/avatar_[^_]+_)[0-9a-f]+(?P<size>_\d+\.png)$")
+
+
+def _image_accept() -> str:
+    # only advertise formats this Pillow build can decode; the server never
+    # picks a modern format for a bare */*
+    modern = [mime for mime, mod in (("image/avif", "avif"), ("image/webp", "webp"))
+              if mod in features.modules and features.check_module(mod)]
+    return ",".join(modern + ["image/*;q=0.8", "*/*;q=0.5"])
+
+
+IMAGE_ACCEPT = _image_accept()
+
+_store: LocalStore | None = None
+_flush_lock = threading.Lock()
+_flush_progress = threading.Condition(_flush_lock)     # notified as a flush settles entries
+_flushing = False           # an outbox flush is sending; guarded by _flush_lock
+_awaited: dict = {}         # entry id -> response (None until sent) of writes waiting on another flush
+_changes: "queue.Queue[str]" = queue.Queue()   # mirrored routes whose content changed
+_revalidating: set = set()  # mirrored routes being revalidated in the background
+_revalidating_lock = threading.Lock()
+_sync_thread: threading.Thread | None = None
+_events: "queue.Queue[dict]" = queue.Queue()   # {"type", "data"} pushed by /api/events
+_events_thread: threading.Thread | None = None
+_blobs: "OrderedDict[str, tuple[bytes, str]]" = OrderedDict()   # url -> (body, content type)
+_blob_bytes = 0
+_blob_lock = threading.Lock()
+_fg_active = 0              # visible (Tk thread) requests in flight
+_fg_finished = 0.0
+
+
+def store() -> LocalStore:
+    global _store
+    if _store is None:
+        _store = LocalStore(MIRROR_FILE)
+    return _store
+
+
+def _account() -> str:
+    """User id from the JWT payload (no verification needed, it only namespaces local data)."""
+    try:
+        payload = TOKEN.split(".")[1]
+        return str(json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["id"])
+    except Exception:
+        return "anonymous"
+
+
+def _local_response(route: str, status: int, body: bytes, **headers) -> requests.Response:
+    resp = requests.Response()
+    resp.status_code = status
+    resp._content = body
+    resp.encoding = "utf-8"
+    resp.url = f"{API_URL}{route}"
+    resp._content_consumed = True       # iter_content() replays _content instead of reading raw
+    resp.headers["Content-Type"] = "application/json"
+    resp.headers.update(headers)
+    return resp
+
+
+def is_queued(resp) -> bool:
+    """True for the placeholder response of a write parked in the outbox."""
+    return resp.status_code == 202 and resp.headers.get("X-Queued") == "1"
+
 
 def save_token(token: str) -> None:
     """Zapisuje token do pliku i w RAM-ie"""
@@ -23,17 +104,548 @@ def load_token() -> None:
 
 def clear_token() -> None:
     global TOKEN, CURRENT_USER_EMAIL
+    if TOKEN:
+        store().forget(_account())
+    prefetcher.cancel()
+    _drop_blobs()
     TOKEN = None
     CURRENT_USER_EMAIL = None
     if os.path.exists(TOKEN_FILE):
         os.remove(TOKEN_FILE)
 
 
+def foreground_idle_for() -> float:
+    """Seconds since the last request made from the Tk thread finished; 0 while one runs."""
+    return 0.0 if _fg_active else time.monotonic() - _fg_finished
+
+
+def _request(method: str, url: str, **kw) -> requests.Response:
+    # requests made on the Tk thread are what the user waits for; prefetching yields to them
+    global _fg_active, _fg_finished
+    if threading.current_thread() is not threading.main_thread():
+        return _send(method, url, **kw)
+    _fg_active += 1
+    try:
+        return _send(method, url, **kw)
+    finally:
+        _fg_active -= 1
+        _fg_finished = time.monotonic()
+
+
+def _send(method: str, url: str, **kw) -> requests.Response:
+    """
+    requests.request that backs off on 429/503: waits Retry-After (or an
+    exponential delay) plus jitter, and returns the last answer once waiting
+    longer would exceed RETRY_BUDGET_S. On the Tk thread it never waits, as
+    sleeping there freezes the window.
+    """
+    budget = 0.0 if threading.current_thread() is threading.main_thread() else RETRY_BUDGET_S
+    spent, attempt = 0.0, 0
+    while True:
+        resp = requests.request(method, url, **kw)
+        if resp.status_code not in RETRY_STATUSES:
+            return resp
+        try:
+            delay = float(resp.headers.get("Retry-After", ""))
+        except ValueError:
+            delay = 0.5 * 2 ** attempt
+        delay += random.uniform(0, 0.25 * delay)
+        if spent + delay > budget:
+            return resp
+        resp.close()
+        for f in kw.get("files", {}).values():     # rewind uploads before resending
+            f[1].seek(0)
+        time.sleep(delay)
+        spent += delay
+        attempt += 1
+
+
 def api_post(route: str, **kw):
-    return requests.post(f"{API_URL}{route}", **kw)
+    return _request("POST", f"{API_URL}{route}", **kw)
 
 def api_get(route: str, auth: bool = False, **kw):
     headers = kw.pop("headers", {})
     if auth and TOKEN:
         headers["Authorization"] = f"Bearer {TOKEN}"
-    return requests.get(f"{API_URL}{route}", headers=headers, **kw)
+        if MIRRORED.match(route):
+            return _mirrored_get(route, headers, **kw)
+    return _request("GET", f"{API_URL}{route}", headers=headers, **kw)
+
+
+def _mirrored_get(route, headers, **kw):
+    """
+    Serves from the local mirror. A copy that is merely old is served as it
+    is and revalidated in the background; if it changed, the route comes
+    out of drain_changes so the view refreshes. A copy known to be outdated
+    (marked stale after a write or an event), a missing one and sprite maps,
+    which must match the listing just shown, are revalidated first with
+    If-None-Match, falling back to the copy offline.
+    """
+    acct = _account()
+    doc = store().get(acct, route)
+    if doc and not doc.stale and time.time() - doc.synced_at < MIRROR_FRESH_S:
+        return _local_response(route, 200, doc.body, **{"X-Mirror": "fresh"})
+    if doc and not doc.stale and "?" not in route:
+        _revalidate_later(acct, route, headers)
+        return _local_response(route, 200, doc.body, **{"X-Mirror": "old"})
+    changed, resp = _revalidate(acct, route, doc, headers, **kw)
+    if resp is None:
+        if doc:
+            return _local_response(route, 200, doc.body, **{"X-Mirror": "offline"})
+        return _local_response(route, 503, b'{"error": "Server unreachable"}')
+    if resp.status_code == 304:
+        return _local_response(route, 200, doc.body, **{"X-Mirror": "revalidated"})
+    return resp
+
+
+def _revalidate_later(acct, route, headers):
+    with _revalidating_lock:
+        if route in _revalidating:
+            return
+        _revalidating.add(route)
+
+    def run():
+        try:
+            changed, _ = _revalidate(acct, route, store().get(acct, route), headers)
+            if changed:
+                _changes.put(route)
+        except Exception:
+            pass
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard(route)
+    threading.Thread(target=run, name="mirror-revalidate", daemon=True).start()
+
+
+def _revalidate(acct, route, doc, headers=None, **kw):
+    """(changed, response); response is None when the server is unreachable."""
+    headers = dict(headers or {"Authorization": f"Bearer {TOKEN}"})
+    if doc and doc.etag:
+        headers["If-None-Match"] = doc.etag
+    kw.setdefault("timeout", 10)
+    try:
+        resp = _request("GET", f"{API_URL}{route}", headers=headers, **kw)
+    except OFFLINE_ERRORS:
+        return False, None
+    if resp.status_code == 304 and doc:
+        store().touch(acct, route)
+        return False, resp
+    if resp.status_code == 200:
+        changed = doc is None or doc.body != resp.content
+        store().put(acct, route, resp.headers.get("ETag"), resp.content)
+        return changed, resp
+    return False, resp
+
+
+def api_send(method: str, route: str, json=None, data=None, file_path=None):
+    """
+    Authenticated write that survives being offline: it is recorded in the
+    outbox first, then the outbox is replayed in order. If the server can't
+    be reached, a 202 placeholder (see is_queued) is returned and the write
+    is retried later with the same Idempotency-Key.
+    """
+    entry_id = store().enqueue(_account(), method, route, json, data, file_path)
+    delivered = flush_outbox(wait_for=entry_id)
+    if entry_id in delivered:
+        return delivered[entry_id]
+    return _local_response(route, 202, b'{"message": "Saved offline, will sync when online"}',
+                           **{"X-Queued": "1"})
+
+
+def edit_mirror(change, *routes) -> None:
+    """
+    Applies a queued write to the mirrored copies of `routes` so it shows
+    before it syncs: change(payload) returns the new payload. The copies
+    lose their ETag, so the next sync replaces them with the server's.
+    """
+    acct = _account()
+    for route in routes:
+        doc = store().get(acct, route)
+        if doc is not None:
+            store().put(acct, route, None, json.dumps(change(json.loads(doc.body))).encode())
+
+
+def flush_outbox(wait_for=None) -> dict:
+    """
+    Replays queued writes in order until one can't reach the server; {entry id: response}.
+    The lock only guards taking a snapshot of the outbox, never a request.
+    A call made while another flush is sending returns {} at once, or with
+    `wait_for` (an entry id) waits for that flush, which replays the entry
+    from its next snapshot, and returns {} only if it stopped first.
+    """
+    global _flushing
+    if not TOKEN:
+        return {}
+    acct = _account()
+    with _flush_lock:
+        if _flushing:
+            if wait_for is None:
+                return {}
+            _awaited[wait_for] = None
+            while _flushing and _awaited[wait_for] is None:
+                _flush_progress.wait()
+            resp = _awaited.pop(wait_for)
+            return {} if resp is None else {wait_for: resp}
+        _flushing = True
+    delivered = {}
+    try:
+        while True:
+            with _flush_lock:
+                entries = store().pending(acct)
+                if not entries:
+                    _flushing = False
+                    break
+            if not _replay(acct, entries, delivered):
+                break
+    finally:
+        with _flush_lock:
+            _flushing = False
+            _flush_progress.notify_all()
+    if delivered:
+        store().mark_stale(acct)
+    return delivered
+
+
+def _replay(acct, entries, delivered) -> bool:
+    """Sends `entries` in order into `delivered`; False once the rest has to wait for a later flush."""
+    for entry in entries:
+        headers = {"Authorization": f"Bearer {TOKEN}", "Idempotency-Key": entry["idem_key"]}
+        try:
+            if entry["file_path"]:
+                with open(entry["file_path"], "rb") as f:
+                    resp = _request(entry["method"], f"{API_URL}{entry['route']}",
+                                    files={"file": (entry["file_name"], f)},
+                                    data=entry["form"], headers=headers, timeout=60)
+            else:
+                resp = _request(entry["method"], f"{API_URL}{entry['route']}",
+                                json=entry["json"], data=entry["form"],
+                                headers=headers, timeout=15)
+        except FileNotFoundError as e:      # queued file vanished; nothing left to send
+            store().record_failure(entry, e)
+            store().remove(entry)
+            continue
+        except requests.RequestException as e:
+            # unreachable or cut off mid-request: keep this and everything after it
+            store().record_failure(entry, e)
+            for rest in store().pending(acct):
+                store().keep_file(rest)
+            return False
+        if resp.status_code in RETRY_STATUSES:
+            # throttled or shedding load: not an answer, so keep the order and retry later
+            store().record_failure(entry, f"HTTP {resp.status_code}")
+            for rest in store().pending(acct):
+                store().keep_file(rest)
+            return False
+        # the server answered (even with an error): the write is settled
+        store().remove(entry)
+        delivered[entry["id"]] = resp
+        with _flush_lock:
+            if entry["id"] in _awaited:
+                _awaited[entry["id"]] = resp
+                _flush_progress.notify_all()
+    return True
+
+def drain_changes() -> set:
+    """Routes changed by background sync since the last call; poll this from the Tk thread."""
+    routes = set()
+    while True:
+        try:
+            routes.add(_changes.get_nowait())
+        except queue.Empty:
+            return routes
+
+
+def start_sync() -> None:
+    """Background thread: replays the outbox and keeps mirrored routes fresh."""
+    global _sync_thread
+    if _sync_thread is not None:
+        return
+
+    def loop():
+        while True:
+            if TOKEN:
+                try:
+                    sync_once()
+                except Exception:
+                    pass
+            time.sleep(SYNC_INTERVAL)
+
+    _sync_thread = threading.Thread(target=loop, name="mirror-sync", daemon=True)
+    _sync_thread.start()
+
+
+def sync_once() -> None:
+    acct = _account()
+    flush_outbox()
+    for route in store().routes(acct):
+        if "?" in route or route.startswith(AVATAR_PREFIX):
+            continue        # sprite maps: revalidated when a grid asks for them; avatars never change
+        changed, resp = _revalidate(acct, route, store().get(acct, route))
+        if resp is None:
+            return      # offline; try again next round
+        if changed:
+            _changes.put(route)
+
+
+# —— live updates ——
+# One background thread follows GET /api/events (server-sent events) and
+# queues each event for the Tk thread, which patches the open views
+# (drain_events). Mirrored listings are marked stale so the next rebuild
+# revalidates them; after a disconnect the stream resumes from the last id.
+
+def drain_events() -> list:
+    """Events received since the last call, oldest first; poll this from the Tk thread."""
+    events = []
+    while True:
+        try:
+            events.append(_events.get_nowait())
+        except queue.Empty:
+            return events
+
+
+def start_events() -> None:
+    global _events_thread
+    if _events_thread is not None:
+        return
+    _events_thread = threading.Thread(target=_follow_events, name="live-events", daemon=True)
+    _events_thread.start()
+
+
+def _follow_events() -> None:
+    last_id, token = None, None
+    while True:
+        if not TOKEN:
+            time.sleep(EVENTS_RETRY_S)
+            continue
+        if TOKEN != token:          # another account: its events start from now
+            last_id, token = None, TOKEN
+        headers = {"Authorization": f"Bearer {token}", "Accept": "text/event-stream"}
+        if last_id:
+            headers["Last-Event-ID"] = last_id
+        try:
+            resp = _request("GET", f"{API_URL}/api/events", headers=headers, stream=True,
+                            timeout=(10, EVENTS_READ_TIMEOUT))
+            with resp:
+                if resp.status_code == 200:
+                    for event_id, kind, data in _sse_events(resp):
+                        if TOKEN != token:
+                            break
+                        if event_id:
+                            last_id = event_id
+                        store().mark_stale(_account())
+                        _events.put({"type": kind, "data": json.loads(data or "{}")})
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(EVENTS_RETRY_S)
+
+
+def _sse_events(resp):
+    """(id, event, data) per message of a text/event-stream response."""
+    event_id, kind, data = None, "message", []
+    # chunk_size=1: the default buffering would hold small events back until more bytes arrive
+    for raw in resp.iter_lines(chunk_size=1):
+        line = raw.decode("utf-8")
+        if not line:
+            if data:
+                yield event_id, kind, "\n".join(data)
+            event_id, kind, data = None, "message", []
+            continue
+        if line.startswith(":"):
+            continue            # heartbeat
+        name, _, value = line.partition(":")
+        value = value[1:] if value.startswith(" ") else value
+        if name == "data":
+            data.append(value)
+        elif name == "event":
+            kind = value
+        elif name == "id":
+            event_id = value
+
+
+# —— export ——
+
+def download_export(path: str, progress=None, cancelled=lambda: False) -> bool:
+    """
+    Streams GET /api/export to `path` through `path`.part, which survives a
+    dropped connection or a cancel: the next attempt (or call) asks for the
+    rest with Range + If-Range, and starts over only if the library changed
+    meanwhile. progress(done, total) is called from the calling thread.
+    Returns False when cancelled.
+    """
+    part, tag_file = path + ".part", path + ".part.etag"
+    failures = 0
+    while True:
+        done = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {"Authorization": f"Bearer {TOKEN}"}
+        if done and os.path.exists(tag_file):
+            with open(tag_file) as f:
+                headers.update({"Range": f"bytes={done}-", "If-Range": f.read()})
+        try:
+            with _request("GET", f"{API_URL}/api/export", headers=headers, stream=True,
+                          timeout=(10, 60)) as resp:
+                if resp.status_code == 416:         # nothing left to fetch for that file; start over
+                    os.remove(part)
+                    continue
+                if resp.status_code not in (200, 206):
+                    raise requests.HTTPError(f"HTTP {resp.status_code}", response=resp)
+                if resp.status_code == 200:
+                    done = 0
+                total = done + int(resp.headers["Content-Length"])
+                with open(tag_file, "w") as f:
+                    f.write(resp.headers.get("ETag", ""))
+                with open(part, "ab" if done else "wb") as out:
+                    for chunk in resp.iter_content(1024 * 1024):
+                        if cancelled():
+                            return False
+                        out.write(chunk)
+                        done += len(chunk)
+                        if progress:
+                            progress(done, total)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+            failures += 1
+            if failures > EXPORT_RETRIES:
+                raise
+            time.sleep(min(2 ** failures, 30))
+            continue
+        if done >= total:
+            os.replace(part, path)
+            os.remove(tag_file)
+            return True
+        failures += 1       # cut short without an error; ask for the rest
+        if failures > EXPORT_RETRIES:
+            raise requests.ConnectionError("export stream ended early")
+
+
+def fetch_image(filename: str, **kw):
+    """GET /uploads/<filename>, letting the server pick the smallest format we can decode."""
+    headers = kw.pop("headers", {})
+    if "Accept" not in headers:
+        cached = _cached_blob(f"/uploads/{filename}")
+        if cached is not None:
+            return cached
+    headers.setdefault("Accept", IMAGE_ACCEPT)
+    kw.setdefault("timeout", 15)
+    try:
+        return _request("GET", f"{API_URL}/uploads/{filename}", headers=headers, **kw)
+    except OFFLINE_ERRORS:
+        return _local_response(f"/uploads/{filename}", 503, b"")
+
+
+def fetch_avatar(url: str):
+    """PNG bytes behind an avatar URL (from /api/profile, the feed, search), or None if unavailable."""
+    acct = _account()
+    doc = store().get(acct, url)
+    if doc is not None:
+        return doc.body
+    try:
+        resp = _request("GET", f"{API_URL}{url}", timeout=10)
+    except OFFLINE_ERRORS:
+        return None
+    if resp.status_code != 200:
+        return None
+    store().put(acct, url, None, resp.content)
+    m = AVATAR_URL.match(url)
+    if m:       # a new version replaces the user's older ones of this size
+        store().forget_variants(acct, m["owner"], m["size"], keep=url)
+    return resp.content
+
+
+def fetch_sprite(url: str, **kw):
+    """GET a sprite sheet by the URL a .../sprite map returned (stream=True recommended)."""
+    cached = _cached_blob(url)
+    if cached is not None:
+        return cached
+    kw.setdefault("timeout", 15)
+    try:
+        return _request("GET", f"{API_URL}{url}", **kw)
+    except OFFLINE_ERRORS:
+        return _local_response(url, 503, b"")
+
+
+# —— prefetching ——
+# Speculative GETs run by `prefetcher` while the UI is idle. Listings and
+# sprite maps land in the mirror; immutable blobs (generated image keys,
+# sprite sheets) in a small in-memory LRU that fetch_image/fetch_sprite
+# consult first.
+
+prefetcher = Prefetcher(idle_for=foreground_idle_for)
+
+
+def _cached_blob(url: str):
+    with _blob_lock:
+        hit = _blobs.get(url)
+        if hit is None:
+            return None
+        _blobs.move_to_end(url)
+    body, ctype = hit
+    return _local_response(url, 200, body, **{"Content-Type": ctype, "X-Cache": "prefetch"})
+
+
+def _keep_blob(url: str, body: bytes, ctype: str) -> None:
+    global _blob_bytes
+    with _blob_lock:
+        if url in _blobs:
+            return
+        _blobs[url] = (body, ctype)
+        _blob_bytes += len(body)
+        while _blob_bytes > BLOB_CACHE_BYTES:
+            _, (old, _) = _blobs.popitem(last=False)
+            _blob_bytes -= len(old)
+
+
+def _drop_blobs() -> None:
+    global _blob_bytes
+    with _blob_lock:
+        _blobs.clear()
+        _blob_bytes = 0
+
+
+def _prefetch_blob(url: str, ticket, **kw) -> None:
+    with _blob_lock:
+        if url in _blobs:
+            return
+    resp = _request("GET", f"{API_URL}{url}", stream=True, timeout=15, **kw)
+    try:
+        if resp.status_code != 200 or int(resp.headers.get("Content-Length") or 0) > BLOB_MAX_BYTES:
+            return
+        chunks, total = [], 0
+        for chunk in resp.iter_content(64 * 1024):
+            ticket.consume(len(chunk))
+            total += len(chunk)
+            if total > BLOB_MAX_BYTES:
+                return
+            chunks.append(chunk)
+    finally:
+        resp.close()
+    _keep_blob(url, b"".join(chunks), resp.headers.get("Content-Type", "application/octet-stream"))
+
+
+def prefetch_route(route: str, priority=NORMAL) -> None:
+    """Warms the mirror for a mirrored GET route."""
+    def run(ticket):
+        ticket.consume(0)
+        resp = api_get(route, auth=True, timeout=10)
+        ticket.consume(len(resp.content))
+    prefetcher.schedule(("route", route), run, priority)
+
+
+def prefetch_sprite(endpoint: str, size: int, page: int = 0, priority=NORMAL) -> None:
+    """Warms one grid page: its listing, sprite map and sprite sheet."""
+    route = f"{endpoint}/sprite?page={page}&size={size}"
+
+    def run(ticket):
+        ticket.consume(0)
+        api_get(endpoint, auth=True, timeout=10)
+        resp = api_get(route, auth=True, timeout=10)
+        if resp.ok:
+            _prefetch_blob(resp.json()["url"], ticket)
+    prefetcher.schedule(("sprite", route), run, priority)
+
+
+def prefetch_image(filename: str, priority=LOW) -> None:
+    """Warms a full-size (detail) image; only immutable generated keys are cached."""
+    if KEY_RE.match(filename):
+        url = f"/uploads/{filename}"
+        prefetcher.schedule(("image", url),
+                            lambda ticket: _prefetch_blob(url, ticket, headers={"Accept": IMAGE_ACCEPT}),
+                            priority)
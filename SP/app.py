@@ -1,5 +1,8 @@
+import os
+import sys
 import tkinter as tk
 import api_utils as api
+import instrumentation
 from views.login_view import LoginView
 from views.main_view  import MainView
 
@@ -21,7 +24,17 @@ class InstaDesktop(tk.Tk):
 
     def show_main(self):
         self.clear()
+        api.start_sync()
+        api.start_events()
         MainView(self, self.show_login).pack(fill="both", expand=True)
 
 if __name__ == "__main__":
-    InstaDesktop().mainloop()
+    # --profile (or INSTA_PROFILE=1) reports UI stalls and view build times on exit
+    profiler = None
+    if "--profile" in sys.argv or os.environ.get("INSTA_PROFILE"):
+        profiler = instrumentation.enable(
+            stall_ms=float(os.environ.get("INSTA_STALL_MS", instrumentation.STALL_THRESHOLD_MS)))
+    root = InstaDesktop()
+    if profiler:
+        profiler.start_heartbeat(root)
+    root.mainloop()
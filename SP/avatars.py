@@ -0,0 +1,70 @@
+# avatars.py
+"""
+Profile pictures as the clients show them: circular, in a few fixed
+sizes, rendered once when the picture is uploaded. Transparent PNG
+corners let a client display them as they are (Tk decodes PNG itself),
+and every name embeds a digest of the picture, so a URL's content never
+changes and a new picture simply gets new URLs.
+"""
+import hashlib
+import re
+
+from PIL import Image, ImageDraw, ImageOps
+
+SIZES = (32, 48, 90)        # feed authors, people search, profile header
+SUPERSAMPLE = 4             # mask drawn this much larger, then downscaled: smooth edge
+DEFAULT_COLOR = "#bbb"
+DEFAULT_VERSION = "1"       # bump when the look of the default avatar changes
+
+# avatar_<user id or "default">_<version>_<size>.png
+NAME_RE = re.compile(r"^avatar_(?P<owner>\d+|default)_(?P<version>[0-9a-f]{1,16})_(?P<size>\d+)\.png$")
+
+
+def key(owner, version, size):
+    return f"avatar_{owner}_{version}_{size}.png"
+
+
+def keys(owner, version):
+    return [key(owner, version, size) for size in SIZES]
+
+
+def version_of(data):
+    """Content version of an encoded picture."""
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def render(img, size):
+    """`img` centre-cropped to a size x size circle on transparent corners (RGBA)."""
+    face = ImageOps.fit(img.convert("RGB"), (size, size), Image.LANCZOS)
+    big = size * SUPERSAMPLE
+    mask = Image.new("L", (big, big), 0)
+    ImageDraw.Draw(mask).ellipse((0, 0, big - 1, big - 1), fill=255)
+    face.putalpha(mask.resize((size, size), Image.LANCZOS))
+    return face
+
+
+def _store(storage, name, img):
+    with storage.writer(name, overwrite=True) as fh:
+        img.save(fh, "PNG", optimize=True)
+
+
+def publish(storage, user_id, img, version):
+    """Stores every size of the user's avatar for picture `img` at `version`; returns the keys."""
+    names = keys(user_id, version)
+    for name, size in zip(names, SIZES):
+        _store(storage, name, render(img, size))
+    return names
+
+
+def ensure_default(storage, size):
+    """Key of the grey stand-in for users without a picture, rendered on first use."""
+    name = key("default", DEFAULT_VERSION, size)
+    if not storage.exists(name):
+        _store(storage, name, render(Image.new("RGB", (size, size), DEFAULT_COLOR), size))
+    return name
+
+
+def urls(user_id, version):
+    """{size: URL} of a user's avatar; version None means no picture yet."""
+    owner, version = (user_id, version) if version else ("default", DEFAULT_VERSION)
+    return {str(size): f"/avatars/{key(owner, version, size)}" for size in SIZES}
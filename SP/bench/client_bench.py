@@ -0,0 +1,245 @@
+# bench/client_bench.py
+"""
+Client grid pipeline (gallery.grid_tiles) against a local fixture server.
+
+    cd SP && python -m bench.client_bench [--photos 60] [--mp 2] [--runs 3]
+
+Reports time to first tile, time to the last tile, peak RSS and bytes
+transferred. The fixture server speaks only the part of the API a grid
+uses (listing, sprite maps and sheets, /uploads) over a synthetic library,
+so neither Flask nor a database is needed. Every run is a fresh client
+process with its own empty mirror: "cold" renders straight away, "warm"
+first lets the prefetcher fill the mirror and the blob cache. Mode
+"sprites" is the normal pipeline, "thumbs" disables the sprite endpoint
+(one download and decode per photo).
+"""
+import argparse
+import base64
+import json
+import multiprocessing as mp
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image
+
+import sprites
+from storage import MediaStorage
+
+ENDPOINT = "/api/images"
+COUNTER = "/_bench/bytes"
+MODES = ("sprites", "thumbs")
+CACHES = ("cold", "warm")
+
+
+# —— fixture server ——
+
+class Library:
+    """`photos` synthetic JPEGs of ~`megapixels`, alternating landscape/portrait, kept between runs."""
+
+    def __init__(self, directory, photos, megapixels):
+        self.storage = MediaStorage(os.path.join(directory, f"media-{megapixels:g}mp"))
+        self.keys = [f"{i:032x}.jpg" for i in range(photos)]
+        w = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+        h = int(w * 3 / 4)
+        for i, key in enumerate(self.keys):
+            if not self.storage.exists(key):
+                self._make(key, (w, h) if i % 2 == 0 else (h, w))
+        self.listing = json.dumps([{
+            "filename": key,
+            "description": f"photo {i}",
+            "uploaded_at": "2026-01-01 12:00",
+            "taken_at": None,
+            "location": None,
+        } for i, key in enumerate(self.keys)]).encode()
+        self._sheets = {}       # (page, tile) -> (map body, sheet body)
+        self._lock = threading.Lock()
+
+    def _make(self, key, size):
+        # a gradient plus noise compresses like a photo rather than a flat fill
+        base = Image.linear_gradient("L").resize(size)
+        noise = Image.effect_noise(size, 40)
+        img = Image.merge("RGB", (base, noise, base.transpose(Image.FLIP_LEFT_RIGHT)))
+        with self.storage.writer(key) as fh:
+            img.save(fh, "JPEG", quality=90)
+
+    def sprite(self, page, tile):
+        """(map body, sheet name, sheet body); composed once per (page, tile)."""
+        with self._lock:
+            if (page, tile) not in self._sheets:
+                keys = self.keys[page * sprites.PER_PAGE:(page + 1) * sprites.PER_PAGE]
+                sheet, offsets = sprites.compose(self.storage, keys, tile)
+                path = os.path.join(self.storage.root, f"sheet-{page}-{tile}.jpg")
+                sheet.save(path, "JPEG", quality=sprites.QUALITY)
+                with open(path, "rb") as f:
+                    body = f.read()
+                name = f"bench.1.{page}.{tile}.{page:016x}.jpg"
+                meta = json.dumps({"url": f"/sprites/{name}", "tile": tile, "page": page,
+                                   "pages": sprites.page_count(len(self.keys)), "tiles": offsets})
+                self._sheets[(page, tile)] = (meta.encode(), name, body)
+            return self._sheets[(page, tile)]
+
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, library, with_sprites=True):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.library = library
+        self.with_sprites = with_sprites
+        self.bytes_sent = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def count(self, nbytes):
+        with self._lock:
+            self.bytes_sent += nbytes
+            self.requests += 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fixture-server", daemon=True).start()
+        return self
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        lib = self.server.library
+        url = urlsplit(self.path)
+        args = {k: v[0] for k, v in parse_qs(url.query).items()}
+        if url.path == COUNTER:
+            return self._send(json.dumps([self.server.bytes_sent, self.server.requests]).encode(),
+                              "application/json", counted=False)
+        if url.path == ENDPOINT:
+            return self._send(lib.listing, "application/json", etag='W/"bench-1"')
+        if url.path == ENDPOINT + "/sprite" and self.server.with_sprites:
+            page, tile = int(args.get("page", 0)), int(args.get("size", sprites.DEFAULT_TILE))
+            if not 0 <= page < sprites.page_count(len(lib.keys)):
+                return self._send(b'{"error": "Not found"}', "application/json", status=404)
+            meta, _, _ = lib.sprite(page, tile)
+            return self._send(meta, "application/json", etag=f'W/"bench-{page}-{tile}"')
+        m = sprites.NAME_RE.match(url.path[len("/sprites/"):])
+        if url.path.startswith("/sprites/") and m:
+            _, page, tile = m.group(0).split(".")[1:4]
+            _, name, body = lib.sprite(int(page), int(tile))
+            if m.group(0) == name:
+                return self._send(body, "image/jpeg")
+        if url.path.startswith("/uploads/"):
+            key = url.path[len("/uploads/"):]
+            if key in lib.keys:
+                with open(lib.storage.path(key), "rb") as f:
+                    return self._send(f.read(), "image/jpeg")
+        self._send(b'{"error": "Not found"}', "application/json", status=404)
+
+    def _send(self, body, ctype, status=200, etag=None, counted=True):
+        if etag and self.headers.get("If-None-Match") == etag:
+            status, body = 304, b""
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+        if counted:
+            self.server.count(len(body))
+
+    def log_message(self, *args):
+        pass
+
+
+# —— client side (one fresh process per run) ——
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _client(url, mirror, cache, with_sprites, size, out):
+    import api_utils as api
+    import gallery
+    from prefetch import HIGH, NORMAL
+
+    api.API_URL = url
+    api.MIRROR_FILE = mirror
+    payload = base64.urlsafe_b64encode(json.dumps({"id": 1}).encode()).decode().rstrip("=")
+    api.TOKEN = f"bench.{payload}.bench"        # only namespaces the mirror; the fixture ignores it
+    api.prefetcher.bytes_per_s = float("inf")
+
+    def counter():
+        return api.api_get(COUNTER).json()
+
+    if cache == "warm":
+        items = api.api_get(ENDPOINT, auth=True).json()
+        for page in range(sprites.page_count(len(items)) if with_sprites else 0):
+            api.prefetch_sprite(ENDPOINT, size, page, HIGH)
+        for item in [] if with_sprites else items:
+            api.prefetch_image(item["filename"], NORMAL)
+        api.prefetcher.wait_idle(timeout=300)
+
+    base = _peak_rss_mb()
+    sent, requests = counter()
+    start = time.perf_counter()
+    items = api.api_get(ENDPOINT, auth=True).json()
+    first = None
+    for _item, pil in gallery.grid_tiles(ENDPOINT, items, size):
+        if first is None:
+            first = time.perf_counter() - start
+    done = time.perf_counter() - start
+    sent_after, requests_after = counter()
+    out.put((first or done, done, _peak_rss_mb(), base, sent_after - sent, requests_after - requests))
+
+
+def measure(server, cache, size, directory):
+    ctx = mp.get_context("spawn")     # fresh interpreter: no heap or caches left over from earlier runs
+    out = ctx.Queue()
+    mirror = os.path.join(directory, f"mirror-{os.getpid()}-{time.monotonic_ns()}.db")
+    proc = ctx.Process(target=_client, args=(server.url, mirror, cache, server.with_sprites, size, out))
+    proc.start()
+    result = out.get()
+    proc.join()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(mirror + suffix):
+            os.remove(mirror + suffix)
+    return result
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--photos", type=int, default=60)
+    ap.add_argument("--mp", type=float, default=2, help="photo size in megapixels")
+    ap.add_argument("--size", type=int, default=180, help="tile size in px")
+    ap.add_argument("--runs", type=int, default=3)
+    ap.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    ap.add_argument("--dir", default=os.path.join(tempfile.gettempdir(), "insta-client-bench"))
+    args = ap.parse_args(argv)
+    os.makedirs(args.dir, exist_ok=True)
+
+    library = Library(args.dir, args.photos, args.mp)
+    print(f"{args.photos} photos of {args.mp:g} MP, {args.size}px tiles, median of {args.runs} runs")
+    print(f"{'mode':<9}{'cache':<7}{'first tile ms':>14}{'complete ms':>13}"
+          f"{'peak RSS MB':>13}{'+over base':>12}{'KiB sent':>10}{'requests':>10}")
+    for mode in args.modes:
+        server = FixtureServer(library, with_sprites=mode == "sprites").start()
+        try:
+            for cache in CACHES:
+                runs = [measure(server, cache, args.size, args.dir) for _ in range(args.runs)]
+                first, done, peak, base, sent, requests = (statistics.median(col) for col in zip(*runs))
+                print(f"{mode:<9}{cache:<7}{first * 1000:>14.1f}{done * 1000:>13.1f}"
+                      f"{peak:>13.1f}{peak - base:>12.1f}{sent / 1024:>10.0f}{requests:>10.0f}")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# bench/imaging_bench.py
+"""
+Time and peak RSS per thumbnail: naive full decode vs. imaging's scaled decode.
+
+    cd SP && python -m bench.imaging_bench [--mp 12 40] [--runs 5]
+
+Each strategy runs in a fresh process so ru_maxrss is its own peak.
+"""
+import argparse
+import io
+import multiprocessing as mp
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+import imaging
+
+THUMB = 180
+DETAIL = (1152, 648)
+
+
+def make_fixture(directory, megapixels, fmt):
+    w = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    h = int(w * 3 / 4)
+    path = os.path.join(directory, f"fixture_{megapixels}mp.{fmt.lower()}")
+    if not os.path.exists(path):
+        # a gradient plus noise compresses like a photo rather than a flat fill
+        base = Image.linear_gradient("L").resize((w, h))
+        noise = Image.effect_noise((w, h), 40)
+        Image.merge("RGB", (base, noise, base.transpose(Image.FLIP_LEFT_RIGHT))).save(path, fmt, quality=90)
+    return path
+
+
+def naive_thumb(path):
+    with open(path, "rb") as f:
+        pil = Image.open(io.BytesIO(f.read()))
+    w, h = pil.size
+    s = min(w, h)
+    pil = pil.crop(((w - s) // 2, (h - s) // 2, (w + s) // 2, (h + s) // 2))
+    return pil.resize((THUMB, THUMB), Image.LANCZOS)
+
+
+def naive_detail(path):
+    with open(path, "rb") as f:
+        pil = Image.open(io.BytesIO(f.read()))
+    pil.thumbnail(DETAIL, Image.LANCZOS)
+    return pil
+
+
+def scaled_thumb(path):
+    with open(path, "rb") as f:
+        return imaging.square_thumbnail(f, THUMB)
+
+
+def scaled_detail(path):
+    with open(path, "rb") as f:
+        return imaging.fit_within(f, *DETAIL)
+
+
+STRATEGIES = {
+    "naive thumb":  naive_thumb,
+    "scaled thumb": scaled_thumb,
+    "naive detail": naive_detail,
+    "scaled detail": scaled_detail,
+}
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _worker(name, path, runs, out):
+    fn = STRATEGIES[name]
+    base = _peak_rss_mb()
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(path).load()
+        times.append(time.perf_counter() - start)
+    out.put((min(times), sorted(times)[len(times) // 2], _peak_rss_mb(), base))
+
+
+def measure(name, path, runs):
+    ctx = mp.get_context("spawn")     # fresh interpreter: no heap left over from earlier runs
+    out = ctx.Queue()
+    proc = ctx.Process(target=_worker, args=(name, path, runs, out))
+    proc.start()
+    result = out.get()
+    proc.join()
+    return result
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--mp", type=float, nargs="+", default=[12, 40], help="fixture sizes in megapixels")
+    ap.add_argument("--formats", nargs="+", default=["JPEG", "PNG"])
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--dir", default=os.path.join(tempfile.gettempdir(), "insta-imaging-bench"))
+    args = ap.parse_args(argv)
+    os.makedirs(args.dir, exist_ok=True)
+
+    print(f"{'fixture':<28}{'strategy':<15}{'best ms':>9}{'median ms':>11}{'peak RSS MB':>13}{'+over base':>12}")
+    for fmt in args.formats:
+        for megapixels in args.mp:
+            path = make_fixture(args.dir, megapixels, fmt)
+            label = f"{megapixels:g} MP {fmt} ({os.path.getsize(path) // 1024} KiB)"
+            for name in STRATEGIES:
+                best, median, peak, base = measure(name, path, args.runs)
+                print(f"{label:<28}{name:<15}{best * 1000:>9.1f}{median * 1000:>11.1f}"
+                      f"{peak:>13.1f}{peak - base:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# derivatives.py
+import importlib
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image as PILImage
+
+import imaging
+import metrics
+
+try:
+    # imported only for its side effect: registers the AVIF plugin on Pillow < 11.2
+    importlib.import_module("pillow_avif")
+except ImportError:
+    pass
+
+log = logging.getLogger("insta.derivatives")
+
+Format = namedtuple("Format", "variant mimetype pil_format options")
+
+# best first; only formats this Pillow build can encode are used
+FORMATS = [
+    Format("avif", "image/avif", "AVIF", {"quality": 55, "speed": 6}),
+    Format("webp", "image/webp", "WEBP", {"quality": 80, "method": 4}),
+]
+PILImage.init()
+AVAILABLE = [f for f in FORMATS if f.pil_format in PILImage.SAVE]
+
+metrics.REGISTRY.describe("derivative_bytes_saved_total", "counter",
+                          "Bytes saved by modern-format derivatives versus their originals.")
+metrics.REGISTRY.describe("normalize_bytes_total", "counter",
+                          "Bytes of uploads as received versus as served after normalization.")
+metrics.REGISTRY.describe("derivatives_served_total", "counter",
+                          "Responses served from /uploads by negotiated format.")
+
+# the upload exactly as received, kept next to the normalized file; never served
+ARCHIVE_VARIANT = "orig"
+VARIANTS = tuple(f.variant for f in FORMATS) + (ARCHIVE_VARIANT,)     # every file kept next to a key
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="derivatives")
+MAX_BACKLOG = 200       # beyond this new jobs are dropped; the backfill can catch up later
+_backlog = 0
+_backlog_lock = threading.Lock()
+
+
+def generate(storage, key):
+    """Encodes every available modern format next to `key`; keeps only variants that are smaller."""
+    src = storage.path(key)
+    src_size = os.path.getsize(src)
+    with imaging.open_checked(src) as img:
+        orient = imaging.orientation(img)   # derivatives carry no EXIF: rotate the pixels instead
+        img.load()
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+        img = imaging.upright(img, orient)
+        results = {}
+        for fmt in AVAILABLE:
+            dkey = storage.derivative_key(key, fmt.variant)
+            start = time.perf_counter()
+            with storage.writer(dkey, overwrite=True) as fh:
+                img.save(fh, format=fmt.pil_format, **fmt.options)
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(storage.path(dkey))
+            metrics.observe("image_processing_seconds", elapsed, op=f"encode_{fmt.variant}")
+            if size >= src_size:
+                os.remove(storage.path(dkey))
+                log.debug("%s: %s not smaller (%d >= %d), dropped", key, fmt.variant, size, src_size)
+                continue
+            metrics.inc("derivative_bytes_saved_total", src_size - size, format=fmt.variant)
+            log.debug("%s: %s %d -> %d bytes in %.0f ms", key, fmt.variant, src_size, size, elapsed * 1000)
+            results[fmt.variant] = size
+        return results
+
+
+def normalize(storage, staged):
+    """
+    Turns an upload stored as received under `staged` into the file that is
+    served (see imaging.normalized) under a new key, and keeps the received
+    bytes as that key's ARCHIVE_VARIANT. Returns the new key; animations
+    are served as received and keep `staged`.
+    """
+    start = time.perf_counter()
+    prepared = imaging.normalized(storage.path(staged))
+    if prepared is None:
+        return staged
+    img, ext, options = prepared
+    key = storage.new_key(f"upload{ext}")
+    try:
+        with storage.writer(key) as fh:
+            img.save(fh, **options)
+        storage.rename(staged, storage.derivative_key(key, ARCHIVE_VARIANT))
+    except BaseException:
+        storage.delete(key)
+        raise
+    metrics.observe("image_processing_seconds", time.perf_counter() - start, op="normalize")
+    metrics.inc("normalize_bytes_total",
+                os.path.getsize(storage.path(storage.derivative_key(key, ARCHIVE_VARIANT))), file="received")
+    metrics.inc("normalize_bytes_total", os.path.getsize(storage.path(key)), file="served")
+    return key
+
+
+def discard(storage, key):
+    """Drops derivatives of `key`, e.g. before its content is overwritten."""
+    for fmt in FORMATS:
+        try:
+            os.remove(storage.path(storage.derivative_key(key, fmt.variant)))
+        except FileNotFoundError:
+            pass
+
+
+def submit(storage, key):
+    """Generates derivatives off the request thread; originals are served until they exist."""
+    global _backlog
+    with _backlog_lock:
+        if _backlog >= MAX_BACKLOG:
+            metrics.inc("load_shed_total", gate="derivatives")
+            log.warning("derivative backlog full, skipping %s", key)
+            return None
+        _backlog += 1
+
+    def run():
+        global _backlog
+        try:
+            generate(storage, key)
+        except Exception:
+            log.exception("derivative generation failed for %s", key)
+        finally:
+            with _backlog_lock:
+                _backlog -= 1
+    return _executor.submit(run)
+
+
+def negotiate(storage, key, accept_mimetypes):
+    """
+    Returns (key, mimetype) of the best stored variant the client explicitly
+    accepts. A bare */* never selects a modern format, since not every
+    client (e.g. an old Pillow) can decode it.
+    """
+    explicit = {m for m, q in accept_mimetypes if q > 0}
+    for fmt in AVAILABLE:
+        if fmt.mimetype in explicit:
+            dkey = storage.derivative_key(key, fmt.variant)
+            if storage.exists(dkey):
+                metrics.inc("derivatives_served_total", format=fmt.variant)
+                return dkey, fmt.mimetype
+    metrics.inc("derivatives_served_total", format="original")
+    return key, None
@@ -0,0 +1,237 @@
+# events.py
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import defaultdict, deque, namedtuple
+
+import metrics
+
+log = logging.getLogger("insta.events")
+
+HEARTBEAT_S = 15        # comment line so proxies and clients see a live connection
+RETRY_MS = 3000         # reconnect delay suggested to EventSource clients
+BACKLOG = 1000          # events kept by MemoryBroker for Last-Event-ID resume
+RETENTION_S = 3600      # events kept by SQLiteBroker
+POLL_S = 0.25           # how often SQLiteBroker tails the shared file
+QUEUE_MAX = 500         # per connection; a client this far behind is told to resync
+
+Event = namedtuple("Event", "id user_id type data")
+
+metrics.REGISTRY.describe("events_published_total", "counter", "Library events published by type.")
+metrics.REGISTRY.describe("event_streams_open", "gauge", "Open /api/events connections in this process.")
+
+
+class _Subscribers:
+    """This process's open streams: user id -> set of queues."""
+
+    def __init__(self):
+        self._queues = defaultdict(set)
+        self._lock = threading.Lock()
+        self._open = 0
+
+    def add(self, user_id):
+        q = queue.Queue(QUEUE_MAX)
+        q.overflowed = False
+        with self._lock:
+            self._queues[user_id].add(q)
+            self._open += 1
+            metrics.gauge("event_streams_open", self._open)
+        return q
+
+    def remove(self, user_id, q):
+        with self._lock:
+            self._queues[user_id].discard(q)
+            if not self._queues[user_id]:
+                del self._queues[user_id]
+            self._open -= 1
+            metrics.gauge("event_streams_open", self._open)
+
+    def deliver(self, event):
+        with self._lock:
+            targets = list(self._queues.get(event.user_id, ()))
+        for q in targets:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                q.overflowed = True
+
+
+class MemoryBroker:
+    """
+    Single-process pub/sub: publish() hands the event straight to this
+    process's streams and keeps the last BACKLOG events for resuming.
+    Ids are microsecond timestamps, so they keep increasing across restarts
+    and a stale Last-Event-ID is recognised rather than misread.
+    """
+
+    def __init__(self, backlog=BACKLOG):
+        self.subscribers = _Subscribers()
+        self._recent = deque(maxlen=backlog)
+        self._last_id = 0
+        self._horizon = time.time_ns() // 1000     # events up to this id are not kept
+        self._lock = threading.Lock()
+
+    def start(self):
+        pass
+
+    def publish(self, user_id, type, data):
+        with self._lock:
+            self._last_id = max(self._last_id + 1, time.time_ns() // 1000)
+            event = Event(self._last_id, user_id, type, json.dumps(data))
+            if len(self._recent) == self._recent.maxlen:
+                self._horizon = self._recent[0].id
+            self._recent.append(event)
+        self.subscribers.deliver(event)
+        return event
+
+    def since(self, user_id, last_id):
+        """The user's events after last_id, or None if some of them are no longer kept."""
+        with self._lock:
+            if last_id < self._horizon:
+                return None
+            return [e for e in self._recent if e.id > last_id and e.user_id == user_id]
+
+
+class SQLiteBroker:
+    """
+    Pub/sub for several worker processes on one host: events are appended
+    to a shared SQLite file (WAL) and every process tails it on one
+    background thread, fanning new rows out to its own streams. The rows
+    double as the resume log for Last-Event-ID.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS events (
+        id      INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        type    TEXT NOT NULL,
+        data    TEXT NOT NULL,
+        created REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS events_user ON events (user_id, id);
+    """
+
+    def __init__(self, path, retention_s=RETENTION_S, poll_s=POLL_S):
+        self.path = os.path.abspath(path)
+        self.retention_s = retention_s
+        self.poll_s = poll_s
+        self.subscribers = _Subscribers()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        self._db().executescript(self.SCHEMA)
+        self._tail = None
+        self._tail_lock = threading.Lock()
+
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def publish(self, user_id, type, data):
+        body = json.dumps(data)
+        cur = self._db().execute("INSERT INTO events (user_id, type, data, created) VALUES (?, ?, ?, ?)",
+                                 (user_id, type, body, time.time()))
+        return Event(cur.lastrowid, user_id, type, body)      # delivered by the tail thread
+
+    def since(self, user_id, last_id):
+        db = self._db()
+        oldest = db.execute("SELECT MIN(id) FROM events").fetchone()[0]
+        if oldest is None:      # everything pruned: only an up-to-date client missed nothing
+            seq = db.execute("SELECT seq FROM sqlite_sequence WHERE name='events'").fetchone()
+            oldest = (seq[0] if seq else 0) + 1
+        if last_id < oldest - 1:
+            return None
+        rows = db.execute("SELECT id, user_id, type, data FROM events WHERE user_id=? AND id>? ORDER BY id",
+                          (user_id, last_id)).fetchall()
+        return [Event(*row) for row in rows]
+
+    def start(self):
+        """Starts tailing (on the first stream); new events from any process reach local streams."""
+        with self._tail_lock:
+            if self._tail is None:
+                self._tail = threading.Thread(target=self._run, name="event-tail", daemon=True)
+                self._tail.start()
+
+    def _run(self):
+        db = self._db()
+        last = db.execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+        pruned = time.monotonic()
+        while True:
+            time.sleep(self.poll_s)
+            try:
+                rows = db.execute("SELECT id, user_id, type, data FROM events WHERE id>? ORDER BY id",
+                                  (last,)).fetchall()
+                for row in rows:
+                    self.subscribers.deliver(Event(*row))
+                    last = row[0]
+                if time.monotonic() - pruned > 60:
+                    db.execute("DELETE FROM events WHERE created < ?", (time.time() - self.retention_s,))
+                    pruned = time.monotonic()
+            except sqlite3.Error as e:
+                log.warning("event tail: %s", e)
+
+
+def make_broker(spec):
+    """"memory" (default) or "sqlite:<path>" when several worker processes serve one host."""
+    if not spec or spec == "memory":
+        return MemoryBroker()
+    if spec.startswith("sqlite:"):
+        return SQLiteBroker(spec[len("sqlite:"):])
+    raise ValueError(f"unknown event broker: {spec!r}")
+
+
+def publish(broker, user_id, type, **data):
+    metrics.inc("events_published_total", type=type)
+    return broker.publish(user_id, type, data)
+
+
+def _frame(event):
+    return f"id: {event.id}\nevent: {event.type}\ndata: {event.data}\n\n"
+
+
+RESET = "event: reset\ndata: {}\n\n"     # events were missed: reload instead of patching
+
+
+def stream(broker, user_id, last_id=None, heartbeat_s=HEARTBEAT_S):
+    """
+    text/event-stream chunks for one connection: the events after last_id
+    (or a reset when they are gone), then live events, with a comment line
+    every heartbeat_s while nothing happens.
+    """
+    broker.start()
+    q = broker.subscribers.add(user_id)     # before replaying, so nothing falls in between
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        if last_id is not None:
+            missed = broker.since(user_id, last_id)
+            if missed is None:
+                yield RESET
+            else:
+                for event in missed:
+                    yield _frame(event)
+                    last_id = event.id
+        while True:
+            if q.overflowed:
+                q.overflowed = False
+                while not q.empty():
+                    q.get_nowait()
+                yield RESET
+            try:
+                event = q.get(timeout=heartbeat_s)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            if last_id is not None and event.id <= last_id:
+                continue        # already sent while replaying
+            last_id = event.id
+            yield _frame(event)
+    finally:
+        broker.subscribers.remove(user_id, q)
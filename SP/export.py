@@ -0,0 +1,183 @@
+# export.py
+"""
+ZIP archive of a user's library, written on the fly. Entries are stored
+uncompressed (photos are compressed already), so the size of the archive
+and the offset of every byte in it are known before a single file is read:
+that gives a Content-Length, byte ranges for resuming a download, and
+constant memory however large the library is. CRCs follow each file in a
+data descriptor; Zip64 records are used only where sizes or offsets need
+them.
+"""
+import struct
+import zlib
+from collections import namedtuple
+from functools import lru_cache
+
+CHUNK = 1024 * 1024
+FLAGS = 0x0808              # sizes/CRC in a data descriptor, UTF-8 names
+VERSION = 20
+VERSION_ZIP64 = 45
+MAX32 = 0xFFFFFFFF
+MAX16 = 0xFFFF
+EXTERNAL_ATTR = 0o100644 << 16     # regular file, rw-r--r--
+MADE_BY = (3 << 8) | VERSION_ZIP64  # unix, so the attributes above apply
+
+# name in the archive, file path (or None and `data` for an in-memory entry), size, datetime
+Entry = namedtuple("Entry", "name path data size modified")
+
+
+def file_entry(name, path, size, modified):
+    return Entry(name, path, None, size, modified)
+
+
+def bytes_entry(name, data, modified):
+    return Entry(name, None, data, len(data), modified)
+
+
+def _dos_time(dt):
+    if dt is None or dt.year < 1980:
+        return 0, (1 << 5) | 1      # 1980-01-01 00:00
+    return (dt.hour << 11) | (dt.minute << 5) | (dt.second // 2), \
+           ((dt.year - 1980) << 9) | (dt.month << 5) | dt.day
+
+
+@lru_cache(maxsize=65536)
+def _file_crc(path, size):
+    """CRC of a file that isn't being sent (range requests); storage keys are immutable."""
+    crc = 0
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(CHUNK), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+class Archive:
+    """
+    Byte layout of the archive for `entries`; iter_range() produces any
+    slice of it. Every part is either fixed bytes or a file region, except
+    the CRCs, which come from the data as it streams past or, for ranges
+    that skip a file, from reading it.
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self._crcs = {}
+        self._parts = []            # (offset, length, kind, index)
+        self._offsets = []          # local header offset per entry
+        pos = 0
+        for i, e in enumerate(self.entries):
+            self._offsets.append(pos)
+            for kind, length in (("header", len(self._local_header(i))),
+                                 ("data", e.size),
+                                 ("descriptor", 24 if self._large(e) else 16)):
+                self._parts.append((pos, length, kind, i))
+                pos += length
+        self._cd_offset = pos
+        for i in range(len(self.entries)):
+            length = len(self._central_header(i, 0))
+            self._parts.append((pos, length, "central", i))
+            pos += length
+        self._cd_size = pos - self._cd_offset
+        end = self._end_records()
+        self._parts.append((pos, len(end), "end", None))
+        self.size = pos + len(end)
+
+    @staticmethod
+    def _large(e):
+        return e.size >= MAX32
+
+    def _name(self, i):
+        return self.entries[i].name.encode("utf-8")
+
+    def _local_header(self, i):
+        e = self.entries[i]
+        t, d = _dos_time(e.modified)
+        if self._large(e):
+            extra = struct.pack("<HHQQ", 1, 16, e.size, e.size)
+            size32, version = MAX32, VERSION_ZIP64
+        else:
+            extra, size32, version = b"", e.size, VERSION
+        name = self._name(i)
+        return struct.pack("<IHHHHHIIIHH", 0x04034b50, version, FLAGS, 0, t, d, 0,
+                           size32, size32, len(name), len(extra)) + name + extra
+
+    def _descriptor(self, i):
+        e, crc = self.entries[i], self._crc(i)
+        if self._large(e):
+            return struct.pack("<IIQQ", 0x08074b50, crc, e.size, e.size)
+        return struct.pack("<IIII", 0x08074b50, crc, e.size, e.size)
+
+    def _central_header(self, i, crc):
+        e = self.entries[i]
+        t, d = _dos_time(e.modified)
+        offset = self._offsets[i]
+        zip64 = []
+        if self._large(e):
+            zip64 += [e.size, e.size]
+        if offset >= MAX32:
+            zip64.append(offset)
+        extra = struct.pack(f"<HH{len(zip64)}Q", 1, 8 * len(zip64), *zip64) if zip64 else b""
+        size32 = MAX32 if self._large(e) else e.size
+        version = VERSION_ZIP64 if zip64 else VERSION
+        name = self._name(i)
+        return struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50, MADE_BY, version, FLAGS, 0, t, d,
+                           crc, size32, size32, len(name), len(extra), 0, 0, 0, EXTERNAL_ATTR,
+                           min(offset, MAX32)) + name + extra
+
+    def _end_records(self):
+        n, cd_size, cd_offset = len(self.entries), self._cd_size, self._cd_offset
+        out = b""
+        if n >= MAX16 or cd_size >= MAX32 or cd_offset >= MAX32:
+            zip64_end = cd_offset + cd_size
+            out += struct.pack("<IQHHIIQQQQ", 0x06064b50, 44, VERSION_ZIP64, VERSION_ZIP64, 0, 0,
+                               n, n, cd_size, cd_offset)
+            out += struct.pack("<IIQI", 0x07064b50, 0, zip64_end, 1)
+        return out + struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, min(n, MAX16), min(n, MAX16),
+                                 min(cd_size, MAX32), min(cd_offset, MAX32), 0)
+
+    def _crc(self, i):
+        if i not in self._crcs:
+            e = self.entries[i]
+            self._crcs[i] = zlib.crc32(e.data) if e.path is None else _file_crc(e.path, e.size)
+        return self._crcs[i]
+
+    def iter_range(self, start=0, stop=None):
+        """Chunks of archive bytes [start, stop)."""
+        stop = self.size if stop is None else min(stop, self.size)
+        for offset, length, kind, i in self._parts:
+            lo, hi = max(start, offset), min(stop, offset + length)
+            if lo >= hi:
+                continue
+            if kind == "data":
+                yield from self._data(i, lo - offset, hi - offset)
+                continue
+            if kind == "header":
+                blob = self._local_header(i)
+            elif kind == "descriptor":
+                blob = self._descriptor(i)
+            elif kind == "central":
+                blob = self._central_header(i, self._crc(i))
+            else:
+                blob = self._end_records()
+            yield blob[lo - offset:hi - offset]
+
+    def _data(self, i, lo, hi):
+        e = self.entries[i]
+        whole = lo == 0 and hi == e.size
+        if e.path is None:
+            yield e.data[lo:hi]
+            return
+        crc = 0
+        with open(e.path, "rb") as fh:
+            fh.seek(lo)
+            remaining = hi - lo
+            while remaining:
+                chunk = fh.read(min(CHUNK, remaining))
+                if not chunk:
+                    raise OSError(f"{e.path} is shorter than {e.size} bytes")
+                remaining -= len(chunk)
+                if whole:
+                    crc = zlib.crc32(chunk, crc)
+                yield chunk
+        if whole:
+            self._crcs[i] = crc
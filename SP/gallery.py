@@ -0,0 +1,126 @@
+# gallery.py
+"""
+Client image pipeline without Tk: fetch -> decode -> crop/resize -> PIL
+image. Views only wrap the results in PhotoImage, so the same code runs
+headless in bench.client_bench.
+"""
+from PIL import Image
+
+import api_utils as api
+import imaging
+import placeholders
+
+THUMB_SIZE = 180
+TILE_COLOR = "#ddd"
+
+
+def placeholder(w, h, color=TILE_COLOR):
+    """Grey stand-in for an image that can't be fetched or decoded (e.g. offline)."""
+    return Image.new("RGB", (w, h), color)
+
+
+def preview(item, max_w, max_h, crop=False):
+    """
+    Stand-in painted from the listing alone, before the image is fetched:
+    the item's BlurHash, else its average colour, else grey. Sized as the
+    real image will be (fitted into max_w x max_h, or filling it with crop=True).
+    """
+    w, h = item.get("width") or max_w, item.get("height") or max_h
+    if crop:
+        out = (max_w, max_h)
+    else:
+        scale = min(max_w / w, max_h / h, 1.0)
+        out = (max(1, round(w * scale)), max(1, round(h * scale)))
+    if item.get("blurhash"):
+        long_side = placeholders.DECODE_SIZE
+        size = (long_side, max(1, round(long_side * h / w))) if w >= h \
+            else (max(1, round(long_side * w / h)), long_side)
+        try:
+            blur = placeholders.decode(item["blurhash"], *size)
+        except ValueError:
+            blur = None
+        if blur is not None:
+            if crop:        # centre, to the box's aspect, as square_thumbnail does
+                bw, bh = blur.size
+                cw, ch = min(bw, round(bh * out[0] / out[1])), min(bh, round(bw * out[1] / out[0]))
+                blur = blur.crop(((bw - cw) // 2, (bh - ch) // 2, (bw + cw) // 2, (bh + ch) // 2))
+            return blur.resize(out, Image.BILINEAR)
+    try:
+        return placeholder(*out, item.get("color") or TILE_COLOR)
+    except ValueError:          # not a colour PIL understands
+        return placeholder(*out)
+
+
+def _fetched(resp, render):
+    if resp.status_code != 200:
+        resp.close()
+        return None
+    try:
+        return render(imaging.spool(resp))
+    except (OSError, imaging.ImageTooLarge):
+        return None
+
+
+def thumbnail(filename, size=THUMB_SIZE):
+    """Square thumbnail of one upload, or None."""
+    return _fetched(api.fetch_image(filename, stream=True),
+                    lambda fp: imaging.square_thumbnail(fp, size))
+
+
+def detail(filename, max_w, max_h):
+    """Upload scaled to fit max_w x max_h, or None."""
+    return _fetched(api.fetch_image(filename, stream=True),
+                    lambda fp: imaging.fit_within(fp, max_w, max_h))
+
+
+class SpriteSheets:
+    """
+    Thumbnails cut from the server's sprite sheets of a listing endpoint:
+    one request and one decode per page instead of per photo. Pages are
+    fetched only when a tile on them is asked for.
+    """
+
+    def __init__(self, endpoint, size=THUMB_SIZE):
+        self.endpoint = endpoint
+        self.size = size
+        self.tiles = {}
+        self.page = 0
+        self.pages = 1          # known after the first map
+        self.failed = False
+
+    def tile(self, filename):
+        while filename not in self.tiles and self.page < self.pages and not self.failed:
+            self.failed = not self._load_page()
+        return self.tiles.pop(filename, None)      # cropped copies; don't hold them twice
+
+    def _load_page(self):
+        resp = api.api_get(f"{self.endpoint}/sprite?page={self.page}&size={self.size}", auth=True)
+        if not resp.ok:
+            return False
+        meta = resp.json()
+        sr = api.fetch_sprite(meta["url"], stream=True)
+        sheet = _fetched(sr, lambda fp: imaging.open_checked(fp))
+        if sheet is None:
+            return False
+        with sheet:
+            try:
+                sheet.load()
+            except OSError:
+                return False
+            size = meta["tile"]
+            for name, (x, y) in meta["tiles"].items():
+                self.tiles[name] = sheet.crop((x, y, x + size, y + size))
+        self.pages = meta["pages"]
+        self.page += 1
+        return True
+
+
+def grid_tiles(endpoint, items, size=THUMB_SIZE):
+    """
+    (item, thumbnail) for a listing in order: from sprite sheets where
+    possible, else fetched one by one, else None (keep the preview). A
+    generator, so the first tile can be shown before later pages are fetched.
+    """
+    sheets = SpriteSheets(endpoint, size)
+    for item in items:
+        yield item, sheets.tile(item["filename"]) or thumbnail(item["filename"], size)
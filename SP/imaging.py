@@ -0,0 +1,178 @@
+# imaging.py
+import io
+import math
+import tempfile
+
+from PIL import Image
+
+try:
+    from PIL import ImageCms
+except ImportError:     # Pillow built without littlecms
+    ImageCms = None
+
+# 50 MP is well above any phone camera; larger "images" are treated as decompression bombs.
+MAX_PIXELS         = 50_000_000
+MAX_DOWNLOAD_BYTES = 64 * 1024 * 1024
+SPOOL_IN_MEMORY    = 4 * 1024 * 1024
+CHUNK              = 64 * 1024
+JPEG_QUALITY       = 85
+RGB_MODES          = ("RGB", "RGBA", "P", "PA")    # pixels already in an RGB profile's space
+
+ORIENTATION = 0x0112
+# EXIF orientation -> transpose that makes the image upright (as ImageOps.exif_transpose)
+UPRIGHT = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+SIDEWAYS = (5, 6, 7, 8)
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def open_checked(fp, max_pixels=MAX_PIXELS):
+    """Opens lazily (header only) and rejects images above `max_pixels` before any decoding."""
+    img = Image.open(fp)
+    w, h = img.size
+    if w * h > max_pixels:
+        img.close()
+        raise ImageTooLarge(f"{w}x{h} exceeds {max_pixels} pixels")
+    return img
+
+
+def check_pixels(fp, max_pixels=MAX_PIXELS):
+    """Returns (width, height) of a valid image within the pixel limit."""
+    with open_checked(fp, max_pixels) as img:
+        return img.size
+
+
+def open_scaled(fp, target, max_pixels=MAX_PIXELS):
+    """Decodes at the smallest scale that still covers `target` (w, h)."""
+    return _scale(open_checked(fp, max_pixels), *target)
+
+
+def _scale(img, tw, th):
+    # JPEGs use DCT draft mode (1/2, 1/4, 1/8 scale straight from the decoder);
+    # other formats are box-reduced by an integer factor right after decoding.
+    tw, th = max(1, tw), max(1, th)
+    if img.format == "JPEG":
+        img.draft(img.mode, (tw, th))
+    img.load()
+    factor = min(img.width // tw, img.height // th)
+    if factor >= 2:
+        img = _displayable(img).reduce(factor)    # reduce() rejects palette images
+    return img
+
+
+def orientation(img):
+    """EXIF orientation of an opened image (1 when absent); read before any scaling drops it."""
+    try:
+        return img.getexif().get(ORIENTATION, 1)
+    except Exception:       # malformed EXIF shouldn't make the image unreadable
+        return 1
+
+
+def upright(img, orient):
+    method = UPRIGHT.get(orient)
+    return img.transpose(method) if method is not None else img
+
+
+def square_thumbnail(fp, size, max_pixels=MAX_PIXELS):
+    """Centre-cropped size x size thumbnail, upright."""
+    img = open_checked(fp, max_pixels)
+    orient = orientation(img)
+    w, h = img.size
+    s = min(w, h)
+    # keep the short side >= size after scaled decoding
+    img = _scale(img, math.ceil(size * w / s), math.ceil(size * h / s))
+    w, h = img.size
+    s = min(w, h)
+    img = img.crop(((w - s) // 2, (h - s) // 2, (w + s) // 2, (h + s) // 2))
+    return _displayable(upright(img.resize((size, size), Image.LANCZOS), orient))
+
+
+def fit_within(fp, max_w, max_h, max_pixels=MAX_PIXELS):
+    """Scaled down (never up) to fit max_w x max_h as displayed (upright), aspect ratio preserved."""
+    img = open_checked(fp, max_pixels)
+    orient = orientation(img)
+    if orient in SIDEWAYS:          # fit the stored (unrotated) pixels into the rotated box
+        max_w, max_h = max_h, max_w
+    w, h = img.size
+    scale = min(max_w / w, max_h / h, 1.0)
+    img = _scale(img, math.ceil(w * scale), math.ceil(h * scale))
+    img.thumbnail((max_w, max_h), Image.LANCZOS)
+    return _displayable(upright(img, orient))
+
+
+def normalized(fp, max_pixels=MAX_PIXELS):
+    """
+    Fully decoded, upright copy for serving: (image, extension, save
+    options). Progressive JPEG, or PNG when there is transparency; EXIF,
+    XMP and embedded thumbnails are left behind. An RGB ICC profile is
+    kept; other colour spaces (CMYK, greyscale) are converted to sRGB
+    through their profile, which is then dropped.
+    Returns None for animations, which are served as uploaded.
+    """
+    img = open_checked(fp, max_pixels)
+    if getattr(img, "is_animated", False):
+        img.close()
+        return None
+    orient = orientation(img)
+    icc = img.info.get("icc_profile")
+    alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+    mode = "RGBA" if alpha else "RGB"
+    converted = None
+    if img.mode not in RGB_MODES:
+        if icc:
+            converted = _to_srgb(img, icc, mode)
+        icc = None      # a CMYK or grey profile would misdescribe RGB pixels
+    img = upright(converted or img.convert(mode), orient)
+    options = {"icc_profile": icc} if icc else {}
+    if alpha:
+        return img, ".png", {"format": "PNG", "optimize": True, **options}
+    return img, ".jpg", {"format": "JPEG", "quality": JPEG_QUALITY, "progressive": True,
+                         "optimize": True, **options}
+
+
+def _to_srgb(img, icc, mode):
+    """`img` converted to `mode` in sRGB through its ICC profile; None if littlecms can't."""
+    if ImageCms is None:
+        return None
+    try:
+        return ImageCms.profileToProfile(img, ImageCms.ImageCmsProfile(io.BytesIO(icc)),
+                                         ImageCms.createProfile("sRGB"), outputMode=mode)
+    except (ImageCms.PyCMSError, OSError, ValueError):
+        return None
+
+
+def _displayable(img):
+    if img.mode not in ("RGB", "RGBA", "L"):
+        img = img.convert("RGBA" if "transparency" in img.info else "RGB")
+    return img
+
+
+def spool(resp, max_bytes=MAX_DOWNLOAD_BYTES):
+    """
+    Streams a `requests` response (opened with stream=True) into a seekable
+    file, kept in memory up to SPOOL_IN_MEMORY and on disk beyond, without
+    the extra full copy that resp.content + BytesIO makes.
+    """
+    buf = tempfile.SpooledTemporaryFile(max_size=SPOOL_IN_MEMORY)
+    total = 0
+    try:
+        for chunk in resp.iter_content(CHUNK):
+            total += len(chunk)
+            if total > max_bytes:
+                buf.close()
+                raise ImageTooLarge(f"download exceeds {max_bytes} bytes")
+            buf.write(chunk)
+    finally:
+        resp.close()
+    buf.seek(0)
+    return buf
@@ -0,0 +1,163 @@
+# ingest.py
+"""
+Process-pool side of the `flask ingest` / `flask backfill` commands.
+Workers only read and write media files; the parent owns the database
+session and writes each batch of results in one transaction.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import derivatives
+import imaging
+import metadata
+import phash
+import placeholders
+from storage import MediaStorage
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff")
+BATCH_SIZE = 256
+REPORT_EVERY_S = 5.0
+
+_storage = None
+
+
+def _init_worker(root):
+    global _storage
+    _storage = MediaStorage(root, derivatives.VARIANTS)
+
+
+def analyse(key, with_derivatives=True):
+    """
+    Reads stored `key` for dimensions/EXIF, its dHash and placeholder, then
+    generates derivatives unless they exist. Returns
+    {'filename', 'bytes', 'values': column values, 'error': str | None}.
+    """
+    path = _storage.path(key)
+    result = {'filename': key, 'bytes': 0, 'values': {}, 'error': None}
+    try:
+        result['bytes'] = os.path.getsize(path)
+        with imaging.open_checked(path) as img:
+            values = metadata.extract(img)
+            values['phash'] = phash.to_hex(phash.dhash(img))
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+        return result
+    values.update(placeholders.describe(path))
+    result['values'] = values
+    if with_derivatives and not any(_storage.exists(_storage.derivative_key(key, f.variant))
+                                    for f in derivatives.FORMATS):
+        try:
+            derivatives.generate(_storage, key)
+        except Exception as e:       # the row is still worth keeping without them
+            result['error'] = f"derivatives: {type(e).__name__}: {e}"
+    return result
+
+
+def import_file(src, with_derivatives=True):
+    """
+    Copies `src` into storage, reads its EXIF, normalizes it like an upload
+    (derivatives.normalize) and analyses the served file; nothing is left
+    in storage if it is unusable.
+    """
+    staged = _storage.new_key(src)
+    try:
+        size = os.path.getsize(src)
+        with open(src, "rb") as fh:
+            _storage.save(staged, fh)
+        with imaging.open_checked(_storage.path(staged)) as img:
+            exif = metadata.extract(img)
+        key = derivatives.normalize(_storage, staged)
+    except Exception as e:
+        _storage.delete(staged)
+        return {'filename': None, 'source': src, 'bytes': 0, 'values': {},
+                'error': f"{type(e).__name__}: {e}"}
+    result = analyse(key, with_derivatives)
+    if result['values']:
+        result['values'].update({k: v for k, v in exif.items() if v is not None})
+    else:
+        _storage.delete(key)
+        result['filename'] = None
+    result['bytes'] = size
+    result['source'] = src
+    return result
+
+
+def walk(directory, after=None):
+    """
+    Image files under `directory` as paths relative to it, in a stable
+    (lexicographic per path component) order; `after` skips everything up
+    to and including that path, which is how an import resumes.
+    """
+    after_parts = tuple(after.split("/")) if after else None
+
+    def visit(rel):
+        entries = sorted(os.scandir(os.path.join(directory, *rel)), key=lambda e: e.name)
+        for entry in entries:
+            parts = rel + (entry.name,)
+            if entry.is_dir(follow_symlinks=False):
+                if after_parts is None or parts >= after_parts[:len(parts)]:
+                    yield from visit(parts)
+            elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                if after_parts is None or parts > after_parts:
+                    yield "/".join(parts)
+
+    yield from visit(())
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run(fn, batches, storage_root, workers, on_batch, arg=lambda item: item, with_derivatives=True):
+    """
+    Runs fn(arg(item)) for every item of every batch in a process pool and
+    calls on_batch(batch, results) in the parent, in order. The next batch
+    is already being worked on while the previous one is written, so the
+    pool doesn't idle during commits.
+    """
+    job = partial(fn, with_derivatives=with_derivatives)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(storage_root,)) as pool:
+        in_flight = None
+        for batch in batches:
+            futures = [pool.submit(job, arg(item)) for item in batch]
+            if in_flight:
+                on_batch(in_flight[0], [f.result() for f in in_flight[1]])
+            in_flight = (batch, futures)
+        if in_flight:
+            on_batch(in_flight[0], [f.result() for f in in_flight[1]])
+
+
+class Throughput:
+    """Running totals, echoed at most every REPORT_EVERY_S seconds and once at the end."""
+
+    def __init__(self, echo):
+        self.echo = echo
+        self.started = self.reported = time.monotonic()
+        self.done = self.failed = self.bytes = 0
+
+    def add(self, results):
+        for r in results:
+            self.bytes += r['bytes']
+            if r['values']:
+                self.done += 1
+            else:
+                self.failed += 1
+        if time.monotonic() - self.reported >= REPORT_EVERY_S:
+            self.report()
+
+    def report(self, final=False):
+        self.reported = time.monotonic()
+        elapsed = max(self.reported - self.started, 1e-6)
+        self.echo(f"{'done' if final else '...'} {self.done} files, {self.failed} failed in "
+                  f"{elapsed:.0f}s: {self.done / elapsed:.1f} files/s, "
+                  f"{self.bytes / elapsed / 1e6:.1f} MB/s")
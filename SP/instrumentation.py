@@ -0,0 +1,151 @@
+# instrumentation.py
+import atexit
+import functools
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+HEARTBEAT_MS       = 50
+STALL_THRESHOLD_MS = 100
+
+VIEW_METHODS = {
+    "views.main_view.MainView":       ("_show",),
+    "views.profile_view.ProfileFeed": ("__init__", "refresh", "_build_image_grid", "_open_album",
+                                       "_open_image_detail", "_build_album_view"),
+    "views.home_view.HomeFeed":       ("__init__", "_load_page", "_search"),
+}
+
+
+class Profiler:
+    """Measures Tk event-loop lag with an after() heartbeat and times named spans."""
+
+    def __init__(self, heartbeat_ms=HEARTBEAT_MS, stall_ms=STALL_THRESHOLD_MS):
+        self.heartbeat_ms = heartbeat_ms
+        self.stall_ms = stall_ms
+        self.durations = defaultdict(list)   # span name -> [seconds]
+        self.finished = []                   # (name, start, end) on the Tk thread
+        self.stalls = []                     # (at, lag_ms, [(name, ms)])
+        self.lags = []
+        self._lock = threading.Lock()
+        self._root = None
+        self._last_tick = None
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.durations[name].append(end - start)
+                if threading.current_thread() is threading.main_thread():
+                    self.finished.append((name, start, end))
+
+    def wrap(self, name, fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with self.span(name):
+                return fn(*args, **kwargs)
+        wrapper.__instrumented__ = True
+        return wrapper
+
+    def instrument(self, cls, *methods):
+        for meth in methods:
+            fn = getattr(cls, meth)
+            if getattr(fn, "__instrumented__", False):
+                continue
+            setattr(cls, meth, self.wrap(f"{cls.__name__}.{meth}", fn))
+
+    def instrument_network(self):
+        import requests
+        send = requests.sessions.Session.request
+        if getattr(send, "__instrumented__", False):
+            return
+        profiler = self
+
+        @functools.wraps(send)
+        def request(session, method, url, *args, **kwargs):
+            with profiler.span(f"net {method.upper()} {_route(url)}"):
+                return send(session, method, url, *args, **kwargs)
+        request.__instrumented__ = True
+        requests.sessions.Session.request = request
+
+    def start_heartbeat(self, root):
+        self._root = root
+        self._last_tick = time.perf_counter()
+        root.after(self.heartbeat_ms, self._tick)
+
+    def _tick(self):
+        now = time.perf_counter()
+        lag_ms = max(0.0, (now - self._last_tick) * 1000 - self.heartbeat_ms)
+        with self._lock:
+            self.lags.append(lag_ms)
+            if lag_ms >= self.stall_ms:
+                window = [(n, (e - s) * 1000) for n, s, e in self.finished if e >= self._last_tick]
+                window.sort(key=lambda item: item[1], reverse=True)
+                self.stalls.append((now - self._started, lag_ms, window[:5]))
+            self.finished.clear()
+        self._last_tick = now
+        try:
+            self._root.after(self.heartbeat_ms, self._tick)
+        except Exception:
+            pass    # root destroyed
+
+    def report(self, out=None):
+        out = out or sys.stderr
+        with self._lock:
+            lags = sorted(self.lags)
+            print("\n=== InstaDesktop UI profile ===", file=out)
+            print(f"session {time.perf_counter() - self._started:.1f} s, "
+                  f"{len(lags)} heartbeats, {len(self.stalls)} stalls >= {self.stall_ms} ms", file=out)
+            if lags:
+                print(f"event-loop lag  p50 {_pct(lags, 50):.1f} ms  p95 {_pct(lags, 95):.1f} ms  "
+                      f"max {lags[-1]:.1f} ms  frozen {sum(l for l in lags if l >= self.stall_ms) / 1000:.2f} s",
+                      file=out)
+
+            if self.durations:
+                print(f"\n{'span':<48}{'n':>5}{'total ms':>11}{'mean':>9}{'p95':>9}{'max':>9}", file=out)
+                rows = sorted(self.durations.items(), key=lambda kv: sum(kv[1]), reverse=True)
+                for name, ds in rows:
+                    ms = sorted(d * 1000 for d in ds)
+                    print(f"{name[:47]:<48}{len(ms):>5}{sum(ms):>11.1f}{sum(ms) / len(ms):>9.1f}"
+                          f"{_pct(ms, 95):>9.1f}{ms[-1]:>9.1f}", file=out)
+
+            if self.stalls:
+                print("\nstalls:", file=out)
+                for at, lag, culprits in self.stalls:
+                    cause = ", ".join(f"{n} {ms:.0f} ms" for n, ms in culprits) or "unattributed"
+                    print(f"  +{at:7.2f}s  {lag:7.1f} ms  {cause}", file=out)
+
+
+def _pct(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def _route(url):
+    parts = urlsplit(url)
+    path = parts.path or "/"
+    if path.startswith("/uploads/"):
+        path = "/uploads/*"
+    return parts.netloc + re.sub(r"/\d+(?=/|$)", "/:id", path)
+
+
+def enable(heartbeat_ms=HEARTBEAT_MS, stall_ms=STALL_THRESHOLD_MS):
+    """Instruments view builders and HTTP calls; call before the first view is created."""
+    import importlib
+    profiler = Profiler(heartbeat_ms, stall_ms)
+    for path, methods in VIEW_METHODS.items():
+        module, cls = path.rsplit(".", 1)
+        profiler.instrument(getattr(importlib.import_module(module), cls), *methods)
+    profiler.instrument_network()
+    atexit.register(profiler.report)
+    return profiler
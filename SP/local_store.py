@@ -0,0 +1,139 @@
+# local_store.py
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+Doc = namedtuple("Doc", "etag body synced_at stale")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    account   TEXT NOT NULL,
+    route     TEXT NOT NULL,
+    etag      TEXT,
+    body      BLOB NOT NULL,
+    synced_at REAL NOT NULL,
+    stale     INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (account, route)
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    account    TEXT NOT NULL,
+    idem_key   TEXT NOT NULL UNIQUE,
+    method     TEXT NOT NULL,
+    route      TEXT NOT NULL,
+    json_body  TEXT,
+    form       TEXT,
+    file_path  TEXT,
+    file_name  TEXT,
+    created_at REAL NOT NULL,
+    attempts   INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT
+);
+"""
+
+
+class LocalStore:
+    """
+    Client-side SQLite file holding
+      * documents: the last JSON body (and ETag) of each mirrored GET route,
+        per account, so views can render without the server, and
+      * outbox: writes not yet acknowledged by the server, replayed in order
+        with their original Idempotency-Key.
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.files_dir = self.path + ".outbox"
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def _q(self, sql, args=()):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    # —— mirror ——
+
+    def get(self, account, route):
+        rows = self._q("SELECT etag, body, synced_at, stale FROM documents WHERE account=? AND route=?",
+                       (account, route))
+        return Doc(rows[0][0], bytes(rows[0][1]), rows[0][2], bool(rows[0][3])) if rows else None
+
+    def put(self, account, route, etag, body):
+        self._q("INSERT OR REPLACE INTO documents (account, route, etag, body, synced_at, stale) "
+                "VALUES (?, ?, ?, ?, ?, 0)", (account, route, etag, body, time.time()))
+
+    def touch(self, account, route):
+        self._q("UPDATE documents SET synced_at=?, stale=0 WHERE account=? AND route=?",
+                (time.time(), account, route))
+
+    def mark_stale(self, account):
+        self._q("UPDATE documents SET stale=1 WHERE account=?", (account,))
+
+    def routes(self, account):
+        return [r[0] for r in self._q("SELECT route FROM documents WHERE account=? ORDER BY route",
+                                      (account,))]
+
+    def forget(self, account):
+        self._q("DELETE FROM documents WHERE account=?", (account,))
+
+    def forget_variants(self, account, prefix, suffix, keep):
+        """Drops the documents whose route starts with `prefix` and ends with `suffix`, except `keep`."""
+        self._q("DELETE FROM documents WHERE account=? AND substr(route, 1, ?)=? AND substr(route, -?)=? "
+                "AND route<>?", (account, len(prefix), prefix, len(suffix), suffix, keep))
+
+    # —— outbox ——
+
+    def enqueue(self, account, method, route, json_body=None, form=None, file_path=None):
+        key = uuid.uuid4().hex
+        file_name = os.path.basename(file_path) if file_path else None
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO outbox (account, idem_key, method, route, json_body, form, file_path, "
+                "file_name, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (account, key, method, route,
+                 json.dumps(json_body) if json_body is not None else None,
+                 json.dumps(form) if form is not None else None,
+                 file_path, file_name, time.time()))
+            return cur.lastrowid
+
+    def pending(self, account):
+        rows = self._q("SELECT id, idem_key, method, route, json_body, form, file_path, file_name, attempts "
+                       "FROM outbox WHERE account=? ORDER BY id", (account,))
+        return [{
+            "id": r[0], "idem_key": r[1], "method": r[2], "route": r[3],
+            "json": json.loads(r[4]) if r[4] else None,
+            "form": json.loads(r[5]) if r[5] else None,
+            "file_path": r[6], "file_name": r[7], "attempts": r[8],
+        } for r in rows]
+
+    def keep_file(self, entry):
+        """Copies a queued upload into the store so the write survives the original being moved."""
+        src = entry["file_path"]
+        if not src or os.path.dirname(os.path.abspath(src)) == self.files_dir:
+            return
+        os.makedirs(self.files_dir, exist_ok=True)
+        dst = os.path.join(self.files_dir, entry["idem_key"])
+        shutil.copyfile(src, dst)
+        entry["file_path"] = dst
+        self._q("UPDATE outbox SET file_path=? WHERE id=?", (dst, entry["id"]))
+
+    def record_failure(self, entry, error):
+        self._q("UPDATE outbox SET attempts=attempts+1, last_error=? WHERE id=?",
+                (str(error)[:500], entry["id"]))
+
+    def remove(self, entry):
+        self._q("DELETE FROM outbox WHERE id=?", (entry["id"],))
+        path = entry.get("file_path")
+        if path and os.path.dirname(os.path.abspath(path)) == self.files_dir:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,180 @@
+# media_gc.py
+import datetime
+import logging
+import os
+import threading
+import time
+
+from storage import TMP_PREFIX
+
+log = logging.getLogger("insta.gc")
+
+BATCH_SIZE      = 200
+MAX_BACKOFF_S   = 3600
+ORPHAN_GRACE_S  = 3600          # never touch files younger than this (upload in flight)
+RECONCILE_EVERY = 6 * 3600
+
+
+def _now():
+    return datetime.datetime.utcnow()
+
+
+class MediaCollector:
+    """
+    Reclaims files of soft-deleted media in the background.
+
+    Deletions only write tombstones inside the request transaction; this
+    collector removes the files (and derivatives), then the rows. Failures
+    are retried with exponential backoff. Every RECONCILE_EVERY seconds it
+    also walks the storage root and removes files no row refers to.
+    Removal is idempotent, so several workers may run collectors at once.
+    """
+
+    def __init__(self, app, db, storage, tombstone, image_model, album_model, membership_model,
+                 interval=30, protected_prefixes=("profile_",)):
+        self.app = app
+        self.db = db
+        self.storage = storage
+        self.Tombstone = tombstone
+        self.Album = album_model
+        self.Membership = membership_model
+        self.media_models = (image_model,)
+        self.interval = interval
+        self.protected_prefixes = tuple(protected_prefixes)
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_reconcile = 0.0
+        self._tasks = []
+
+    def add_task(self, fn):
+        """Extra housekeeping run on every pass, after collection, in its own app context and transaction."""
+        self._tasks.append(fn)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="media-gc", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+
+    def wake(self):
+        """Runs a collection pass now instead of waiting for the next interval."""
+        self.start()
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.collect_once()
+                if time.time() - self._last_reconcile >= RECONCILE_EVERY:
+                    self.reconcile()
+                    self._last_reconcile = time.time()
+            except Exception:
+                log.exception("media gc pass failed")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def collect_once(self):
+        with self.app.app_context():
+            session = self.db.session
+            due = self.Tombstone.query\
+                      .filter(self.Tombstone.next_attempt_at <= _now())\
+                      .order_by(self.Tombstone.id)\
+                      .limit(BATCH_SIZE).all()
+            purged = []
+            for tomb in due:
+                try:
+                    self.storage.delete(tomb.key)
+                    purged.append(tomb.key)
+                    session.delete(tomb)
+                except Exception as e:
+                    tomb.attempts += 1
+                    tomb.last_error = str(e)[:500]
+                    delay = min(MAX_BACKOFF_S, 2 ** tomb.attempts * self.interval)
+                    tomb.next_attempt_at = _now() + datetime.timedelta(seconds=delay)
+                    log.warning("could not remove %s (attempt %d): %s", tomb.key, tomb.attempts, e)
+            for model in self.media_models:
+                if purged:
+                    model.query.filter(model.filename.in_(purged),
+                                       model.deleted_at.isnot(None))\
+                               .delete(synchronize_session=False)
+            self._purge_empty_albums()
+            session.commit()
+        for task in self._tasks:
+            self._run_task(task)
+        return len(purged)
+
+    def _run_task(self, task):
+        # each task commits on its own, so a failing one can't undo the pass or the other tasks
+        with self.app.app_context():
+            try:
+                task()
+                self.db.session.commit()
+            except Exception:
+                self.db.session.rollback()
+                log.exception("housekeeping task %s failed", getattr(task, "__name__", task))
+
+    def _purge_empty_albums(self):
+        has_images = self.db.session.query(self.Membership.id)\
+                         .filter(self.Membership.album_id == self.Album.id).exists()
+        empty = self.Album.query.filter(self.Album.deleted_at.isnot(None)).filter(~has_images)
+        for alb in empty.limit(BATCH_SIZE).all():
+            self.db.session.delete(alb)
+
+    def reconcile(self):
+        """Removes stored files that are older than the grace period and referenced by no row."""
+        cutoff = time.time() - ORPHAN_GRACE_S
+        removed = 0
+        with self.app.app_context():
+            for directory, _dirs, files in os.walk(self.storage.root):
+                candidates = {}
+                for name in files:
+                    path = os.path.join(directory, name)
+                    try:
+                        if os.path.getmtime(path) > cutoff:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    if name.startswith(TMP_PREFIX):
+                        removed += _unlink(path)
+                    elif not name.startswith(self.protected_prefixes):
+                        candidates[name] = path
+                if not candidates:
+                    continue
+                referenced = self._referenced(set().union(*(_prefixes(n) for n in candidates)))
+                for name, path in candidates.items():
+                    if referenced.isdisjoint(_prefixes(name)):
+                        removed += _unlink(path)
+        if removed:
+            log.info("reconcile removed %d orphaned files", removed)
+        return removed
+
+    def _referenced(self, names):
+        names = list(names)
+        found = set()
+        for i in range(0, len(names), 500):
+            chunk = names[i:i + 500]
+            for model in self.media_models:
+                found.update(r[0] for r in self.db.session.query(model.filename)
+                                                  .filter(model.filename.in_(chunk)))
+        return found
+
+
+def _prefixes(name):
+    """Every key `name` could be a derivative of: a.jpg.webp -> {a, a.jpg, a.jpg.webp}."""
+    parts = name.split(".")
+    return {".".join(parts[:i]) for i in range(1, len(parts) + 1)}
+
+
+def _unlink(path):
+    try:
+        os.remove(path)
+        return 1
+    except OSError:
+        return 0
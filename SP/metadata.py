@@ -0,0 +1,76 @@
+# metadata.py
+import datetime
+
+# EXIF tag ids (see PIL.ExifTags); numeric so older Pillows work too
+ORIENTATION        = 0x0112
+DATETIME           = 0x0132
+EXIF_IFD           = 0x8769
+GPS_IFD            = 0x8825
+DATETIME_ORIGINAL  = 0x9003
+GPS_LAT_REF, GPS_LAT, GPS_LON_REF, GPS_LON = 1, 2, 3, 4
+
+EXIF_TIME_FORMAT   = "%Y:%m:%d %H:%M:%S"
+CLIENT_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def extract(img):
+    """
+    Column values for an opened image (only the header is read):
+    displayed width/height, taken_at (naive, camera local time) and
+    location as "lat,lon"; unknown values are None.
+    """
+    exif = img.getexif()
+    w, h = img.size
+    if exif.get(ORIENTATION) in (5, 6, 7, 8):     # rotated 90°: shown as h x w
+        w, h = h, w
+    return {
+        'width': w,
+        'height': h,
+        'taken_at': _taken_at(exif),
+        'location': _location(exif),
+    }
+
+
+def _taken_at(exif):
+    raw = exif.get_ifd(EXIF_IFD).get(DATETIME_ORIGINAL) or exif.get(DATETIME)
+    return parse_time(raw, EXIF_TIME_FORMAT)
+
+
+def parse_time(raw, fmt=CLIENT_TIME_FORMAT):
+    if not isinstance(raw, str):
+        return None
+    try:
+        return datetime.datetime.strptime(raw.strip("\x00 "), fmt)
+    except ValueError:
+        return None
+
+
+def _location(exif):
+    gps = exif.get_ifd(GPS_IFD)
+    try:
+        lat = _degrees(gps[GPS_LAT], gps.get(GPS_LAT_REF, "N") == "S")
+        lon = _degrees(gps[GPS_LON], gps.get(GPS_LON_REF, "E") == "W")
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        return None
+    return format_location(lat, lon)
+
+
+def _degrees(dms, negative):
+    d, m, s = (float(v) for v in dms)
+    value = d + m / 60 + s / 3600
+    return -value if negative else value
+
+
+def format_location(lat, lon):
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return f"{lat:.6f},{lon:.6f}"
+
+
+def parse_location(text):
+    """Validated "lat,lon" from client input, else None."""
+    try:
+        lat, lon = (float(v) for v in (text or "").split(",", 1))
+    except ValueError:
+        return None
+    return format_location(lat, lon)
@@ -0,0 +1,214 @@
+# metrics.py
+import hmac
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS   = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+LOOPBACK        = ("127.0.0.1", "::1")
+
+slow_log = logging.getLogger("insta.slow")
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+class Registry:
+    """Thread-safe store of counters, gauges and histograms rendered in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._types = {}
+        self._help = {}
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._histograms = {}
+
+    def describe(self, name, kind, text):
+        self._types[name] = kind
+        self._help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._types.setdefault(name, "counter")
+            self._counters[key] += value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._types.setdefault(name, "gauge")
+            self._gauges[key] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._types.setdefault(name, "histogram")
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+    def render(self):
+        with self._lock:
+            series = defaultdict(list)
+            for (name, labels), value in self._counters.items():
+                series[name].append((name, labels, value))
+            for (name, labels), value in self._gauges.items():
+                series[name].append((name, labels, value))
+            for (name, labels), hist in self._histograms.items():
+                for bound, n in zip(hist.buckets, hist.counts):
+                    series[name].append((f"{name}_bucket", labels + (("le", _fmt(bound)),), n))
+                series[name].append((f"{name}_bucket", labels + (("le", "+Inf"),), hist.count))
+                series[name].append((f"{name}_sum", labels, hist.total))
+                series[name].append((f"{name}_count", labels, hist.count))
+
+            lines = []
+            for name in sorted(series):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {self._types.get(name, 'untyped')}")
+                for sample, labels, value in series[name]:
+                    lines.append(f"{sample}{_labels(labels)} {_fmt(value)}")
+            return "\n".join(lines) + "\n"
+
+
+def _fmt(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return "{" + body + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+REGISTRY = Registry()
+REGISTRY.describe("http_requests_total", "counter", "Requests by endpoint, method and status.")
+REGISTRY.describe("http_request_duration_seconds", "histogram", "Request latency by endpoint.")
+REGISTRY.describe("http_request_bytes_total", "counter", "Request body bytes received.")
+REGISTRY.describe("http_response_bytes_total", "counter", "Response body bytes sent.")
+REGISTRY.describe("sql_queries_per_request", "histogram", "SQL statements issued per request.")
+REGISTRY.describe("sql_query_seconds_total", "counter", "Time spent in SQL per endpoint.")
+REGISTRY.describe("image_processing_seconds", "histogram", "Duration of PIL work by operation.")
+
+inc     = REGISTRY.inc
+gauge   = REGISTRY.set
+observe = REGISTRY.observe
+
+
+@contextmanager
+def timed(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def _endpoint_label():
+    rule = request.url_rule
+    return rule.rule if rule is not None else "unmatched"
+
+
+def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+    stack = conn.info.get("query_start")
+    if not stack:
+        return
+    elapsed = time.perf_counter() - stack.pop()
+    if not has_request_context() or "metrics_start" not in g:
+        return
+    g.sql_count += 1
+    g.sql_time += elapsed
+    if g.sql_log is not None:
+        g.sql_log.append((elapsed, statement))
+
+
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    g.sql_count = 0
+    g.sql_time = 0.0
+    g.sql_log = [] if _slow_threshold() is not None else None
+
+
+def _slow_threshold():
+    ms = current_app.config.get("SLOW_REQUEST_MS")
+    return float(ms) / 1000.0 if ms else None
+
+
+def _finish_request(response):
+    if "metrics_start" not in g:
+        return response
+    elapsed = time.perf_counter() - g.metrics_start
+    endpoint = _endpoint_label()
+    method = request.method
+
+    inc("http_requests_total", endpoint=endpoint, method=method, status=str(response.status_code))
+    observe("http_request_duration_seconds", elapsed, endpoint=endpoint, method=method)
+    observe("sql_queries_per_request", g.sql_count, buckets=COUNT_BUCKETS, endpoint=endpoint)
+    inc("sql_query_seconds_total", g.sql_time, endpoint=endpoint)
+    inc("http_request_bytes_total", request.content_length or 0, endpoint=endpoint)
+    if response.content_length is not None:
+        inc("http_response_bytes_total", response.content_length, endpoint=endpoint)
+
+    threshold = _slow_threshold()
+    if threshold is not None and elapsed >= threshold:
+        statements = "\n".join(f"  {t * 1000:7.2f} ms  {sql}" for t, sql in g.sql_log or [])
+        slow_log.warning("slow request %s %s -> %s in %.1f ms (%d SQL, %.1f ms)\n%s",
+                         method, request.path, response.status_code, elapsed * 1000,
+                         g.sql_count, g.sql_time * 1000, statements)
+    return response
+
+
+def _metrics_allowed():
+    # with METRICS_TOKEN set, scrapers send it as a bearer token; without, only this machine may read
+    token = current_app.config.get("METRICS_TOKEN")
+    if not token:
+        return request.remote_addr in LOOPBACK
+    sent = request.headers.get("Authorization", "").removeprefix("Bearer ")
+    return hmac.compare_digest(sent.encode(), token.encode())
+
+
+def metrics_view():
+    if not _metrics_allowed():
+        return Response("Not Found", status=404, mimetype="text/plain")
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+def init_app(app):
+    """Hooks request timing, SQL counting and the /metrics route into `app`."""
+    event.listen(Engine, "before_cursor_execute", _before_cursor)
+    event.listen(Engine, "after_cursor_execute", _after_cursor)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view, methods=["GET"])
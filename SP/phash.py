@@ -0,0 +1,128 @@
+# phash.py
+import re
+
+from PIL import Image
+
+import imaging
+
+HASH_BITS = 64
+HEX_RE = re.compile(r"[0-9a-fA-F]{%d}" % (HASH_BITS // 4))
+
+
+def dhash(img, size=8):
+    """
+    64-bit difference hash: compares neighbouring pixels of a size+1 x size
+    grayscale thumbnail. Robust to re-encoding, resizing and small tone
+    changes; returned as an int.
+    """
+    orient = imaging.orientation(img)
+    img.draft("L", (size * 4, size * 4))     # cheap JPEG downscale while decoding
+    # hashed upright, so a file and its normalized (rotated, EXIF-free) copy match
+    gray = imaging.upright(img.convert("L"), orient)
+    small = gray.resize((size + 1, size), Image.LANCZOS)
+    px = list(small.getdata())
+    bits = 0
+    for row in range(size):
+        base = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (px[base + col] > px[base + col + 1])
+    return bits
+
+
+def dhash_file(path_or_fp):
+    with Image.open(path_or_fp) as img:
+        return dhash(img)
+
+
+def to_hex(value):
+    return f"{value:016x}"
+
+
+def from_hex(text):
+    """Inverse of to_hex; ValueError unless `text` is exactly 16 hex digits (no sign, prefix or spaces)."""
+    if not isinstance(text, str) or not HEX_RE.fullmatch(text):
+        raise ValueError(f"not a {HASH_BITS}-bit hex hash: {text!r}")
+    return int(text, 16)
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over hamming distance. `search(h, k)` visits only
+    the subtrees whose edge distance lies within [d-k, d+k], so lookups for
+    small k touch a small fraction of the items.
+    """
+
+    __slots__ = ("root", "size")
+
+    def __init__(self, items=()):
+        self.root = None        # [hash, [payloads], {distance: child}]
+        self.size = 0
+        for h, payload in items:
+            self.add(h, payload)
+
+    def add(self, h, payload):
+        self.size += 1
+        if self.root is None:
+            self.root = [h, [payload], {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(h, node[0])
+            if d == 0:
+                node[1].append(payload)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, [payload], {}]
+                return
+            node = child
+
+    def search(self, h, k):
+        """[(distance, hash, payload)] for every item within hamming distance k, nearest first."""
+        if self.root is None:
+            return []
+        found, stack = [], [self.root]
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= k:
+                found.extend((d, node[0], p) for p in node[1])
+            for edge, child in node[2].items():
+                if d - k <= edge <= d + k:
+                    stack.append(child)
+        found.sort(key=lambda item: item[0])
+        return found
+
+    def __len__(self):
+        return self.size
+
+
+def duplicate_groups(items, k):
+    """
+    Clusters (hash, payload) items whose hashes are within k of each other
+    (single linkage). Returns groups with two or more members, largest first.
+    """
+    items = list(items)
+    tree = BKTree((h, i) for i, (h, _) in enumerate(items))
+    parent = list(range(len(items)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, (h, _) in enumerate(items):
+        for _d, _h, j in tree.search(h, k):
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                parent[rj] = ri
+
+    groups = {}
+    for i, (_h, payload) in enumerate(items):
+        groups.setdefault(find(i), []).append(payload)
+    return sorted((g for g in groups.values() if len(g) > 1), key=len, reverse=True)
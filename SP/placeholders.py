@@ -0,0 +1,129 @@
+# placeholders.py
+"""
+BlurHash placeholders (https://blurha.sh): a handful of DCT components of
+an image packed into ~20-30 base-83 characters, plus its average colour.
+The server encodes one per upload; clients decode it into a blurred tile
+that stands in until the real thumbnail arrives.
+"""
+import math
+
+from PIL import Image
+
+import imaging
+
+SAMPLE = 32             # encoded from a thumbnail this big; low frequencies survive any downscale
+DECODE_SIZE = 16        # decoded this small, then scaled up: it's a blur anyway
+MAX_COMPONENTS = 4
+_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+_INDEX = {c: i for i, c in enumerate(_CHARS)}
+
+
+def _b83(value, length):
+    return "".join(_CHARS[value // 83 ** (length - 1 - i) % 83] for i in range(length))
+
+
+def _unb83(text):
+    value = 0
+    for c in text:
+        value = value * 83 + _INDEX[c]
+    return value
+
+
+_TO_LINEAR = [v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+              for v in (c / 255 for c in range(256))]
+
+
+def _to_srgb(v):
+    v = min(max(v, 0.0), 1.0)
+    return int((v * 12.92 if v <= 0.0031308 else 1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(v, exp):
+    return math.copysign(abs(v) ** exp, v)
+
+
+def encode(img):
+    """(hash, "#rrggbb") for an opened image; its orientation is applied first."""
+    orient = imaging.orientation(img)
+    img.draft("RGB", (SAMPLE * 2, SAMPLE * 2))     # cheap JPEG downscale while decoding
+    small = imaging.upright(img.convert("RGB"), orient)
+    small.thumbnail((SAMPLE, SAMPLE), Image.BILINEAR)
+    w, h = small.size
+    nx, ny = (MAX_COMPONENTS, 3) if w >= h else (3, MAX_COMPONENTS)
+    px = [tuple(_TO_LINEAR[c] for c in p) for p in small.getdata()]
+    cos_x = [[math.cos(math.pi * i * x / w) for x in range(w)] for i in range(nx)]
+    cos_y = [[math.cos(math.pi * j * y / h) for y in range(h)] for j in range(ny)]
+
+    factors = []
+    for j in range(ny):
+        for i in range(nx):
+            r = g = b = 0.0
+            for y in range(h):
+                cy = cos_y[j][y]
+                row = y * w
+                for x in range(w):
+                    basis = cos_x[i][x] * cy
+                    pr, pg, pb = px[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = (1 if i == j == 0 else 2) / (w * h)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    if ac:
+        q_max = max(0, min(82, int(max(abs(v) for f in ac for v in f) * 166 - 0.5)))
+        max_value = (q_max + 1) / 166
+    else:
+        q_max, max_value = 0, 1
+    rgb = tuple(_to_srgb(v) for v in dc)
+    out = _b83((nx - 1) + (ny - 1) * 9, 1) + _b83(q_max, 1) + _b83((rgb[0] << 16) | (rgb[1] << 8) | rgb[2], 4)
+    for f in ac:
+        q = [max(0, min(18, int(_sign_pow(v / max_value, 0.5) * 9 + 9.5))) for v in f]
+        out += _b83(q[0] * 19 * 19 + q[1] * 19 + q[2], 2)
+    return out, "#%02x%02x%02x" % rgb
+
+
+def decode(text, w, h, punch=1.0):
+    """RGB image of w x h (keep it small and scale up) for a hash; ValueError if malformed."""
+    try:
+        flag = _unb83(text[0])
+        nx, ny = flag % 9 + 1, flag // 9 + 1
+        if len(text) != 4 + 2 * nx * ny:
+            raise ValueError(f"blurhash length {len(text)} doesn't match {nx}x{ny} components")
+        max_value = (_unb83(text[1]) + 1) / 166 * punch
+        dc = _unb83(text[2:6])
+        colors = [tuple(_TO_LINEAR[c] for c in (dc >> 16, (dc >> 8) & 255, dc & 255))]
+        for k in range(1, nx * ny):
+            v = _unb83(text[4 + 2 * k:6 + 2 * k])
+            colors.append(tuple(_sign_pow((q - 9) / 9, 2) * max_value
+                                for q in (v // (19 * 19), v // 19 % 19, v % 19)))
+    except (KeyError, IndexError) as e:
+        raise ValueError(f"malformed blurhash {text!r}") from e
+
+    cos_x = [[math.cos(math.pi * x * i / w) for i in range(nx)] for x in range(w)]
+    cos_y = [[math.cos(math.pi * y * j / h) for j in range(ny)] for y in range(h)]
+    data = bytearray()
+    for y in range(h):
+        for x in range(w):
+            r = g = b = 0.0
+            for j in range(ny):
+                cy = cos_y[y][j]
+                for i in range(nx):
+                    basis = cos_x[x][i] * cy
+                    cr, cg, cb = colors[i + j * nx]
+                    r += cr * basis
+                    g += cg * basis
+                    b += cb * basis
+            data += bytes((_to_srgb(r), _to_srgb(g), _to_srgb(b)))
+    return Image.frombytes("RGB", (w, h), bytes(data))
+
+
+def describe(path):
+    """{'blurhash', 'color'} column values for a stored file, or {} if it can't be read."""
+    try:
+        with imaging.open_checked(path) as img:
+            text, color = encode(img)
+    except Exception:
+        return {}
+    return {'blurhash': text, 'color': color}
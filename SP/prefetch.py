@@ -0,0 +1,131 @@
+# prefetch.py
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+log = logging.getLogger("insta.prefetch")
+
+HIGH, NORMAL, LOW = 0, 5, 10    # lower runs first
+WORKERS = 2
+BYTES_PER_S = 2 * 1024 * 1024
+IDLE_S = 0.3                    # foreground must have been quiet this long before prefetching
+MAX_QUEUED = 500
+
+
+class Cancelled(Exception):
+    pass
+
+
+class Ticket:
+    """Handed to a task; downloads call consume() per chunk to be throttled and cancelled."""
+
+    def __init__(self, prefetcher, generation):
+        self._prefetcher = prefetcher
+        self._generation = generation
+
+    @property
+    def cancelled(self):
+        return self._generation != self._prefetcher.generation
+
+    def consume(self, nbytes):
+        if self.cancelled:
+            raise Cancelled()
+        self._prefetcher._throttle(nbytes)
+
+
+class Prefetcher:
+    """
+    Runs speculative fetches on a few daemon threads, best priority first,
+    only while the foreground has been idle for `idle_s` (idle_for() says
+    how long; 0 while a visible request runs) and within a bytes/second
+    budget. cancel() drops everything queued and makes running tasks stop
+    at their next chunk; views call it when the user navigates away.
+    """
+
+    def __init__(self, idle_for, workers=WORKERS, bytes_per_s=BYTES_PER_S, idle_s=IDLE_S):
+        self.idle_for = idle_for
+        self.workers = workers
+        self.bytes_per_s = bytes_per_s
+        self.idle_s = idle_s
+        self.generation = 0
+        self._heap = []
+        self._keys = set()
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._busy = 0
+        self._allowance = float(bytes_per_s)
+        self._refilled = time.monotonic()
+        self._budget_lock = threading.Lock()
+
+    def schedule(self, key, fn, priority=NORMAL):
+        """Queues fn(ticket) once per key until the next cancel(); returns False if skipped."""
+        with self._cond:
+            if key in self._keys or len(self._heap) >= MAX_QUEUED:
+                return False
+            self._keys.add(key)
+            heapq.heappush(self._heap, (priority, next(self._seq), self.generation, key, fn))
+            self._cond.notify()
+        self._start()
+        return True
+
+    def cancel(self):
+        with self._cond:
+            self.generation += 1
+            self._heap.clear()
+            self._keys.clear()
+            self._cond.notify_all()
+
+    def wait_idle(self, timeout=None):
+        """Blocks until nothing is queued or running; False on timeout (used by benchmarks)."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._heap and not self._busy, timeout)
+
+    def _start(self):
+        if self._threads:
+            return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name=f"prefetch-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _priority, _seq, generation, key, fn = heapq.heappop(self._heap)
+                self._busy += 1
+            try:
+                self._wait_for_idle()
+                ticket = Ticket(self, generation)
+                if not ticket.cancelled:
+                    fn(ticket)
+            except Cancelled:
+                pass
+            except Exception as e:          # speculative: failures only cost the cache hit
+                log.debug("prefetch %s failed: %s", key, e)
+            finally:
+                with self._cond:
+                    self._busy -= 1
+                    self._cond.notify_all()
+
+    def _wait_for_idle(self):
+        while True:
+            idle = self.idle_for()
+            if idle >= self.idle_s:
+                return
+            time.sleep(self.idle_s - idle)
+
+    def _throttle(self, nbytes):
+        with self._budget_lock:
+            now = time.monotonic()
+            self._allowance = min(self.bytes_per_s,
+                                  self._allowance + (now - self._refilled) * self.bytes_per_s)
+            self._refilled = now
+            self._allowance -= nbytes
+            debt = -self._allowance
+        if debt > 0:
+            time.sleep(debt / self.bytes_per_s)
@@ -0,0 +1,122 @@
+# ratelimit.py
+import math
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import jsonify, request
+
+import metrics
+
+metrics.REGISTRY.describe("rate_limited_total", "counter", "Requests rejected with 429 by endpoint class.")
+metrics.REGISTRY.describe("load_shed_total", "counter", "Requests shed with 503 because a work pool was full.")
+metrics.REGISTRY.describe("work_slots_in_use", "gauge", "Busy slots per concurrency gate.")
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, n=1):
+        """0 if `n` tokens were taken, else seconds until they will be available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= n:
+            self.tokens -= n
+            return 0.0
+        return (n - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    Token buckets per (endpoint class, user or client IP). `limits` maps a
+    class to (requests per second, burst). Buckets live in a bounded LRU, so
+    memory stays flat however many clients show up. Limits are per worker
+    process.
+    """
+
+    def __init__(self, limits, max_buckets=100_000):
+        self.limits = dict(limits)
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, cls, key):
+        rate, burst = self.limits[cls]
+        with self._lock:
+            bucket = self._buckets.get((cls, key))
+            if bucket is None:
+                bucket = self._buckets[(cls, key)] = TokenBucket(rate, burst)
+                if len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end((cls, key))
+            return bucket.take()
+
+    def limit(self, cls, per="user"):
+        """
+        Decorator; per="user" keys on the current_user passed by token_required
+        (so it must sit below it), per="ip" on the client address.
+        """
+        def deco(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                key = f"user:{args[0].id}" if per == "user" else f"ip:{request.remote_addr}"
+                wait = self.hit(cls, key)
+                if wait:
+                    metrics.inc("rate_limited_total", cls=cls)
+                    return retry_later(429, wait, 'Zbyt wiele żądań, spróbuj ponownie później')
+                return f(*args, **kwargs)
+            return decorated
+        return deco
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class ConcurrencyGate:
+    """Caps concurrent CPU-heavy work; callers wait up to `timeout` and are shed after that."""
+
+    def __init__(self, name, slots, timeout=2.0, retry_after=5):
+        self.name = name
+        self.slots = slots
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._sem = threading.BoundedSemaphore(slots)
+        self._busy = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        if not self._sem.acquire(timeout=self.timeout):
+            metrics.inc("load_shed_total", gate=self.name)
+            raise Overloaded(self.retry_after)
+        self._track(+1)
+        try:
+            yield
+        finally:
+            self._track(-1)
+            self._sem.release()
+
+    def _track(self, delta):
+        with self._lock:
+            self._busy += delta
+            metrics.gauge("work_slots_in_use", self._busy, gate=self.name)
+
+
+def retry_later(status, seconds, message):
+    resp = jsonify({'error': message, 'retry_after': math.ceil(seconds)})
+    resp.status_code = status
+    resp.headers['Retry-After'] = str(max(1, math.ceil(seconds)))
+    return resp
@@ -0,0 +1,80 @@
+# responses.py
+import gzip
+import json
+
+from flask import Response, request
+
+try:
+    import orjson
+except ImportError:          # optional, falls back to the stdlib encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:          # optional, gzip is always available
+    brotli = None
+
+# Bump whenever the shape of a list payload changes so clients drop stale copies.
+PAYLOAD_REVISION = 4
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def etag_for(*parts):
+    return "-".join(str(p) for p in ("r%d" % PAYLOAD_REVISION,) + parts)
+
+
+def not_modified(etag):
+    """304 response if the client already holds `etag`, else None."""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    resp = Response(status=304)
+    resp.set_etag(etag, weak=True)
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+
+def _negotiate_encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+
+def compress(body):
+    """Returns (body, content-encoding) for the current request."""
+    if len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    encoding = _negotiate_encoding()
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY), encoding
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0), encoding
+    return body, None
+
+
+def json_response(payload, status=200, etag=None):
+    """Serialized, optionally compressed JSON carrying a weak ETag."""
+    return serialized_response(dumps(payload), status, etag)
+
+
+def serialized_response(body, status=200, etag=None):
+    """json_response for a body that is already serialized (e.g. from the result cache)."""
+    body, encoding = compress(body)
+    resp = Response(body, status=status, mimetype="application/json")
+    resp.headers["Vary"] = "Accept-Encoding"
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    if etag is not None:
+        resp.set_etag(etag, weak=True)
+        resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
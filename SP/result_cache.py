@@ -0,0 +1,179 @@
+# result_cache.py
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+metrics.REGISTRY.describe("result_cache_requests_total", "counter",
+                          "Serialized-result cache lookups by kind and result (hit, miss, stale).")
+metrics.REGISTRY.describe("result_cache_hit_ratio", "gauge",
+                          "Hits / lookups per kind since this process started.")
+
+
+class MemoryBackend:
+    """Per-process LRU bounded by the total size of the stored values."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()     # key -> (tag, body)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                self._items.move_to_end(key)
+            return item
+
+    def put(self, key, tag, body):
+        if len(body) > self.max_bytes // 8:     # one huge library shouldn't flush everyone else
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._items[key] = (tag, body)
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def delete(self, keys):
+        with self._lock:
+            for key in keys:
+                old = self._items.pop(key, None)
+                if old is not None:
+                    self._bytes -= len(old[1])
+
+    def size(self):
+        return self._bytes
+
+
+class SQLiteBackend:
+    """
+    LRU in a local SQLite file (WAL), so every worker process on the host
+    sees the same entries and the same invalidations. Access times are
+    recorded on reads; eviction drops the least recently used rows once
+    the stored bytes exceed max_bytes.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS results (
+        key      TEXT PRIMARY KEY,
+        tag      TEXT,
+        body     BLOB NOT NULL,
+        size     INTEGER NOT NULL,
+        accessed REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed);
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = os.path.abspath(path)
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        self._db().executescript(self.SCHEMA)
+
+    def _db(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=2, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        db = self._db()
+        row = db.execute("SELECT tag, body FROM results WHERE key=?", (key,)).fetchone()
+        if row is None:
+            return None
+        db.execute("UPDATE results SET accessed=? WHERE key=?", (time.time(), key))
+        return row[0], bytes(row[1])
+
+    def put(self, key, tag, body):
+        if len(body) > self.max_bytes // 8:
+            return
+        db = self._db()
+        db.execute("INSERT OR REPLACE INTO results (key, tag, body, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                   (key, tag, body, len(body), time.time()))
+        excess = self.size() - self.max_bytes
+        if excess > 0:
+            victims, freed = [], 0
+            for old_key, size in db.execute("SELECT key, size FROM results ORDER BY accessed"):
+                if freed >= excess:
+                    break
+                victims.append(old_key)
+                freed += size
+            self.delete(victims)
+
+    def delete(self, keys):
+        keys = list(keys)
+        if keys:
+            self._db().execute(f"DELETE FROM results WHERE key IN ({','.join('?' * len(keys))})", keys)
+
+    def size(self):
+        return self._db().execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+
+def make_backend(spec, max_bytes=DEFAULT_MAX_BYTES):
+    """"memory" (default) or "sqlite:<path>" to share the cache between worker processes."""
+    if not spec or spec == "memory":
+        return MemoryBackend(max_bytes)
+    if spec.startswith("sqlite:"):
+        return SQLiteBackend(spec[len("sqlite:"):], max_bytes)
+    raise ValueError(f"unknown result cache backend: {spec!r}")
+
+
+class ResultCache:
+    """
+    Serialized (JSON bytes) per-user query results. Each entry carries a tag,
+    e.g. the user's library_version when it was computed; a lookup with a
+    different tag is a miss, so a result computed concurrently with a write
+    is never served after it. Writers also delete the affected keys.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._lookups = {}      # kind -> [hits, total]
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build, tag=None):
+        """
+        Stored bytes for `key` ("u<id>:<kind>[:...]"), or build() stored now;
+        build returns bytes.
+        """
+        kind = key.split(":")[1]
+        tag = None if tag is None else str(tag)
+        item = self.backend.get(key)
+        if item is not None and item[0] == tag:
+            self._record(kind, "hit")
+            return item[1]
+        self._record(kind, "stale" if item is not None else "miss")
+        body = build()
+        self.backend.put(key, tag, body)
+        return body
+
+    def invalidate(self, *keys):
+        self.backend.delete(keys)
+
+    def _record(self, kind, result):
+        metrics.inc("result_cache_requests_total", kind=kind, result=result)
+        with self._lock:
+            counts = self._lookups.setdefault(kind, [0, 0])
+            counts[0] += result == "hit"
+            counts[1] += 1
+            ratio = counts[0] / counts[1]
+        metrics.gauge("result_cache_hit_ratio", round(ratio, 4), kind=kind)
+
+    def stats(self):
+        with self._lock:
+            return {kind: {"hits": h, "lookups": n, "hit_ratio": h / n if n else 0.0}
+                    for kind, (h, n) in self._lookups.items()}
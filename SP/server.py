@@ -1,13 +1,36 @@
 # server.py
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, make_response
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 import jwt
 import datetime
 from functools import wraps
+import hashlib
+import io
+import json
 import os
-from PIL import Image as PILImage    # for converting PNG → JPEG
+import re
+import threading
+import click
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+import metrics
+import avatars
+import derivatives
+import phash
+import placeholders
+import imaging
+import sprites
+import metadata
+import ingest
+import result_cache
+import events
+import export
+from storage import KEY_RE, MediaStorage
+from media_gc import MediaCollector
+from responses import dumps, etag_for, json_response, not_modified, serialized_response
+from ratelimit import ConcurrencyGate, Overloaded, RateLimiter, retry_later
 
 app = Flask(__name__)
 CORS(app)
@@ -15,12 +38,39 @@ CORS(app)
 app.config['SECRET_KEY'] = 'tajny_klucz_demo'
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SLOW_REQUEST_MS'] = os.environ.get('SLOW_REQUEST_MS')   # e.g. 250; unset = off
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')       # unset = /metrics from localhost only
 
-UPLOAD_FOLDER = 'uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+app.config['UPLOAD_FOLDER'] = os.path.abspath(
+    os.environ.get('UPLOAD_ROOT', os.path.join(BASE_DIR, 'uploads')))
+storage = MediaStorage(app.config['UPLOAD_FOLDER'], derivatives.VARIANTS)
+sprite_cache = sprites.SpriteCache(
+    os.environ.get('SPRITE_CACHE', os.path.join(BASE_DIR, 'cache', 'sprites')), app.config['SECRET_KEY'])
+PROFILE_MAX_SIDE = 1080     # profile pictures are only ever shown small
+
+# (requests per second, burst) per user, or per IP for auth
+RATE_LIMITS = {
+    'auth':   (5 / 60, 5),      # bcrypt is deliberately slow
+    'upload': (1.0, 30),
+    'write':  (5.0, 50),
+    'export': (1 / 60, 10),     # each resume of a download is a request
+}
+limiter = RateLimiter(RATE_LIMITS)
+# decode/hash/transcode work; beyond this requests wait briefly, then get 503
+image_gate = ConcurrencyGate('image', int(os.environ.get('IMAGE_WORKERS', os.cpu_count() or 2)))
+
+# serialized listings/profiles; RESULT_CACHE=sqlite:<path> shares them between worker processes
+results = result_cache.ResultCache(result_cache.make_backend(
+    os.environ.get('RESULT_CACHE', 'memory'),
+    int(os.environ.get('RESULT_CACHE_MB', 64)) * 1024 * 1024))
+
+# live library updates (/api/events); EVENT_BROKER=sqlite:<path> when several workers serve
+broker = events.make_broker(os.environ.get('EVENT_BROKER', 'memory'))
 
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
+metrics.init_app(app)
 
 
 class User(db.Model):
@@ -29,14 +79,35 @@ class User(db.Model):
     password = db.Column(db.String(128), nullable=False)
     username = db.Column(db.String(120), nullable=True)
     bio      = db.Column(db.Text,       nullable=True)
+    # bumped on every write to the user's images/albums; drives list ETags
+    library_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    follower_count  = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    following_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # set once follower_count reaches CELEBRITY_FOLLOWERS: posts are merged into feeds at read time
+    fanout_on_read  = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+    # digest of the current profile picture; names its avatar files (avatars.py)
+    avatar_version  = db.Column(db.String(16), nullable=True)
+    # bumped when the name, bio or follow counts change; tags the cached profile
+    profile_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
 
 class Image(db.Model):
+    """A stored photo: a post (posted) and/or a member of any number of albums."""
     id          = db.Column(db.Integer, primary_key=True)
-    user_id     = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id     = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     filename    = db.Column(db.String(256), unique=True, nullable=False)
     description = db.Column(db.Text,       nullable=True)
     uploaded_at = db.Column(db.DateTime,   default=datetime.datetime.utcnow)
+    deleted_at  = db.Column(db.DateTime,   nullable=True)
+    phash       = db.Column(db.String(16), nullable=True)    # 64-bit dHash, hex
+    width       = db.Column(db.Integer,    nullable=True)        # as displayed (EXIF rotation applied)
+    height      = db.Column(db.Integer,    nullable=True)
+    taken_at    = db.Column(db.DateTime,   nullable=True)
+    location    = db.Column(db.String(32), nullable=True)    # "lat,lon"
+    blurhash    = db.Column(db.String(32), nullable=True)    # listing placeholder (placeholders.py)
+    color       = db.Column(db.String(7),  nullable=True)    # average colour, "#rrggbb"
+    # shown in the profile grid and feeds; False for photos that only live in albums
+    posted      = db.Column(db.Boolean,    nullable=False, default=True, server_default='1')
 
 
 class Album(db.Model):
@@ -45,14 +116,516 @@ class Album(db.Model):
     name        = db.Column(db.String(120), nullable=False)
     description = db.Column(db.Text,      nullable=True)
     created_at  = db.Column(db.DateTime,  default=datetime.datetime.utcnow)
+    deleted_at  = db.Column(db.DateTime,  nullable=True)
 
 
-class AlbumImage(db.Model):
+class AlbumMembership(db.Model):
+    """An image in an album. Adding or removing one never touches the file."""
+    __table_args__ = (db.UniqueConstraint('album_id', 'image_id'),)
+    id       = db.Column(db.Integer, primary_key=True)
+    album_id = db.Column(db.Integer, db.ForeignKey('album.id'), nullable=False)
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id'), nullable=False, index=True)
+    added_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+
+class Follow(db.Model):
+    __table_args__ = (db.UniqueConstraint('follower_id', 'followee_id'),
+                      db.Index('ix_follow_merge', 'follower_id', 'merge_on_read'))
     id          = db.Column(db.Integer, primary_key=True)
-    album_id    = db.Column(db.Integer, db.ForeignKey('album.id'))
-    filename    = db.Column(db.String(256), unique=True, nullable=False)
-    description = db.Column(db.Text,      nullable=True)
-    uploaded_at = db.Column(db.DateTime,  default=datetime.datetime.utcnow)
+    follower_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    followee_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    # copy of the followee's fanout_on_read, so feed reads find them without scanning all follows
+    merge_on_read = db.Column(db.Boolean, nullable=False, default=False, server_default='0')
+    created_at  = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+
+
+class TimelineEntry(db.Model):
+    """A post pushed into a follower's home feed when it was written (fan-out on write)."""
+    __table_args__ = (db.UniqueConstraint('user_id', 'image_id'),)
+    id        = db.Column(db.Integer, primary_key=True)
+    user_id   = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    image_id  = db.Column(db.Integer, db.ForeignKey('image.id'), nullable=False, index=True)
+    author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+
+
+class FileTombstone(db.Model):
+    """A stored file whose row was deleted; removed from disk by the MediaCollector."""
+    id              = db.Column(db.Integer, primary_key=True)
+    key             = db.Column(db.String(256), nullable=False)
+    created_at      = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
+    attempts        = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_error      = db.Column(db.Text, nullable=True)
+
+
+class IdempotencyRecord(db.Model):
+    """Response to a write sent with an Idempotency-Key, replayed when the client retries it."""
+    __table_args__ = (db.UniqueConstraint('user_id', 'key'),)
+    id         = db.Column(db.Integer, primary_key=True)
+    user_id    = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    key        = db.Column(db.String(64), nullable=False)
+    status     = db.Column(db.Integer, nullable=False)
+    mimetype   = db.Column(db.String(64), nullable=True)
+    body       = db.Column(db.LargeBinary, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, index=True)
+
+
+IDEMPOTENCY_TTL = datetime.timedelta(days=7)
+IDEMPOTENCY_PENDING = 0                            # status of a record whose write is still running
+IDEMPOTENCY_LEASE = datetime.timedelta(minutes=5)  # a pending record older than this was abandoned
+RETRYABLE_4XX = (408, 409, 425, 429)               # answers a retry may change: never replayed
+CELEBRITY_FOLLOWERS = 10_000   # above this, posts are pulled at read time instead of fanned out
+TIMELINE_MAX = 800             # entries kept per home timeline
+TIMELINE_BACKFILL = 50         # posts copied into the timeline on follow
+FEED_PAGE, FEED_MAX_PAGE = 20, 50
+
+
+class JobCheckpoint(db.Model):
+    """Resume position of a long-running CLI job, committed together with the work it covers."""
+    name       = db.Column(db.String(255), primary_key=True)
+    position   = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+
+collector = MediaCollector(app, db, storage, FileTombstone, Image, Album, AlbumMembership,
+                           protected_prefixes=("profile_", "avatar_"))
+
+# listing entries (media_json) of posts and album photos
+LISTING_COLUMNS = (Image.id, Image.filename, Image.description, Image.uploaded_at, Image.taken_at,
+                   Image.location, Image.width, Image.height, Image.blurhash, Image.color)
+LEGACY_ALBUM_IMAGE_COLUMNS = ('filename', 'description', 'uploaded_at', 'deleted_at', 'phash', 'width',
+                              'height', 'taken_at', 'location', 'blurhash', 'color')
+
+
+def migrate_schema(engine=None):
+    """Creates missing tables and adds columns introduced after the first release."""
+    engine = engine or db.engine
+    db.metadata.create_all(engine)
+    insp = inspect(engine)
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {c['name'] for c in insp.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing:
+                    continue
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" ' \
+                      f'{col.type.compile(dialect=engine.dialect)}'
+                if col.server_default is not None:
+                    ddl += f" DEFAULT '{col.server_default.arg}'"
+                conn.execute(db.text(ddl))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        if 'album_image' in insp.get_table_names():
+            merge_album_images(conn, {c['name'] for c in insp.get_columns('album_image')})
+
+
+def merge_album_images(conn, legacy_columns):
+    """
+    Moves album photos from the old album_image table into image (not
+    posted) plus album memberships, then drops the table. Keys stay the
+    same, so no file moves. Tables from before later columns existed (e.g.
+    deleted_at) lack them, so only the columns present are read.
+    """
+    cols = [c for c in LEGACY_ALBUM_IMAGE_COLUMNS if c in legacy_columns]
+    added_at = 'ai.uploaded_at' if 'uploaded_at' in legacy_columns else 'NULL'
+    live = 'WHERE ai.deleted_at IS NULL' if 'deleted_at' in legacy_columns else ''
+    conn.execute(db.text(
+        f'INSERT INTO image (user_id, posted, {", ".join(cols)}) '
+        f'SELECT album.user_id, 0, {", ".join("ai." + c for c in cols)} '
+        f'FROM album_image ai JOIN album ON album.id = ai.album_id'))
+    conn.execute(db.text(
+        f'INSERT INTO album_membership (album_id, image_id, added_at) '
+        f'SELECT ai.album_id, image.id, {added_at} FROM album_image ai '
+        f'JOIN image ON image.filename = ai.filename {live}'))
+    conn.execute(db.text('DROP TABLE album_image'))
+
+
+def cached_json(key, build, tag=None, etag=None):
+    """Response for `key` from the result cache; build() returns the payload on a miss."""
+    return serialized_response(results.get_or_build(key, lambda: dumps(build()), tag), etag=etag)
+
+
+def invalidate_results(user_id, *kinds):
+    """Drops cached results of a user, e.g. invalidate_results(uid, 'images', 'album:3')."""
+    results.invalidate(*(f"u{user_id}:{kind}" for kind in kinds))
+
+
+def bump_library_version(user):
+    # SQL-side increment so concurrent workers never hand out the same version twice
+    user.library_version = User.library_version + 1
+
+
+def bump_profile_version(*users):
+    for user in users:
+        user.profile_version = User.profile_version + 1
+
+
+def soft_delete(rows):
+    """Marks images deleted everywhere and queues their files for the collector (caller commits)."""
+    now = datetime.datetime.utcnow()
+    for row in rows:
+        row.deleted_at = now
+        db.session.add(FileTombstone(key=row.filename))
+    ids = [row.id for row in rows]
+    if ids:
+        TimelineEntry.query.filter(TimelineEntry.image_id.in_(ids)).delete(synchronize_session=False)
+        AlbumMembership.query.filter(AlbumMembership.image_id.in_(ids)).delete(synchronize_session=False)
+    return len(rows)
+
+
+def drop_orphans(image_ids):
+    """Soft-deletes those of the images that are neither posted nor in any album any more (caller commits)."""
+    in_album = db.session.query(AlbumMembership.id).filter(AlbumMembership.image_id == Image.id).exists()
+    return soft_delete(Image.query.filter(Image.id.in_(image_ids), Image.posted.is_(False),
+                                          Image.deleted_at.is_(None), ~in_album).all())
+
+
+def album_filenames(image_ids):
+    """{album id: [filename]} of the albums holding the images."""
+    by_album = {}
+    rows = db.session.query(AlbumMembership.album_id, Image.filename)\
+                     .join(Image, Image.id == AlbumMembership.image_id)\
+                     .filter(AlbumMembership.image_id.in_(image_ids))
+    for aid, filename in rows:
+        by_album.setdefault(aid, []).append(filename)
+    return by_album
+
+
+def delete_media(user, images):
+    """Deletes images from posts, from every album and (via the collector) from disk; commits."""
+    by_album = album_filenames([img.id for img in images])
+    posts = [img.filename for img in images if img.posted]
+    deleted = soft_delete(images)
+    if deleted:
+        bump_library_version(user)
+    db.session.commit()
+    invalidate_results(user.id, *(['images'] if posts else []), *(f'album:{aid}' for aid in by_album))
+    if posts:
+        events.publish(broker, user.id, 'images_deleted', album_id=None, filenames=posts)
+    for aid, names in by_album.items():
+        events.publish(broker, user.id, 'images_deleted', album_id=aid, filenames=names)
+    collector.wake()
+    return deleted
+
+
+def commit_or_discard(*keys):
+    """Commits the session; on failure removes the already-stored files so nothing is orphaned."""
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        for key in keys:
+            storage.delete(key)
+        raise
+
+
+def rejected_upload(key):
+    """Error response (and removes the file) if `key` is not a decodable image within the pixel limit."""
+    try:
+        imaging.check_pixels(storage.path(key))
+        return None
+    except imaging.ImageTooLarge as e:
+        storage.delete(key)
+        return jsonify({'error': 'Obraz jest za duży', 'details': str(e)}), 413
+    except Exception as e:
+        storage.delete(key)
+        return jsonify({'error': 'Nieprawidłowy plik obrazu', 'details': str(e)}), 400
+
+
+def store_upload(file):
+    """Saves and inspects an uploaded image: (row column values, None) or (None, error response)."""
+    with image_gate.slot():
+        staged = storage.save(storage.new_key(file.filename), file.stream)
+        rejected = rejected_upload(staged)
+        if rejected:
+            return None, rejected
+        attrs = describe_image(staged)       # before normalizing drops the EXIF
+        try:
+            key = derivatives.normalize(storage, staged)
+        except Exception as e:
+            storage.delete(staged)
+            return None, (jsonify({'error': 'Nieprawidłowy plik obrazu', 'details': str(e)}), 400)
+        attrs.update(filename=key, phash=compute_phash(key), **compute_placeholder(key))
+    # EXIF wins; the client's guess (e.g. device location) only fills gaps
+    if attrs.get('taken_at') is None:
+        attrs['taken_at'] = metadata.parse_time(request.form.get('taken_at'))
+    if attrs.get('location') is None:
+        attrs['location'] = metadata.parse_location(request.form.get('location'))
+    return attrs, None
+
+
+def describe_image(key):
+    try:
+        with imaging.open_checked(storage.path(key)) as img:
+            return metadata.extract(img)
+    except Exception:
+        return {}
+
+
+def media_json(row):
+    """Listing entry for an Image row (or a query row with LISTING_COLUMNS)."""
+    entry = {
+        'id': row.id,
+        'filename': row.filename,
+        'description': row.description,
+        'uploaded_at': row.uploaded_at.strftime('%Y-%m-%d %H:%M'),
+    }
+    if row.taken_at:
+        entry['taken_at'] = row.taken_at.strftime('%Y-%m-%d %H:%M:%S')
+    if row.location:
+        entry['location'] = row.location
+    # enough for the client to lay out and paint the tile before fetching it
+    for field in ('width', 'height', 'blurhash', 'color'):
+        value = getattr(row, field)
+        if value:
+            entry[field] = value
+    return entry
+
+
+def fan_out(image, author):
+    """Pushes a new post into every follower's timeline (flush first), unless the author is read-merged."""
+    if author.fanout_on_read:
+        return
+    followers = db.select(Follow.follower_id, db.literal(image.id), db.literal(author.id))\
+                  .where(Follow.followee_id == author.id)
+    db.session.execute(db.insert(TimelineEntry)
+                         .from_select(['user_id', 'image_id', 'author_id'], followers))
+    with _fanned_out_lock:
+        _fanned_out.add(author.id)
+
+
+def home_feed(user, before, limit):
+    """
+    (posts, next cursor) of the user's home feed, newest first, below image
+    id `before`. The pushed timeline and the read-merged authors (the user
+    and followed celebrities) are each read with one index range scan
+    capped at `limit`, so the cost doesn't depend on how many accounts the
+    user follows.
+    """
+    pushed = db.session.query(TimelineEntry.image_id).filter(TimelineEntry.user_id == user.id)
+    pulled_authors = [user.id] + [r[0] for r in db.session.query(Follow.followee_id)
+                                  .filter_by(follower_id=user.id, merge_on_read=True)]
+    pulled = db.session.query(Image.id).filter(Image.user_id.in_(pulled_authors), Image.posted,
+                                               Image.deleted_at.is_(None))
+    if before:
+        pushed = pushed.filter(TimelineEntry.image_id < before)
+        pulled = pulled.filter(Image.id < before)
+    ids = {r[0] for r in pushed.order_by(TimelineEntry.image_id.desc()).limit(limit)}
+    ids.update(r[0] for r in pulled.order_by(Image.id.desc()).limit(limit))
+    page = sorted(ids, reverse=True)[:limit]
+    rows = db.session.query(Image, User.username, User.email, User.avatar_version)\
+                     .join(User, User.id == Image.user_id)\
+                     .filter(Image.id.in_(page), Image.deleted_at.is_(None))\
+                     .order_by(Image.id.desc()).all()
+    posts = [{**media_json(img),
+              'author': {'id': img.user_id, 'username': username or email,
+                         'avatar': avatars.urls(img.user_id, avatar_version)}}
+             for img, username, email, avatar_version in rows]
+    return posts, (page[-1] if len(page) == limit else None)
+
+
+_fanned_out_lock = threading.Lock()
+_fanned_out = set()     # authors fanned out since the last trim; their followers' timelines grew
+
+
+def trim_timelines(user_ids):
+    """Keeps the newest TIMELINE_MAX entries of each user's timeline; older pages come from nowhere else."""
+    user_ids = list(user_ids)
+    for i in range(0, len(user_ids), 500):
+        ranked = db.select(TimelineEntry.id,
+                           db.func.row_number().over(partition_by=TimelineEntry.user_id,
+                                                     order_by=TimelineEntry.image_id.desc()).label('rn'))\
+                   .where(TimelineEntry.user_id.in_(user_ids[i:i + 500]))\
+                   .subquery()
+        old = db.select(ranked.c.id).where(ranked.c.rn > TIMELINE_MAX)
+        TimelineEntry.query.filter(TimelineEntry.id.in_(old)).delete(synchronize_session=False)
+
+
+def trim_fanned_out():
+    """Collector task: trims only the timelines that fan-out grew since the last pass."""
+    with _fanned_out_lock:
+        authors = list(_fanned_out)
+        _fanned_out.clear()
+    if authors:
+        trim_timelines(r[0] for r in db.session.query(Follow.follower_id)
+                                               .filter(Follow.followee_id.in_(authors)).distinct())
+
+
+def follow_json(user, is_following):
+    return {
+        'id': user.id,
+        'username': user.username or user.email,
+        'avatar': avatars.urls(user.id, user.avatar_version),
+        'followers': user.follower_count,
+        'following': user.following_count,
+        'is_following': is_following,
+    }
+
+
+def adopt_legacy_avatar(user):
+    """
+    Renders avatars for a picture uploaded before they existed; True if it
+    did (caller commits). Only the backfill command calls this: on a request
+    the image gate could shed it and fail a plain profile read.
+    """
+    legacy = f"profile_{user.id}.jpg"
+    if user.avatar_version or not storage.exists(legacy):
+        return False
+    with open(storage.path(legacy), 'rb') as fh:
+        data = fh.read()
+    version = avatars.version_of(data)
+    try:
+        with image_gate.slot(), imaging.open_checked(io.BytesIO(data)) as img:
+            avatars.publish(storage, user.id, img, version)
+    except (OSError, imaging.ImageTooLarge):
+        return False
+    user.avatar_version = version
+    return True
+
+
+def compute_phash(key):
+    try:
+        with metrics.timed('image_processing_seconds', op='phash'):
+            return phash.to_hex(phash.dhash_file(storage.path(key)))
+    except Exception:
+        return None
+
+
+def compute_placeholder(key):
+    with metrics.timed('image_processing_seconds', op='blurhash'):
+        return placeholders.describe(storage.path(key))
+
+
+def library_hashes(user_id):
+    """(hash, (filename, description)) for every live post and album photo of the user."""
+    rows = db.session.query(Image.phash, Image.filename, Image.description)\
+                     .filter(Image.user_id == user_id, Image.deleted_at.is_(None),
+                             Image.phash.isnot(None))
+    return [(phash.from_hex(h), (f, d)) for h, f, d in rows]
+
+
+_phash_index_lock = threading.Lock()
+_phash_indexes = {}     # user_id -> (library_version, BKTree)
+
+
+def phash_index(user):
+    """Per-user BK-tree, rebuilt lazily when the library version moves."""
+    with _phash_index_lock:
+        cached = _phash_indexes.get(user.id)
+        if cached and cached[0] == user.library_version:
+            return cached[1]
+    tree = phash.BKTree(library_hashes(user.id))
+    with _phash_index_lock:
+        _phash_indexes[user.id] = (user.library_version, tree)
+    return tree
+
+
+def similar_response(user, h, exclude=None):
+    try:
+        k = max(0, min(int(request.args.get('k', 6)), 20))
+    except ValueError:
+        return jsonify({'error': 'k must be an integer'}), 400
+    matches = [{'filename': f, 'description': d, 'distance': dist}
+               for dist, _h, (f, d) in phash_index(user).search(h, k) if f != exclude]
+    return jsonify(matches), 200
+
+
+def sprite_response(current_user, scope, keys):
+    """Offset map and URL of one page's sprite sheet; ?page=N (0-based), ?size=<tile px>."""
+    page = request.args.get('page', 0, type=int)
+    tile = min(max(request.args.get('size', sprites.DEFAULT_TILE, type=int), sprites.MIN_TILE),
+               sprites.MAX_TILE)
+    pages = sprites.page_count(len(keys))
+    if not 0 <= page < pages:
+        return jsonify({'error': 'Not found'}), 404
+    etag = etag_for('sprite', scope, current_user.library_version, page, tile)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    name, offsets = sprites.sheet_for(sprite_cache, storage, image_gate, scope,
+                                      current_user.library_version, page, tile, keys)
+    return json_response({
+        'url': f'/sprites/{name}',
+        'tile': tile,
+        'page': page,
+        'pages': pages,
+        'tiles': offsets,
+    }, etag=etag)
+
+
+def _reserve_idempotency_key(user_id, key):
+    """
+    (id of a pending record, None) if the caller gets to run the write for
+    `key`, else (None, the record that is already there). The unique
+    (user_id, key) constraint makes the insert a lock: of concurrent
+    retries only one runs the write.
+    """
+    record = IdempotencyRecord(user_id=user_id, key=key, status=IDEMPOTENCY_PENDING)
+    db.session.add(record)
+    try:
+        db.session.commit()
+        return record.id, None
+    except IntegrityError:
+        db.session.rollback()
+    prior = IdempotencyRecord.query.filter_by(user_id=user_id, key=key).first()
+    if prior is None or prior.status != IDEMPOTENCY_PENDING \
+            or prior.created_at > datetime.datetime.utcnow() - IDEMPOTENCY_LEASE:
+        return None, prior
+    # the request holding it died: take it over unless another retry just did
+    taken = IdempotencyRecord.query.filter_by(id=prior.id, status=IDEMPOTENCY_PENDING,
+                                              created_at=prior.created_at)\
+                                   .update({'created_at': datetime.datetime.utcnow()},
+                                           synchronize_session=False)
+    db.session.commit()
+    return (prior.id, None) if taken else (None, None)
+
+
+def idempotent(f):
+    """Replays the stored response if a write is retried with the same Idempotency-Key."""
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key', '').strip()[:64]
+        if not key:
+            return f(current_user, *args, **kwargs)
+        record_id, prior = _reserve_idempotency_key(current_user.id, key)
+        if record_id is None:
+            if prior is None or prior.status == IDEMPOTENCY_PENDING:
+                return retry_later(429, 1, 'Żądanie z tym kluczem jest w trakcie realizacji')
+            resp = app.response_class(prior.body, status=prior.status, mimetype=prior.mimetype)
+            resp.headers['Idempotent-Replayed'] = 'true'
+            return resp
+        try:
+            resp = make_response(f(current_user, *args, **kwargs))
+        except BaseException:
+            db.session.rollback()
+            IdempotencyRecord.query.filter_by(id=record_id).delete(synchronize_session=False)
+            db.session.commit()
+            raise
+        record = IdempotencyRecord.query.filter_by(id=record_id)
+        if resp.status_code < 500 and resp.status_code not in RETRYABLE_4XX:
+            record.update({'status': resp.status_code, 'mimetype': resp.mimetype, 'body': resp.get_data()},
+                          synchronize_session=False)
+        else:       # the next retry runs the write again
+            record.delete(synchronize_session=False)
+        db.session.commit()
+        return resp
+    return decorated
+
+
+def purge_idempotency_records():
+    IdempotencyRecord.query.filter(
+        IdempotencyRecord.created_at < datetime.datetime.utcnow() - IDEMPOTENCY_TTL
+    ).delete(synchronize_session=False)
+
+
+collector.add_task(purge_idempotency_records)
+collector.add_task(sprite_cache.prune)
+collector.add_task(trim_fanned_out)
+
+
+@app.errorhandler(Overloaded)
+def handle_overloaded(e):
+    return retry_later(503, e.retry_after, 'Serwer jest przeciążony, spróbuj ponownie później')
 
 
 def token_required(f):
@@ -74,6 +647,7 @@ def token_required(f):
 
 
 @app.route('/api/register', methods=['POST'])
+@limiter.limit('auth', per='ip')
 def register():
     data = request.get_json() or {}
     email = data.get('email', '').strip()
@@ -90,6 +664,7 @@ def register():
 
 
 @app.route('/api/login', methods=['POST'])
+@limiter.limit('auth', per='ip')
 def login():
     data = request.get_json() or {}
     user = User.query.filter_by(email=data.get('email','')).first()
@@ -105,23 +680,31 @@ def login():
 @app.route('/api/profile', methods=['GET'])
 @token_required
 def get_profile(current_user):
-    return jsonify({
+    tag = f'{current_user.avatar_version}:{current_user.profile_version}'
+    return cached_json(f'u{current_user.id}:profile', lambda: {
         'id': current_user.id,
         'email': current_user.email,
         'username': current_user.username or current_user.email,
-        'bio': current_user.bio or ""
-    }), 200
+        'bio': current_user.bio or "",
+        'followers': current_user.follower_count,
+        'following': current_user.following_count,
+        'avatar': avatars.urls(current_user.id, current_user.avatar_version),
+    }, tag)
 
 
 @app.route('/api/profile-edit', methods=['POST'])
 @token_required
+@limiter.limit('write')
+@idempotent
 def edit_profile(current_user):
     data = request.get_json() or {}
     if 'username' in data:
         current_user.username = data['username']
     if 'bio' in data:
         current_user.bio = data['bio']
+    bump_profile_version(current_user)
     db.session.commit()
+    invalidate_results(current_user.id, 'profile')
     return jsonify({
         'message': 'Profile updated',
         'username': current_user.username,
@@ -131,6 +714,8 @@ def edit_profile(current_user):
 
 @app.route('/api/profile-picture', methods=['POST'])
 @token_required
+@limiter.limit('upload')
+@idempotent
 def upload_profile_picture(current_user):
     if 'file' not in request.files:
         return jsonify({'error': 'Brak pliku'}), 400
@@ -141,16 +726,40 @@ def upload_profile_picture(current_user):
     if ext not in ('.jpg', '.jpeg', '.png'):
         return jsonify({'error': 'Dozwolone tylko JPG/JPEG/PNG'}), 400
     try:
-        img = PILImage.open(file.stream).convert('RGB')
-        save_name = f"profile_{current_user.id}.jpg"
-        img.save(os.path.join(UPLOAD_FOLDER, save_name), format='JPEG', quality=85)
+        with image_gate.slot(), metrics.timed('image_processing_seconds', op='profile_picture'):
+            img = imaging.fit_within(file.stream, PROFILE_MAX_SIDE, PROFILE_MAX_SIDE).convert('RGB')
+            buf = io.BytesIO()
+            img.save(buf, format='JPEG', quality=85)
+            save_name = f"profile_{current_user.id}.jpg"
+            derivatives.discard(storage, save_name)
+            storage.save(save_name, buf.getvalue(), overwrite=True)
+            version = avatars.version_of(buf.getvalue())
+            avatars.publish(storage, current_user.id, img, version)
+    except imaging.ImageTooLarge as e:
+        return jsonify({'error': 'Obraz jest za duży', 'details': str(e)}), 413
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({'error': 'Błąd przetwarzania obrazu', 'details': str(e)}), 500
-    return jsonify({'message': 'Zdjęcie profilowe zapisane'}), 200
+    old = current_user.avatar_version
+    if old != version:
+        current_user.avatar_version = version
+        # a picture used before may still be queued for removal
+        FileTombstone.query.filter(FileTombstone.key.in_(avatars.keys(current_user.id, version)))\
+                           .delete(synchronize_session=False)
+        for name in avatars.keys(current_user.id, old) if old else ():
+            db.session.add(FileTombstone(key=name))
+        db.session.commit()
+        invalidate_results(current_user.id, 'profile')
+    derivatives.submit(storage, save_name)
+    return jsonify({'message': 'Zdjęcie profilowe zapisane',
+                    'avatar': avatars.urls(current_user.id, version)}), 200
 
 
 @app.route('/api/upload', methods=['POST'])
 @token_required
+@limiter.limit('upload')
+@idempotent
 def upload_file(current_user):
     if 'file' not in request.files:
         return jsonify({'error': 'Brak pliku'}), 400
@@ -158,46 +767,113 @@ def upload_file(current_user):
     if file.filename == '':
         return jsonify({'error': 'Nie wybrano pliku'}), 400
     description = request.form.get('description', '')
-    filename = f"user{current_user.id}_{file.filename}"
-    file.save(os.path.join(UPLOAD_FOLDER, filename))
-    image = Image(user_id=current_user.id, filename=filename, description=description)
+    attrs, error = store_upload(file)
+    if error:
+        return error
+    filename = attrs['filename']
+    image = Image(user_id=current_user.id, description=description, **attrs)
     db.session.add(image)
-    db.session.commit()
+    bump_library_version(current_user)
+    db.session.flush()
+    fan_out(image, current_user)
+    commit_or_discard(filename)
+    invalidate_results(current_user.id, 'images')
+    events.publish(broker, current_user.id, 'image_added', album_id=None, image=media_json(image))
+    derivatives.submit(storage, filename)
     return jsonify({'message': 'Plik został zapisany'}), 200
 
 
 @app.route('/api/images', methods=['GET'])
 @token_required
 def get_user_images(current_user):
-    images = Image.query.filter_by(user_id=current_user.id)\
-                       .order_by(Image.uploaded_at.desc())\
-                       .all()
-    return jsonify([{
-        'filename': img.filename,
-        'description': img.description,
-        'uploaded_at': img.uploaded_at.strftime('%Y-%m-%d %H:%M')
-    } for img in images]), 200
+    etag = etag_for('images', current_user.id, current_user.library_version)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    def build():
+        images = db.session.query(*LISTING_COLUMNS)\
+                           .filter_by(user_id=current_user.id, posted=True, deleted_at=None)\
+                           .order_by(Image.uploaded_at.desc())\
+                           .all()
+        return [media_json(img) for img in images]
+    return cached_json(f'u{current_user.id}:images', build, current_user.library_version, etag)
+
+
+@app.route('/api/images/sprite', methods=['GET'])
+@token_required
+def user_images_sprite(current_user):
+    keys = [r.filename for r in db.session.query(Image.filename)
+            .filter_by(user_id=current_user.id, posted=True, deleted_at=None)
+            .order_by(Image.uploaded_at.desc())]
+    return sprite_response(current_user, f'u{current_user.id}-images', keys)
+
+
+@app.route('/api/images/similar', methods=['GET'])
+@token_required
+def find_similar_images(current_user):
+    """Near-duplicates of a dHash (hex, computed by the client) within hamming distance k."""
+    try:
+        h = phash.from_hex(request.args.get('hash', ''))
+    except ValueError:
+        return jsonify({'error': 'hash must be a 64-bit hex dHash'}), 400
+    return similar_response(current_user, h)
+
+
+@app.route('/api/images/<filename>/similar', methods=['GET'])
+@token_required
+def similar_to_image(current_user, filename):
+    row = Image.query.filter_by(filename=filename, user_id=current_user.id, deleted_at=None).first()
+    if not row:
+        return jsonify({'error': 'Image not found or not yours'}), 404
+    if not row.phash:
+        return jsonify({'error': 'Image has no perceptual hash yet'}), 409
+    return similar_response(current_user, phash.from_hex(row.phash), exclude=filename)
 
 
 @app.route('/api/images/<filename>', methods=['DELETE'])
 @token_required
+@limiter.limit('write')
+@idempotent
 def delete_image(current_user, filename):
-    img = Image.query.filter_by(filename=filename, user_id=current_user.id).first()
+    """Deletes a photo from posts and every album; see DELETE /api/albums/<aid>/media/<id> to only remove it from one."""
+    img = Image.query.filter_by(filename=filename, user_id=current_user.id, deleted_at=None).first()
     if not img:
         return jsonify({'error': 'Image not found or not yours'}), 404
+    # the file itself is reclaimed by the collector after the commit
+    delete_media(current_user, [img])
+    return jsonify({'message': 'Image deleted'}), 200
 
-    # remove file from disk
-    path = os.path.join(UPLOAD_FOLDER, filename)
-    if os.path.exists(path):
-        try:
-            os.remove(path)
-        except Exception as e:
-            return jsonify({'error': 'Could not delete file', 'details': str(e)}), 500
 
-    # remove from DB
-    db.session.delete(img)
-    db.session.commit()
-    return jsonify({'message': 'Image deleted'}), 200
+@app.route('/api/images/delete', methods=['POST'])
+@token_required
+@limiter.limit('write')
+@idempotent
+def bulk_delete_images(current_user):
+    """Deletes many photos of the current user (from posts and every album) in one transaction."""
+    data = request.get_json() or {}
+    filenames = data.get('filenames')
+    if not isinstance(filenames, list) or not filenames:
+        return jsonify({'error': 'filenames must be a non-empty list'}), 400
+    if len(filenames) > 1000:
+        return jsonify({'error': 'At most 1000 files per request'}), 400
+    images = Image.query.filter(Image.filename.in_(filenames),
+                                Image.user_id == current_user.id,
+                                Image.deleted_at.is_(None)).all()
+    return jsonify({'deleted': delete_media(current_user, images)}), 202
+
+
+@app.route('/api/events', methods=['GET'])
+@token_required
+def event_stream(current_user):
+    """
+    Server-sent events for the user's library: image_added, images_deleted
+    (album_id is null for posts), album_created, album_deleted, and reset
+    when events were missed. Resumes after the Last-Event-ID header.
+    """
+    last_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id', ''))
+    last_id = int(last_id) if last_id.isdigit() else None
+    return Response(events.stream(broker, current_user.id, last_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 # —————— Albums endpoints ——————
@@ -205,19 +881,28 @@ def delete_image(current_user, filename):
 @app.route('/api/albums', methods=['GET'])
 @token_required
 def list_albums(current_user):
-    albums = Album.query.filter_by(user_id=current_user.id)\
-                        .order_by(Album.created_at.desc())\
-                        .all()
-    return jsonify([{
-        'id': alb.id,
-        'name': alb.name,
-        'description': alb.description,
-        'created_at': alb.created_at.isoformat()
-    } for alb in albums]), 200
+    etag = etag_for('albums', current_user.id, current_user.library_version)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    def build():
+        albums = db.session.query(Album.id, Album.name, Album.description, Album.created_at)\
+                           .filter_by(user_id=current_user.id, deleted_at=None)\
+                           .order_by(Album.created_at.desc())\
+                           .all()
+        return [{
+            'id': alb.id,
+            'name': alb.name,
+            'description': alb.description,
+            'created_at': alb.created_at.isoformat()
+        } for alb in albums]
+    return cached_json(f'u{current_user.id}:albums', build, current_user.library_version, etag)
 
 
 @app.route('/api/albums', methods=['POST'])
 @token_required
+@limiter.limit('write')
+@idempotent
 def create_album(current_user):
     data = request.get_json() or {}
     name = data.get('name','').strip()
@@ -227,35 +912,80 @@ def create_album(current_user):
                 name=name,
                 description=data.get('description',''))
     db.session.add(alb)
+    bump_library_version(current_user)
     db.session.commit()
-    return jsonify({
+    invalidate_results(current_user.id, 'albums')
+    album = {
         'id': alb.id,
         'name': alb.name,
         'description': alb.description,
         'created_at': alb.created_at.isoformat()
-    }), 201
+    }
+    events.publish(broker, current_user.id, 'album_created', album=album)
+    return jsonify(album), 201
+
+
+@app.route('/api/albums/<int:aid>', methods=['DELETE'])
+@token_required
+@limiter.limit('write')
+@idempotent
+def delete_album(current_user, aid):
+    alb = Album.query.filter_by(id=aid, deleted_at=None).first_or_404()
+    if alb.user_id != current_user.id:
+        return jsonify({'error':'Forbidden'}), 403
+    image_ids = [r[0] for r in db.session.query(AlbumMembership.image_id).filter_by(album_id=aid)]
+    alb.deleted_at = datetime.datetime.utcnow()
+    AlbumMembership.query.filter_by(album_id=aid).delete(synchronize_session=False)
+    # photos that are also posts or in other albums stay
+    deleted = drop_orphans(image_ids)
+    bump_library_version(current_user)
+    db.session.commit()
+    invalidate_results(current_user.id, 'albums', f'album:{aid}')
+    events.publish(broker, current_user.id, 'album_deleted', album_id=aid)
+    collector.wake()
+    return jsonify({'message': 'Album deleted', 'deleted': deleted}), 202
+
+
+def album_images(aid, *columns):
+    """Query for `columns` of the album's live images, most recently added first."""
+    return db.session.query(*columns)\
+                     .join(AlbumMembership, AlbumMembership.image_id == Image.id)\
+                     .filter(AlbumMembership.album_id == aid, Image.deleted_at.is_(None))\
+                     .order_by(AlbumMembership.added_at.desc(), AlbumMembership.id.desc())
 
 
 @app.route('/api/albums/<int:aid>/images', methods=['GET'])
 @token_required
 def list_album_images(current_user, aid):
-    alb = Album.query.get_or_404(aid)
+    alb = Album.query.filter_by(id=aid, deleted_at=None).first_or_404()
+    if alb.user_id != current_user.id:
+        return jsonify({'error':'Forbidden'}), 403
+    etag = etag_for('album', aid, current_user.library_version)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+    def build():
+        imgs = album_images(aid, *LISTING_COLUMNS).all()
+        return [media_json(img) for img in imgs]
+    return cached_json(f'u{current_user.id}:album:{aid}', build, current_user.library_version, etag)
+
+
+@app.route('/api/albums/<int:aid>/images/sprite', methods=['GET'])
+@token_required
+def album_images_sprite(current_user, aid):
+    alb = Album.query.filter_by(id=aid, deleted_at=None).first_or_404()
     if alb.user_id != current_user.id:
         return jsonify({'error':'Forbidden'}), 403
-    imgs = AlbumImage.query.filter_by(album_id=aid)\
-                            .order_by(AlbumImage.uploaded_at.desc())\
-                            .all()
-    return jsonify([{
-        'filename': img.filename,
-        'description': img.description,
-        'uploaded_at': img.uploaded_at.strftime('%Y-%m-%d %H:%M')
-    } for img in imgs]), 200
+    keys = [r.filename for r in album_images(aid, Image.filename)]
+    return sprite_response(current_user, f'u{current_user.id}-album{aid}', keys)
 
 
 @app.route('/api/albums/<int:aid>/images', methods=['POST'])
 @token_required
+@limiter.limit('upload')
+@idempotent
 def add_image_to_album(current_user, aid):
-    alb = Album.query.get_or_404(aid)
+    alb = Album.query.filter_by(id=aid, deleted_at=None).first_or_404()
     if alb.user_id != current_user.id:
         return jsonify({'error':'Forbidden'}), 403
     if 'file' not in request.files:
@@ -264,21 +994,303 @@ def add_image_to_album(current_user, aid):
     if file.filename == '':
         return jsonify({'error':'Nie wybrano pliku'}), 400
     desc = request.form.get('description','')
-    filename = f"album{aid}_{file.filename}"
-    file.save(os.path.join(UPLOAD_FOLDER, filename))
-    ai = AlbumImage(album_id=aid, filename=filename, description=desc)
-    db.session.add(ai)
+    attrs, error = store_upload(file)
+    if error:
+        return error
+    filename = attrs['filename']
+    image = Image(user_id=current_user.id, description=desc, posted=False, **attrs)
+    db.session.add(image)
+    db.session.flush()
+    db.session.add(AlbumMembership(album_id=aid, image_id=image.id))
+    bump_library_version(current_user)
+    commit_or_discard(filename)
+    invalidate_results(current_user.id, f'album:{aid}')
+    events.publish(broker, current_user.id, 'image_added', album_id=aid, image=media_json(image))
+    derivatives.submit(storage, filename)
+    return jsonify(media_json(image)), 201
+
+
+@app.route('/api/albums/<int:aid>/media', methods=['POST'])
+@token_required
+@limiter.limit('write')
+@idempotent
+def add_media_to_album(current_user, aid):
+    """Adds photos the user already has (posts or other albums' photos) by id: {"ids": [...]}."""
+    alb = Album.query.filter_by(id=aid, deleted_at=None).first_or_404()
+    if alb.user_id != current_user.id:
+        return jsonify({'error':'Forbidden'}), 403
+    ids = (request.get_json() or {}).get('ids')
+    if not isinstance(ids, list) or not ids or not all(isinstance(i, int) for i in ids):
+        return jsonify({'error': 'ids must be a non-empty list of image ids'}), 400
+    if len(ids) > 1000:
+        return jsonify({'error': 'At most 1000 images per request'}), 400
+    images = Image.query.filter(Image.id.in_(ids), Image.user_id == current_user.id,
+                                Image.deleted_at.is_(None)).all()
+    if len(images) != len(set(ids)):
+        return jsonify({'error': 'Image not found or not yours'}), 404
+    present = {r[0] for r in db.session.query(AlbumMembership.image_id)
+                                        .filter(AlbumMembership.album_id == aid,
+                                                AlbumMembership.image_id.in_(ids))}
+    added = sorted((img for img in images if img.id not in present), key=lambda img: ids.index(img.id))
+    for img in added:
+        db.session.add(AlbumMembership(album_id=aid, image_id=img.id))
+    if added:
+        bump_library_version(current_user)
+    try:
+        db.session.commit()
+    except IntegrityError:      # a concurrent request added some of them first
+        db.session.rollback()
+        return jsonify({'error': 'Album changed meanwhile, try again'}), 409
+    invalidate_results(current_user.id, f'album:{aid}')
+    for img in added:
+        events.publish(broker, current_user.id, 'image_added', album_id=aid, image=media_json(img))
+    return jsonify({'added': [media_json(img) for img in added]}), 200
+
+
+@app.route('/api/albums/<int:aid>/media/<int:image_id>', methods=['DELETE'])
+@token_required
+@limiter.limit('write')
+@idempotent
+def remove_media_from_album(current_user, aid, image_id):
+    """Takes a photo out of the album; the photo itself is deleted only if nothing else holds it."""
+    alb = Album.query.filter_by(id=aid, deleted_at=None).first_or_404()
+    if alb.user_id != current_user.id:
+        return jsonify({'error':'Forbidden'}), 403
+    row = db.session.query(AlbumMembership, Image.filename)\
+                    .join(Image, Image.id == AlbumMembership.image_id)\
+                    .filter(AlbumMembership.album_id == aid, AlbumMembership.image_id == image_id)\
+                    .first()
+    if not row:
+        return jsonify({'error': 'Image is not in this album'}), 404
+    membership, filename = row
+    db.session.delete(membership)
+    db.session.flush()
+    deleted = drop_orphans([image_id])
+    bump_library_version(current_user)
     db.session.commit()
-    return jsonify({
-        'filename': ai.filename,
-        'description': ai.description,
-        'uploaded_at': ai.uploaded_at.strftime('%Y-%m-%d %H:%M')
-    }), 201
+    invalidate_results(current_user.id, f'album:{aid}')
+    events.publish(broker, current_user.id, 'images_deleted', album_id=aid, filenames=[filename])
+    if deleted:
+        collector.wake()
+    return jsonify({'message': 'Removed from album', 'deleted': deleted}), 200
+
+
+# —————— Export ——————
+
+UNSAFE_PATH_CHARS = re.compile(r'[^\w\- ]+')     # in album folder names inside the ZIP
+
+
+def export_archive(user):
+    """
+    export.Archive of the user's posts and album photos plus manifest.json,
+    and its ETag: a digest of the manifest, which lists every file with its
+    size, so the same ETag always means the same bytes. A photo that is a
+    post and in albums (or in several albums) is stored once, in the first
+    folder that lists it; the manifest points every listing at that file.
+    """
+    entries = []
+    placed = {}     # filename -> (name in the archive, size)
+
+    def add(folder, row):
+        if row.filename not in placed:
+            path = storage.path(row.filename)
+            try:
+                size = os.path.getsize(path)
+            except OSError:         # not stored (yet) or already collected
+                return None
+            placed[row.filename] = (f"{folder}/{row.filename}", size)
+            entries.append(export.file_entry(placed[row.filename][0], path, size,
+                                             row.taken_at or row.uploaded_at))
+        name, size = placed[row.filename]
+        return {**media_json(row), 'file': name, 'bytes': size}
+
+    posts = Image.query.filter_by(user_id=user.id, posted=True, deleted_at=None).order_by(Image.id).all()
+    manifest = {'user_id': user.id, 'posts': [], 'albums': []}
+    manifest['posts'] = [m for m in (add('posts', row) for row in posts) if m]
+    for alb in Album.query.filter_by(user_id=user.id, deleted_at=None).order_by(Album.id):
+        folder = f"albums/{alb.id} {UNSAFE_PATH_CHARS.sub('_', alb.name).strip()}".rstrip()
+        photos = album_images(alb.id, Image)
+        manifest['albums'].append({
+            'id': alb.id,
+            'name': alb.name,
+            'description': alb.description,
+            'created_at': alb.created_at.isoformat(),
+            'photos': [m for m in (add(folder, row) for row in photos) if m],
+        })
+    body = json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+    entries.insert(0, export.bytes_entry('manifest.json', body, None))
+    etag = etag_for('export', user.id, hashlib.sha256(body).hexdigest()[:20])
+    return export.Archive(entries), etag
+
+
+@app.route('/api/export', methods=['GET'])
+@token_required
+@limiter.limit('export')
+def export_library(current_user):
+    """
+    The whole library as one ZIP, generated while it is sent. Honors a
+    single byte range (with If-Range) so an interrupted download resumes.
+    """
+    archive, etag = export_archive(current_user)
+    start, stop, status = 0, archive.size, 200
+    if_range = request.headers.get('If-Range')
+    if request.range and (if_range is None or if_range == f'"{etag}"'):
+        span = request.range.range_for_length(archive.size)
+        if span is None:
+            resp = Response(status=416)
+            resp.headers['Content-Range'] = f'bytes */{archive.size}'
+            return resp
+        start, stop, status = span[0], span[1], 206
+
+    def body():
+        sent = 0
+        try:
+            for chunk in archive.iter_range(start, stop):
+                sent += len(chunk)
+                yield chunk
+        finally:
+            metrics.inc('export_bytes_total', sent)
+
+    resp = Response(body(), status=status, mimetype='application/zip', direct_passthrough=True)
+    resp.set_etag(etag)
+    resp.headers['Accept-Ranges'] = 'bytes'
+    resp.headers['Content-Length'] = str(stop - start)
+    resp.headers['Content-Disposition'] = f'attachment; filename="library-{current_user.id}.zip"'
+    resp.headers['Cache-Control'] = 'private, no-store'
+    if status == 206:
+        resp.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{archive.size}'
+    return resp
 
 
 @app.route('/uploads/<path:filename>', methods=['GET'])
 def get_uploaded_file(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    if filename.endswith('.' + derivatives.ARCHIVE_VARIANT):
+        return jsonify({'error': 'Not found'}), 404     # as received, EXIF/GPS included
+    try:
+        key, mimetype = derivatives.negotiate(storage, filename, request.accept_mimetypes)
+        path = storage.path(key)
+    except ValueError:
+        return jsonify({'error': 'Not found'}), 404
+    resp = send_from_directory(os.path.dirname(path), os.path.basename(path), mimetype=mimetype)
+    resp.vary.add('Accept')
+    if KEY_RE.match(filename):
+        # generated keys never change content
+        resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp
+
+
+@app.route('/avatars/<name>', methods=['GET'])
+def get_avatar(name):
+    m = avatars.NAME_RE.match(name)
+    if not m:
+        return jsonify({'error': 'Not found'}), 404
+    if m['owner'] == 'default' and m['version'] == avatars.DEFAULT_VERSION and int(m['size']) in avatars.SIZES:
+        avatars.ensure_default(storage, int(m['size']))
+    path = storage.path(name)
+    if not os.path.isfile(path):
+        return jsonify({'error': 'Not found'}), 404
+    resp = send_from_directory(os.path.dirname(path), os.path.basename(path), mimetype='image/png')
+    # a new picture gets new names, so an avatar URL's content never changes
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp
+
+
+@app.route('/api/users', methods=['GET'])
+@token_required
+def search_users(current_user):
+    """?q=<username or email prefix>; at most 20 matches."""
+    q = request.args.get('q', '').strip()
+    if len(q) < 2:
+        return jsonify([]), 200
+    like = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    users = User.query.filter(User.id != current_user.id,
+                              db.or_(User.username.ilike(like, escape='\\'),
+                                     User.email.ilike(like, escape='\\')))\
+                      .order_by(User.follower_count.desc()).limit(20).all()
+    followed = {r[0] for r in db.session.query(Follow.followee_id).filter(
+        Follow.follower_id == current_user.id, Follow.followee_id.in_([u.id for u in users]))}
+    return jsonify([follow_json(u, u.id in followed) for u in users]), 200
+
+
+@app.route('/api/users/<int:uid>/follow', methods=['POST'])
+@token_required
+@limiter.limit('write')
+@idempotent
+def follow_user(current_user, uid):
+    if uid == current_user.id:
+        return jsonify({'error': 'Nie można obserwować samego siebie'}), 400
+    target = User.query.filter_by(id=uid).first_or_404()
+    if Follow.query.filter_by(follower_id=current_user.id, followee_id=uid).first():
+        return jsonify(follow_json(target, True)), 200
+    try:
+        db.session.add(Follow(follower_id=current_user.id, followee_id=uid,
+                              merge_on_read=target.fanout_on_read))
+        current_user.following_count = User.following_count + 1
+        target.follower_count = User.follower_count + 1
+        bump_profile_version(current_user, target)
+        db.session.flush()
+        if target.fanout_on_read:
+            pass        # the follow row already merges their posts at read time
+        elif target.follower_count >= CELEBRITY_FOLLOWERS:
+            # from now on the author's posts are merged at read time; existing entries stay
+            target.fanout_on_read = True
+            Follow.query.filter_by(followee_id=uid).update({'merge_on_read': True}, synchronize_session=False)
+        else:
+            recent = db.select(db.literal(current_user.id), Image.id, db.literal(uid))\
+                       .where(Image.user_id == uid, Image.posted, Image.deleted_at.is_(None))\
+                       .order_by(Image.id.desc()).limit(TIMELINE_BACKFILL)
+            db.session.execute(db.insert(TimelineEntry)
+                                 .from_select(['user_id', 'image_id', 'author_id'], recent))
+            trim_timelines([current_user.id])
+        db.session.commit()
+    except IntegrityError:      # a concurrent request followed first; its counts stand
+        db.session.rollback()
+        return jsonify(follow_json(target, True)), 200
+    invalidate_results(current_user.id, 'profile')
+    invalidate_results(uid, 'profile')
+    return jsonify(follow_json(target, True)), 200
+
+
+@app.route('/api/users/<int:uid>/follow', methods=['DELETE'])
+@token_required
+@limiter.limit('write')
+@idempotent
+def unfollow_user(current_user, uid):
+    target = User.query.filter_by(id=uid).first_or_404()
+    deleted = Follow.query.filter_by(follower_id=current_user.id, followee_id=uid)\
+                          .delete(synchronize_session=False)
+    if deleted:
+        current_user.following_count = User.following_count - 1
+        target.follower_count = User.follower_count - 1
+        bump_profile_version(current_user, target)
+        TimelineEntry.query.filter_by(user_id=current_user.id, author_id=uid)\
+                           .delete(synchronize_session=False)
+        db.session.commit()
+        invalidate_results(current_user.id, 'profile')
+        invalidate_results(uid, 'profile')
+    return jsonify(follow_json(target, False)), 200
+
+
+@app.route('/api/feed', methods=['GET'])
+@token_required
+def get_home_feed(current_user):
+    """Home feed page: ?before=<cursor from the previous page>&limit=N."""
+    before = request.args.get('before', type=int)
+    limit = min(max(request.args.get('limit', FEED_PAGE, type=int), 1), FEED_MAX_PAGE)
+    posts, cursor = home_feed(current_user, before, limit)
+    return json_response({'items': posts, 'next': cursor})
+
+
+@app.route('/sprites/<name>', methods=['GET'])
+def get_sprite(name):
+    try:
+        path = sprite_cache.path(name)
+    except ValueError:
+        return jsonify({'error': 'Not found'}), 404
+    resp = send_from_directory(os.path.dirname(path), os.path.basename(path), mimetype='image/jpeg')
+    # a changed listing gets a new name, so a sheet's content never changes
+    resp.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return resp
 
 
 @app.route('/api/secure', methods=['GET'])
@@ -287,9 +1299,164 @@ def secure(current_user):
     return jsonify({'message': f'Zalogowano jako {current_user.email}'}), 200
 
 
+@app.cli.command('dedupe-report')
+@click.option('--k', default=6, show_default=True, help='Max hamming distance between dHashes.')
+@click.option('--user', 'user_id', type=int, default=None, help='Limit to one user.')
+@click.option('--fill-missing', is_flag=True, help='Hash rows that have no dHash yet first.')
+def dedupe_report(k, user_id, fill_missing):
+    """Lists near-duplicate groups across the library."""
+    if fill_missing:
+        filled = 0
+        for row in Image.query.filter(Image.phash.is_(None), Image.deleted_at.is_(None)).all():
+            row.phash = compute_phash(row.filename)
+            filled += row.phash is not None
+        db.session.commit()
+        click.echo(f"hashed {filled} files")
+
+    users = [user_id] if user_id else [u.id for u in db.session.query(User.id)]
+    total = 0
+    for uid in users:
+        groups = phash.duplicate_groups(library_hashes(uid), k)
+        for group in groups:
+            total += len(group) - 1
+            click.echo(f"user {uid}: {len(group)} near-duplicates")
+            for filename, description in group:
+                click.echo(f"    {filename}  {description or ''}")
+    click.echo(f"{total} redundant files (k={k})")
+
+
+
+def load_checkpoint(name, restart):
+    cp = db.session.get(JobCheckpoint, name)
+    if cp is None:
+        cp = JobCheckpoint(name=name)
+        db.session.add(cp)
+    if restart:
+        cp.position = None
+    return cp
+
+
+@app.cli.command('ingest')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--user', 'user_id', type=int, required=True, help='Owner of the imported photos.')
+@click.option('--album', 'album_id', type=int, default=None, help='Import into this album instead of posts.')
+@click.option('--workers', type=int, default=os.cpu_count(), show_default=True)
+@click.option('--batch', 'batch_size', type=int, default=ingest.BATCH_SIZE, show_default=True)
+@click.option('--no-derivatives', is_flag=True, help='Leave WebP/AVIF generation to a later backfill.')
+@click.option('--restart', is_flag=True, help='Ignore the saved position and start from the top.')
+def ingest_command(directory, user_id, album_id, workers, batch_size, no_derivatives, restart):
+    """Imports every image under DIRECTORY for a user, resuming where a previous run stopped."""
+    migrate_schema()
+    user = db.session.get(User, user_id)
+    if user is None:
+        raise click.BadParameter(f"no user {user_id}", param_hint='--user')
+    if album_id is not None:
+        alb = Album.query.filter_by(id=album_id, user_id=user_id, deleted_at=None).first()
+        if alb is None:
+            raise click.BadParameter(f"user {user_id} has no album {album_id}", param_hint='--album')
+    directory = os.path.abspath(directory)
+    cp = load_checkpoint(f"ingest:{user_id}:{album_id or ''}:{directory}", restart)
+    db.session.commit()
+    if cp.position:
+        click.echo(f"resuming after {cp.position}")
+    progress = ingest.Throughput(click.echo)
+
+    def write(batch, results):
+        keys = [r['filename'] for r in results if r['filename']]
+        images = []
+        for r in results:
+            if r['error']:
+                click.echo(f"  {r['source']}: {r['error']}", err=True)
+            if r['filename']:
+                images.append(Image(user_id=user_id, filename=r['filename'], posted=album_id is None,
+                                    **r['values']))
+        db.session.add_all(images)
+        db.session.flush()
+        if album_id is not None:
+            db.session.add_all(AlbumMembership(album_id=album_id, image_id=img.id) for img in images)
+        else:
+            for img in images:
+                fan_out(img, user)
+        bump_library_version(user)
+        cp.position = batch[-1]
+        commit_or_discard(*keys)        # rows and resume position land together
+        invalidate_results(user_id, 'images' if album_id is None else f'album:{album_id}')
+        progress.add(results)
+
+    batches = ingest.batched(ingest.walk(directory, after=cp.position), batch_size)
+    ingest.run(ingest.import_file, batches, storage.root, workers, write,
+               arg=lambda rel: os.path.join(directory, *rel.split('/')),
+               with_derivatives=not no_derivatives)
+    trim_fanned_out()       # no collector runs in this process
+    db.session.commit()
+    progress.report(final=True)
+
+
+@app.cli.command('backfill')
+@click.option('--workers', type=int, default=os.cpu_count(), show_default=True)
+@click.option('--batch', 'batch_size', type=int, default=ingest.BATCH_SIZE, show_default=True)
+@click.option('--no-derivatives', is_flag=True, help='Only fill database columns.')
+@click.option('--restart', is_flag=True, help='Revisit rows a previous run already passed (e.g. failures).')
+def backfill_command(workers, batch_size, no_derivatives, restart):
+    """Fills dimensions, EXIF fields, dHashes, derivatives and avatars for rows stored before they existed."""
+    migrate_schema()
+    adopted = sum(adopt_legacy_avatar(u) for u in User.query.filter(User.avatar_version.is_(None)))
+    db.session.commit()
+    if adopted:
+        click.echo(f"rendered avatars for {adopted} users")
+    progress = ingest.Throughput(click.echo)
+    cp = load_checkpoint("backfill:image", restart)
+    db.session.commit()
+    pending = (Image.width.is_(None)) | (Image.phash.is_(None)) | (Image.blurhash.is_(None))
+
+    def batches():
+        after = int(cp.position or 0)
+        while True:
+            rows = db.session.query(Image.id, Image.filename, Image.user_id, Image.posted)\
+                             .filter(Image.id > after, Image.deleted_at.is_(None), pending)\
+                             .order_by(Image.id).limit(batch_size).all()
+            if not rows:
+                return
+            after = rows[-1].id
+            yield rows
+
+    def write(rows, results):
+        updates = []
+        for row, r in zip(rows, results):
+            if r['error']:
+                click.echo(f"  image {row.id} {row.filename}: {r['error']}", err=True)
+            values = {k: v for k, v in r['values'].items() if v is not None}
+            if values:
+                updates.append({'id': row.id, **values})
+        db.session.bulk_update_mappings(Image, updates)
+        # listings embed the new columns: every owner's cached posts and albums go stale
+        touched = {}
+        updated = {u['id'] for u in updates}
+        for row in rows:
+            if row.posted and row.id in updated:
+                touched.setdefault(row.user_id, set()).add('images')
+        albums = db.session.query(Album.user_id, AlbumMembership.album_id)\
+                           .join(AlbumMembership, AlbumMembership.album_id == Album.id)\
+                           .filter(AlbumMembership.image_id.in_(updated)).distinct()
+        for uid, aid in albums:
+            touched.setdefault(uid, set()).add(f'album:{aid}')
+        for user in User.query.filter(User.id.in_(touched)):
+            bump_library_version(user)
+        cp.position = str(rows[-1].id)
+        db.session.commit()
+        for uid, kinds in touched.items():
+            invalidate_results(uid, *kinds)
+        progress.add(results)
+
+    ingest.run(ingest.analyse, batches(), storage.root, workers, write,
+               arg=lambda row: row.filename, with_derivatives=not no_derivatives)
+    progress.report(final=True)
+
+
 if __name__ == '__main__':
-    if not os.path.exists('users.db'):
-        with app.app_context():
-            db.create_all()
-            print("🧱 Baza danych utworzona.")
+    with app.app_context():
+        migrate_schema()
+    # housekeeping tasks run on its passes, so start it before the first delete wakes it;
+    # the reloader's parent runs one too, which is harmless (removal is idempotent)
+    collector.start()
     app.run(port=3000, debug=True)
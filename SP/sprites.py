@@ -0,0 +1,170 @@
+# sprites.py
+import hashlib
+import hmac
+import json
+import logging
+import math
+import os
+import re
+import tempfile
+import threading
+import time
+
+from PIL import Image as PILImage
+
+import imaging
+import metrics
+
+log = logging.getLogger("insta.sprites")
+
+PER_PAGE = 30           # tiles per sheet; one sheet per grid page
+COLS = 6
+DEFAULT_TILE = 180
+MIN_TILE, MAX_TILE = 64, 360
+QUALITY = 82
+MAX_AGE_S = 7 * 24 * 3600
+
+# <scope>.<version>.<page>.<tile>.<mac>.jpg, scope like "u12-images" or "u12-album5"
+NAME_RE = re.compile(r"^(?P<scope>[a-z0-9-]{1,40})\.(?P<version>\d+)\.\d+\.\d+\.[0-9a-f]{16}\.jpg$")
+
+metrics.REGISTRY.describe("sprite_requests_total", "counter", "Sprite-sheet lookups by cache result.")
+
+
+class SpriteCache:
+    """
+    Sprite sheets (one JPEG holding a page of square thumbnails) plus their
+    JSON offset maps, in a flat directory outside the media root. Names
+    embed the listing's library_version, so a changed listing simply asks
+    for a new name; the sheets this process stored for an older version of
+    a listing are deleted when a newer one is stored, the rest expire via
+    prune(). The MAC makes names unguessable, since /sprites is served
+    without a token.
+    """
+
+    def __init__(self, root, secret):
+        self.root = os.path.abspath(root)
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self._stored = {}       # scope -> (version, names stored for that version)
+        self._stored_lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def name(self, scope, version, page, tile):
+        base = f"{scope}.{version}.{page}.{tile}"
+        mac = hmac.new(self.secret, base.encode(), hashlib.sha256).hexdigest()[:16]
+        return f"{base}.{mac}.jpg"
+
+    def path(self, name):
+        if not NAME_RE.match(name):
+            raise ValueError(f"invalid sprite name: {name!r}")
+        return os.path.join(self.root, name)
+
+    def get_map(self, name):
+        try:
+            with open(self.path(name) + ".json", encoding="utf-8") as fh:
+                offsets = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return None
+        return offsets if os.path.isfile(self.path(name)) else None
+
+    def touch(self, name):
+        """Marks a sheet as used so prune() keeps it."""
+        for p in (self.path(name), self.path(name) + ".json"):
+            try:
+                os.utime(p)
+            except FileNotFoundError:
+                pass
+
+    def put(self, name, sheet, offsets):
+        """Stores sheet then map (readers check the map first), then drops older versions."""
+        self._write(self.path(name), lambda fh: sheet.save(fh, "JPEG", quality=QUALITY, progressive=True))
+        self._write(self.path(name) + ".json", lambda fh: fh.write(json.dumps(offsets).encode()))
+        self._invalidate(name)
+
+    def _write(self, final, dump):
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                dump(fh)
+            os.replace(tmp, final)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def _invalidate(self, name):
+        m = NAME_RE.match(name)
+        scope, version = m["scope"], int(m["version"])
+        with self._stored_lock:
+            known, names = self._stored.get(scope, (version, set()))
+            if version < known:
+                return          # a late request for an older version; prune() takes its sheet
+            old = names if version > known else set()
+            self._stored[scope] = (version, (names if version == known else set()) | {name})
+        for other in old:
+            _unlink(self.path(other))
+            _unlink(self.path(other) + ".json")
+
+    def prune(self, max_age=MAX_AGE_S):
+        """Removes sheets not requested for `max_age` seconds (deleted albums, old versions)."""
+        cutoff = time.time() - max_age
+        removed = 0
+        for entry in os.scandir(self.root):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    removed += _unlink(entry.path)
+            except FileNotFoundError:
+                pass
+        if removed:
+            log.info("pruned %d sprite files", removed)
+        return removed
+
+
+def _unlink(path):
+    try:
+        os.remove(path)
+        return 1
+    except FileNotFoundError:
+        return 0
+
+
+def page_count(n, per_page=PER_PAGE):
+    return max(1, math.ceil(n / per_page))
+
+
+def compose(storage, keys, tile):
+    """Draws square thumbnails of `keys` row by row; returns (sheet, {key: [x, y]})."""
+    rows = max(1, math.ceil(len(keys) / COLS))
+    sheet = PILImage.new("RGB", (min(len(keys), COLS) * tile or tile, rows * tile), "#ddd")
+    offsets = {}
+    for i, key in enumerate(keys):
+        x, y = (i % COLS) * tile, (i // COLS) * tile
+        try:
+            with open(storage.path(key), "rb") as fh:
+                thumb = imaging.square_thumbnail(fh, tile)
+        except (OSError, ValueError) as e:      # missing/corrupt/too large: leave the grey tile
+            log.warning("sprite tile %s skipped: %s", key, e)
+        else:
+            sheet.paste(thumb.convert("RGB"), (x, y))
+        offsets[key] = [x, y]
+    return sheet, offsets
+
+
+def sheet_for(cache, storage, gate, scope, version, page, tile, keys):
+    """
+    (name, offsets) of the sheet for one page of `keys`; a cache miss
+    composes it while holding a slot of the image ConcurrencyGate `gate`.
+    """
+    name = cache.name(scope, version, page, tile)
+    offsets = cache.get_map(name)
+    if offsets is not None:
+        cache.touch(name)
+        metrics.inc("sprite_requests_total", result="hit")
+        return name, offsets
+    metrics.inc("sprite_requests_total", result="miss")
+    chunk = keys[page * PER_PAGE:(page + 1) * PER_PAGE]
+    with gate.slot(), metrics.timed("image_processing_seconds", op="sprite"):
+        sheet, offsets = compose(storage, chunk, tile)
+    cache.put(name, sheet, offsets)
+    return name, offsets
@@ -0,0 +1,132 @@
+# storage.py
+import os
+import re
+import secrets
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+# Generated keys are 32 hex chars (+ extension); derivatives append ".<variant>".
+KEY_RE     = re.compile(r"^[0-9a-f]{32}(\.[a-z0-9_]{1,12})*$")
+EXT_RE     = re.compile(r"^\.[a-z0-9]{1,5}$")
+TMP_PREFIX = ".tmp-"
+COPY_CHUNK = 1 << 20
+
+
+class MediaStorage:
+    """
+    Media files under an absolute root directory.
+
+    New files get random keys and live in two levels of hash-sharded
+    directories (root/ab/cd/abcd....jpg) so no directory grows past a few
+    hundred entries. Legacy flat names (user1_x.jpg, profile_1.jpg) resolve
+    directly under the root. Writes go to a temp file in the target
+    directory, are fsynced and then published with a link/rename, so
+    readers never see partial files and concurrent workers never clobber
+    each other. `variants` names the derivatives a key may have, so
+    deleting a legacy key never has to list the (large, flat) root.
+    """
+
+    def __init__(self, root, variants=()):
+        self.root = os.path.abspath(root)
+        self.variants = tuple(variants)
+        os.makedirs(self.root, exist_ok=True)
+
+    def new_key(self, original_name=""):
+        ext = os.path.splitext(original_name or "")[1].lower()
+        if ext == ".jpeg":
+            ext = ".jpg"
+        return secrets.token_hex(16) + (ext if EXT_RE.match(ext) else "")
+
+    def path(self, key):
+        if not key or "/" in key or "\\" in key or key.startswith("."):
+            raise ValueError(f"invalid storage key: {key!r}")
+        if KEY_RE.match(key):
+            return os.path.join(self.root, key[:2], key[2:4], key)
+        return os.path.join(self.root, key)
+
+    def exists(self, key):
+        try:
+            return os.path.isfile(self.path(key))
+        except ValueError:
+            return False
+
+    @contextmanager
+    def writer(self, key, overwrite=False):
+        """Yields a binary file; its content becomes `key` atomically on success."""
+        final = self.path(key)
+        directory = os.path.dirname(final)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=TMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                yield fh
+                fh.flush()
+                os.fsync(fh.fileno())
+            if overwrite:
+                os.replace(tmp, final)
+            else:
+                os.link(tmp, final)     # fails with FileExistsError instead of clobbering
+                os.unlink(tmp)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+        _fsync_dir(directory)
+
+    def save(self, key, stream, overwrite=False):
+        with self.writer(key, overwrite=overwrite) as fh:
+            if isinstance(stream, (bytes, bytearray, memoryview)):
+                fh.write(stream)
+            else:
+                shutil.copyfileobj(stream, fh, COPY_CHUNK)
+        return key
+
+    def rename(self, key, new_key):
+        """Moves a stored file to a new key (never over an existing one)."""
+        src, dst = self.path(key), self.path(new_key)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        os.link(src, dst)
+        os.unlink(src)
+        _fsync_dir(os.path.dirname(dst))
+        _fsync_dir(os.path.dirname(src))
+        return new_key
+
+    def derivative_key(self, key, variant):
+        return f"{key}.{variant}"
+
+    def delete(self, key):
+        """Removes `key` and all of its derivatives; returns the number of files removed."""
+        final = self.path(key)
+        directory, name = os.path.split(final)
+        removed = 0
+        if KEY_RE.match(key):       # a shard holds a few hundred files at most
+            try:
+                entries = [e.path for e in os.scandir(directory)
+                           if e.name == name or e.name.startswith(name + ".")]
+            except FileNotFoundError:
+                return 0
+        else:
+            entries = [final] + [self.path(self.derivative_key(key, v)) for v in self.variants]
+        for p in entries:
+            try:
+                os.remove(p)
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+
+def _fsync_dir(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:        # not supported on Windows
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
@@ -0,0 +1,60 @@
+# tests/test_migrate.py
+import os
+import shutil
+import sqlite3
+
+from sqlalchemy import create_engine
+
+import server
+
+BASELINE_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "instance", "users.db")
+
+
+def migrate(path):
+    engine = create_engine(f"sqlite:///{path}")
+    try:
+        with server.app.app_context():
+            server.migrate_schema(engine)
+    finally:
+        engine.dispose()
+
+
+def test_baseline_database_migrates(tmp_path):
+    """The first release's schema: album_image without deleted_at or any later column."""
+    path = tmp_path / "users.db"
+    shutil.copy(BASELINE_DB, path)
+    with sqlite3.connect(path) as conn:
+        posts_before = conn.execute("SELECT COUNT(*) FROM image").fetchone()[0]
+        album_photos = conn.execute("SELECT album_id, filename FROM album_image ORDER BY id").fetchall()
+    assert album_photos
+
+    migrate(path)
+    migrate(path)       # idempotent: the second run finds nothing left to do
+
+    with sqlite3.connect(path) as conn:
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+        assert "album_image" not in tables
+        assert conn.execute("SELECT COUNT(*) FROM image WHERE posted=1").fetchone()[0] == posts_before
+        moved = conn.execute(
+            "SELECT m.album_id, i.filename FROM album_membership m JOIN image i ON i.id = m.image_id "
+            "WHERE i.posted=0 AND i.user_id = (SELECT user_id FROM album WHERE id = m.album_id) "
+            "ORDER BY i.id").fetchall()
+        assert moved == album_photos
+
+
+def test_soft_deleted_album_photos_get_no_membership(tmp_path):
+    path = tmp_path / "users.db"
+    shutil.copy(BASELINE_DB, path)
+    with sqlite3.connect(path) as conn:
+        conn.execute("ALTER TABLE album_image ADD COLUMN deleted_at DATETIME")
+        conn.execute("UPDATE album_image SET deleted_at = '2025-01-01 00:00:00' "
+                     "WHERE id = (SELECT MIN(id) FROM album_image)")
+        total = conn.execute("SELECT COUNT(*) FROM album_image").fetchone()[0]
+
+    migrate(path)
+
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM image WHERE posted=0").fetchone()[0] == total
+        assert conn.execute("SELECT COUNT(*) FROM image WHERE posted=0 AND deleted_at IS NOT NULL")\
+                   .fetchone()[0] == 1
+        assert conn.execute("SELECT COUNT(*) FROM album_membership").fetchone()[0] == total - 1
@@ -0,0 +1,28 @@
+# views/avatar.py
+"""
+Avatars as the server renders them (circular PNGs in avatars.SIZES): Tk
+decodes them itself, and every view shares one PhotoImage per URL.
+"""
+import base64
+import tkinter as tk
+import api_utils as api
+
+_photos = {}        # avatar URL -> PhotoImage; small and immutable, so kept for the session
+_blanks = {}        # size -> transparent stand-in while an avatar can't be fetched
+
+
+def photo(avatar, size):
+    """PhotoImage for the `avatar` URLs of a profile/feed/search entry at `size` px."""
+    url = (avatar or {}).get(str(size))
+    if url and url not in _photos:
+        body = api.fetch_avatar(url)
+        if body is not None:
+            try:
+                _photos[url] = tk.PhotoImage(data=base64.b64encode(body))
+            except tk.TclError:     # not a PNG this Tk can read
+                pass
+    if url in _photos:
+        return _photos[url]
+    if size not in _blanks:
+        _blanks[size] = tk.PhotoImage(width=size, height=size)
+    return _blanks[size]
@@ -0,0 +1,171 @@
+# views/home_view.py
+import tkinter as tk
+from tkinter import messagebox
+from datetime import datetime, timedelta
+from PIL import ImageTk
+import api_utils as api
+import gallery
+from views import avatar
+
+POST_SIZE = 480
+FEED_PAGE = 10
+AUTHOR_AVATAR = 32
+RESULT_AVATAR = 48
+UTC_OFFSET_HOURS = 2  # Europe/Warsaw
+
+
+class HomeFeed(tk.Frame):
+    """Posts of followed accounts (and your own), newest first, with people search on top."""
+
+    def __init__(self, master):
+        super().__init__(master, bg="white")
+        self.photos = []
+        self.cursor = None
+        self.more_btn = None
+
+        self._build_search()
+
+        self.canvas = tk.Canvas(self, bg="white", highlightthickness=0)
+        scroll = tk.Scrollbar(self, orient="vertical", command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=scroll.set)
+        scroll.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+        self.posts = tk.Frame(self.canvas, bg="white")
+        self.canvas.create_window((0, 0), window=self.posts, anchor="nw")
+        self.posts.bind("<Configure>",
+                        lambda e: self.canvas.configure(scrollregion=self.canvas.bbox("all")))
+
+        self._load_page()
+
+    # MainView keeps the view between visits: the wheel scrolls the feed only while it is shown
+    def on_show(self):
+        self.canvas.bind_all("<MouseWheel>", self._on_wheel)
+
+    def on_hide(self):
+        self.canvas.unbind_all("<MouseWheel>")
+
+    def destroy(self):
+        self.on_hide()
+        super().destroy()
+
+    def refresh(self):
+        self._reload()
+
+    def _on_wheel(self, event):
+        self.canvas.yview_scroll(-1 if event.delta > 0 else 1, "units")
+
+    # —— people search ——
+
+    def _build_search(self):
+        bar = tk.Frame(self, bg="white")
+        bar.pack(fill="x", padx=40, pady=(15, 5))
+        tk.Label(bar, text="Find people:", bg="white", fg="black").pack(side="left")
+        self.query = tk.Entry(bar, width=30, bg="white", fg="black", insertbackground="black")
+        self.query.pack(side="left", padx=6)
+        self.query.bind("<Return>", lambda e: self._search())
+        tk.Button(bar, text="Search", relief="raised", bd=1, command=self._search).pack(side="left")
+        self.results = tk.Frame(self, bg="white")
+        self.results.pack(fill="x", padx=40)
+
+    def _search(self):
+        for w in self.results.winfo_children():
+            w.destroy()
+        resp = api.api_get("/api/users", auth=True, params={"q": self.query.get().strip()})
+        users = resp.json() if resp.ok else []
+        if not users:
+            tk.Label(self.results, text="Nobody found.", fg="gray", bg="white").pack(anchor="w")
+            return
+        for user in users:
+            self._user_row(user)
+
+    def _user_row(self, user):
+        row = tk.Frame(self.results, bg="white")
+        row.pack(fill="x", pady=2)
+        tk.Label(row, text=user["username"], image=avatar.photo(user.get("avatar"), RESULT_AVATAR),
+                 compound="left", padx=6, fg="black", bg="white",
+                 font=("Arial", 10, "bold")).pack(side="left")
+        tk.Label(row, text=f"{user['followers']} followers", fg="gray", bg="white",
+                 font=("Arial", 9)).pack(side="left", padx=8)
+        btn = tk.Button(row, text="Unfollow" if user["is_following"] else "Follow",
+                        relief="raised", bd=1)
+        btn.config(command=lambda u=user, r=row: self._toggle_follow(u, r))
+        btn.pack(side="right")
+
+    def _toggle_follow(self, user, row):
+        method = "DELETE" if user["is_following"] else "POST"
+        resp = api.api_send(method, f"/api/users/{user['id']}/follow")
+        if api.is_queued(resp):
+            messagebox.showinfo("Offline", "Saved offline – it will sync when you're back online.")
+            return
+        if not resp.ok:
+            try:
+                err = resp.json().get("error", resp.text)
+            except ValueError:
+                err = resp.text or f"Status {resp.status_code}"
+            messagebox.showerror("Error", err)
+            return
+        row.destroy()
+        self._user_row(resp.json())
+        self._reload()
+
+    # —— feed ——
+
+    def _reload(self):
+        for w in self.posts.winfo_children():
+            w.destroy()
+        self.photos = []
+        self.cursor = None
+        self._load_page()
+
+    def _load_page(self):
+        if self.more_btn:
+            self.more_btn.destroy()
+            self.more_btn = None
+        params = {"limit": FEED_PAGE}
+        if self.cursor:
+            params["before"] = self.cursor
+        resp = api.api_get("/api/feed", auth=True, params=params)
+        if not resp.ok:
+            tk.Label(self.posts, text="Feed unavailable.", fg="gray", bg="white").pack(pady=20, padx=40)
+            return
+        page = resp.json()
+        if not page["items"] and not self.photos:
+            tk.Label(self.posts, text="Nothing here yet – follow someone to fill your feed.",
+                     fg="gray", bg="white").pack(pady=20, padx=40)
+        shown = [(post, self._post(post)) for post in page["items"]]
+        self.cursor = page["next"]
+        if self.cursor:
+            self.more_btn = tk.Button(self.posts, text="Load more", relief="raised", bd=1,
+                                      command=self._load_page)
+            self.more_btn.pack(pady=15)
+        self.update_idletasks()     # the page laid out with previews, then the photos one by one
+        for post, lbl in shown:
+            pil = gallery.detail(post["filename"], POST_SIZE, POST_SIZE)
+            if pil is not None:
+                lbl.image = ImageTk.PhotoImage(pil)
+                lbl.config(image=lbl.image)
+                self.update_idletasks()
+
+    def _post(self, post):
+        card = tk.Frame(self.posts, bg="white")
+        card.pack(anchor="w", padx=40, pady=10)
+        author = post["author"]
+        tk.Label(card, text=author["username"], image=avatar.photo(author.get("avatar"), AUTHOR_AVATAR),
+                 compound="left", padx=6, fg="black", bg="white",
+                 font=("Arial", 11, "bold")).pack(anchor="w")
+
+        photo = ImageTk.PhotoImage(gallery.preview(post, POST_SIZE, POST_SIZE))
+        self.photos.append(photo)
+        lbl = tk.Label(card, image=photo, bg="white")
+        lbl.pack(anchor="w", pady=4)
+
+        if post.get("description"):
+            tk.Label(card, text=post["description"], fg="black", bg="white", font=("Arial", 10),
+                     wraplength=POST_SIZE, justify="left").pack(anchor="w")
+        try:
+            dt = datetime.strptime(post["uploaded_at"], "%Y-%m-%d %H:%M") + timedelta(hours=UTC_OFFSET_HOURS)
+            when = dt.strftime("%d %b %Y %H:%M")
+        except (KeyError, ValueError):
+            when = ""
+        tk.Label(card, text=when, fg="gray", bg="white", font=("Arial", 8)).pack(anchor="w")
+        return lbl
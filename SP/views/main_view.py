@@ -1,5 +1,8 @@
+import time
 import tkinter as tk
+from collections import OrderedDict
 from views.profile_view import ProfileFeed
+from views.home_view import HomeFeed
 from views.upload_view import open_upload_dialog
 import api_utils as api
 
@@ -9,12 +12,42 @@ HIGHLIGHT_FG = "black"
 INACTIVE_FG  = "#888"
 HOVER_FG     = "#333"
 LOGOUT_FG    = "#d00"
+CHANGE_POLL_MS = 250       # also the latency of live updates
+STALE_AFTER_S  = 300       # a view hidden longer than this reloads when shown again
+VIEW_CACHE_MB  = 48        # image memory hidden views may keep; least recently shown go first
+
+
+def _hook(view, name):
+    method = getattr(view, name, None)
+    if method:
+        method()
+
+
+def _image_bytes(widget):
+    """Pixel memory of the images shown in `widget` and below it (Tk keeps 4 bytes a pixel)."""
+    names, stack = set(), [widget]
+    while stack:
+        w = stack.pop()
+        stack.extend(w.winfo_children())
+        try:
+            name = str(w.cget("image"))
+        except tk.TclError:     # not a widget with an image
+            continue
+        if name:
+            names.add(name)
+    return sum(4 * int(widget.tk.call("image", "width", n)) * int(widget.tk.call("image", "height", n))
+               for n in names)
+
 
 class MainView(tk.Frame):
     def __init__(self, master, on_logout):
         super().__init__(master, bg=SIDEBAR_BG)
         self.on_logout = on_logout
         self.content_frame = None
+        self.current = None
+        self.views = OrderedDict()  # nav text -> view kept between visits, least recently shown first
+        self.hidden_at = {}         # nav text -> time.monotonic() the view was hidden
+        self.stale = set()          # hidden views whose data changed meanwhile
         self.active_label = None
         self.nav_items = {}
 
@@ -26,9 +59,10 @@ class MainView(tk.Frame):
 
         self._build_sidebar()
         self.show_profile()
+        self.after(CHANGE_POLL_MS, self._poll_changes)
 
     def _build_sidebar(self):
-        self._add_nav("🏠 Home", self.show_profile)
+        self._add_nav("🏠 Home", self.show_home)
         self._add_nav("📤 Upload", self.show_upload)
         self._add_nav("👤 Profile", self.show_profile)
         self._add_nav("🚪 Logout", self.logout, is_logout=True)
@@ -60,6 +94,8 @@ class MainView(tk.Frame):
             label.config(fg=INACTIVE_FG, font=("Arial", 12, "bold"))
 
     def _highlight(self, text):
+        # called first by every show_*: drop the old view's prefetches before the new view queues its own
+        api.prefetcher.cancel()
         for lbl_text, label in self.nav_items.items():
             if lbl_text == text:
                 label.config(fg=HIGHLIGHT_FG, font=("Arial", 12, "bold"))
@@ -67,23 +103,76 @@ class MainView(tk.Frame):
             elif "Logout" not in lbl_text:
                 label.config(fg=INACTIVE_FG, font=("Arial", 12, "bold"))
 
-    def _switch_content(self, new_frame):
+    def _show(self, name, build):
+        """
+        Shows the view for nav item `name`, built by `build` on first use and
+        afterwards only hidden and shown again. It reloads (refresh()) when
+        its data changed while hidden, after STALE_AFTER_S, or when its nav
+        item is clicked while it is already shown.
+        """
+        self._highlight(name)
+        if name == self.current:
+            _hook(self.content_frame, "refresh")
+            return
         if self.content_frame:
-            self.content_frame.destroy()
-        self.content_frame = new_frame
-        self.content_frame.pack(fill="both", expand=True)
+            self.content_frame.pack_forget()
+            _hook(self.content_frame, "on_hide")
+            self.hidden_at[self.current] = time.monotonic()
+        view = self.views.get(name)
+        hidden = self.hidden_at.pop(name, None)
+        if view is None:
+            view = self.views[name] = build()
+        self.views.move_to_end(name)
+        self.current, self.content_frame = name, view
+        view.pack(fill="both", expand=True)
+        _hook(view, "on_show")
+        if name in self.stale or (hidden is not None and time.monotonic() - hidden > STALE_AFTER_S):
+            _hook(view, "refresh")
+        self.stale.discard(name)
+        self._evict()
+
+    def _evict(self):
+        """Destroys the least recently shown hidden views while they hold over VIEW_CACHE_MB of images."""
+        hidden = {n: _image_bytes(v) for n, v in self.views.items() if n != self.current}
+        total = sum(hidden.values())
+        for name, size in hidden.items():
+            if total <= VIEW_CACHE_MB * 1024 * 1024:
+                break
+            self.views.pop(name).destroy()
+            self.hidden_at.pop(name, None)
+            self.stale.discard(name)
+            total -= size
+
+    def _poll_changes(self):
+        # background threads can't touch Tk widgets; hand changes over on the Tk thread.
+        # Only the shown view patches itself; hidden ones that care reload when shown.
+        routes = api.drain_changes()
+        events = api.drain_events()
+        for name, view in self.views.items():
+            wants = (routes and hasattr(view, "on_data_changed")) or (events and hasattr(view, "on_event"))
+            if name != self.current and wants:
+                self.stale.add(name)
+        if routes and hasattr(self.content_frame, "on_data_changed"):
+            self.content_frame.on_data_changed(routes)
+        for event in events if hasattr(self.content_frame, "on_event") else ():
+            self.content_frame.on_event(event)
+        self.after(CHANGE_POLL_MS, self._poll_changes)
+
+    def show_home(self):
+        self._show("🏠 Home", lambda: HomeFeed(self.content))
 
     def show_profile(self):
-        self._highlight("👤 Profile")
-        self._switch_content(ProfileFeed(self.content))
+        self._show("👤 Profile", lambda: ProfileFeed(self.content))
 
     def show_upload(self):
-        self._highlight("📤 Upload")
+        self._show("📤 Upload", self._build_upload)
+
+    def _build_upload(self):
         frame = tk.Frame(self.content, bg=CONTENT_BG)
         tk.Label(frame, text="Pick a photo & add a description", fg="black", bg=CONTENT_BG).pack(pady=10)
         tk.Button(frame, text="🖼️ Upload", width=20, bg="#0095f6", fg="black",
                   relief="flat", command=lambda: open_upload_dialog(self, self.show_profile)).pack(pady=10)
-        self._switch_content(frame)
+        return frame
 
     def logout(self):
         api.clear_token()
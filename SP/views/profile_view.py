@@ -1,29 +1,41 @@
 # views/profile_view.py
-import os
-import io
+import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox, simpledialog
-from PIL import Image, ImageTk, ImageDraw, ExifTags, UnidentifiedImageError
+from PIL import Image, ImageTk, ExifTags
 import api_utils as api
+import gallery
+from prefetch import HIGH, LOW
+from views import avatar
+from views.upload_view import confirm_not_duplicate
 import requests
 from datetime import datetime, timedelta
 
-THUMB_SIZE = 180
+THUMB_SIZE = gallery.THUMB_SIZE
 COLS = 3
 GAP = 4
 UTC_OFFSET_HOURS = 2  # Europe/Warsaw
 NOMINATIM_URL = "https://nominatim.openstreetmap.org/reverse"
 USER_AGENT = "YourApp/1.0 (you@example.com)"
+PREFETCH_ALBUMS = 6
+AVATAR_SIZE = 90
 
 class ProfileFeed(tk.Frame):
     def __init__(self, master):
         super().__init__(master, bg="white")
-        self.thumbs = []
         self.tab_selected = "POSTS"
         self.user_data = {}
         self.grid_frame = None
         self.albums_frame = None
         self.post_count_label = None
+        self.select_mode = False
+        self.selected = {}          # filename -> tile frame, for multi-select delete
+        self.visible_images = []    # listing the open grid shows, for neighbour prefetch
+        self.posts = []             # POSTS grid listing, in display order
+        self.post_names = set()     # all posts, for the count in the header
+        self.tiles = None           # POSTS grid container while it is shown
+        self.grid_cells = {}        # filename -> tile frame in the POSTS grid
+        self.album_popups = {}      # album id -> {"frame", "photos", "cells"} of open albums
 
         # fetch device coords once
         try:
@@ -38,6 +50,20 @@ class ProfileFeed(tk.Frame):
         self._build_tab_buttons()
         self._build_image_grid("/api/images")
 
+    def refresh(self):
+        """Rebuilds header and the open tab from fresh data; MainView calls it when the view is stale."""
+        for w in self.winfo_children():
+            if not isinstance(w, tk.Toplevel):      # open album and export popups stay
+                w.destroy()
+        self.grid_frame = self.albums_frame = self.tiles = None
+        self._fetch_profile()
+        self._build_profile_header()
+        self._build_tab_buttons()
+        if self.tab_selected == "POSTS":
+            self._build_image_grid("/api/images")
+        else:
+            self._build_album_view()
+
     def _reverse_to_city(self, lat, lon):
         """Use Nominatim to get the city from coordinates."""
         if lat is None or lon is None:
@@ -82,9 +108,8 @@ class ProfileFeed(tk.Frame):
         left = tk.Frame(header, bg="white")
         left.pack(side="left", padx=30)
 
-        profile_pic = self._load_profile_picture()
-        self.profile_label = tk.Label(left, image=profile_pic, bg="white", cursor="hand2")
-        self.profile_label.image = profile_pic
+        self.profile_label = tk.Label(left, image=avatar.photo(self.user_data.get("avatar"), AVATAR_SIZE),
+                                      bg="white", cursor="hand2")
         self.profile_label.pack()
         self.profile_label.bind("<Button-1>", self._change_profile_picture)
 
@@ -95,14 +120,20 @@ class ProfileFeed(tk.Frame):
         tk.Label(right, text=username, fg="black", bg="white",
                  font=("Arial", 16, "bold")).pack(anchor="w")
 
-        tk.Button(right, text="Edit Profile", command=self._edit_profile,
-                  font=("Arial", 10), relief="raised", bd=1).pack(anchor="w", pady=5)
+        actions = tk.Frame(right, bg="white"); actions.pack(anchor="w", pady=5)
+        tk.Button(actions, text="Edit Profile", command=self._edit_profile,
+                  font=("Arial", 10), relief="raised", bd=1).pack(side="left")
+        tk.Button(actions, text="Export library", command=self._export_library,
+                  font=("Arial", 10), relief="raised", bd=1).pack(side="left", padx=6)
 
         post_resp = api.api_get("/api/images", auth=True)
-        post_count = len(post_resp.json()) if post_resp.ok else 0
+        self.post_names = {d["filename"] for d in post_resp.json()} if post_resp.ok else set()
+        post_count = len(self.post_names)
 
         stats = tk.Frame(right, bg="white"); stats.pack(anchor="w", pady=(10,0))
-        for label, value in [("Posts", post_count), ("Followers", 0), ("Following", 0)]:
+        for label, value in [("Posts", post_count),
+                             ("Followers", self.user_data.get("followers", 0)),
+                             ("Following", self.user_data.get("following", 0))]:
             stat = tk.Frame(stats, bg="white"); stat.pack(side="left", padx=10)
             val_lbl = tk.Label(stat, text=str(value), fg="black", bg="white",
                                font=("Arial", 12, "bold"))
@@ -119,9 +150,12 @@ class ProfileFeed(tk.Frame):
 
     def _refresh_post_count(self):
         resp = api.api_get("/api/images", auth=True)
-        count = len(resp.json()) if resp.ok else 0
+        self.post_names = {d["filename"] for d in resp.json()} if resp.ok else set()
+        self._show_post_count()
+
+    def _show_post_count(self):
         if self.post_count_label:
-            self.post_count_label.config(text=str(count))
+            self.post_count_label.config(text=str(len(self.post_names)))
 
     def _change_profile_picture(self, _event=None):
         path = filedialog.askopenfilename(
@@ -134,16 +168,13 @@ class ProfileFeed(tk.Frame):
             messagebox.showerror("Invalid Format", "Please select a JPEG or PNG image.")
             return
 
-        with open(path, "rb") as f:
-            resp = requests.post(
-                f"{api.API_URL}/api/profile-picture",
-                files={"file": f},
-                headers={"Authorization": f"Bearer {api.TOKEN}"}
-            )
-        if resp.ok:
-            new_pic = self._load_profile_picture()
-            self.profile_label.config(image=new_pic)
-            self.profile_label.image = new_pic
+        resp = api.api_send("POST", "/api/profile-picture", file_path=path)
+        if api.is_queued(resp):
+            messagebox.showinfo("Offline", "Saved offline – your new picture will appear once it is uploaded.")
+        elif resp.ok:
+            # new picture, new URLs: nothing cached can be stale
+            self.user_data["avatar"] = resp.json().get("avatar")
+            self.profile_label.config(image=avatar.photo(self.user_data["avatar"], AVATAR_SIZE))
         else:
             try:
                 err = resp.json().get("error", resp.text)
@@ -167,21 +198,21 @@ class ProfileFeed(tk.Frame):
         def save():
             new_bio = bio_entry.get("1.0", "end").strip()
             payload = {"username": self.user_data.get("username", ""), "bio": new_bio}
-            resp = requests.post(
-                f"{api.API_URL}/api/profile-edit",
-                json=payload,
-                headers={"Authorization": f"Bearer {api.TOKEN}"}
-            )
-            if resp.ok:
-                self.user_data["bio"] = new_bio
-                self.bio_label.config(text=new_bio)
-                popup.destroy()
-            else:
+            resp = api.api_send("POST", "/api/profile-edit", json=payload)
+            if api.is_queued(resp):
+                api.edit_mirror(lambda profile: {**profile, "bio": new_bio}, "/api/profile")
+                messagebox.showinfo("Offline", "Saved offline – your bio will sync when you're back online.",
+                                    parent=popup)
+            elif not resp.ok:
                 try:
                     err = resp.json().get("error", resp.text)
                 except:
                     err = resp.text or f"Status {resp.status_code}"
                 messagebox.showerror("Error", err)
+                return
+            self.user_data["bio"] = new_bio
+            self.bio_label.config(text=new_bio)
+            popup.destroy()
 
         tk.Button(popup, text="Save", command=save,
                   font=("Arial", 10), relief="raised", bd=1).pack(pady=10)
@@ -190,28 +221,50 @@ class ProfileFeed(tk.Frame):
         popup.grab_set()
         popup.focus_set()
 
-    def _load_profile_picture(self, size=90):
-        try:
-            user_id = self.user_data.get("id")
-            if user_id:
-                resp = requests.get(f"{api.API_URL}/uploads/profile_{user_id}.jpg")
-                if resp.status_code == 200:
-                    pil = Image.open(io.BytesIO(resp.content))
-                    pil = pil.resize((size, size), Image.LANCZOS)
-                    return ImageTk.PhotoImage(self._make_circle(pil))
-        except:
-            pass
-        pil = Image.new("RGB", (size, size), "#bbb")
-        return ImageTk.PhotoImage(self._make_circle(pil))
-
-    def _make_circle(self, img):
-        size = img.size[0]
-        mask = Image.new("L", (size, size), 0)
-        draw = ImageDraw.Draw(mask)
-        draw.ellipse((0,0,size,size), fill=255)
-        result = Image.new("RGB", (size,size), (255,255,255))
-        result.paste(img, (0,0), mask)
-        return result
+    def _export_library(self):
+        """Downloads the library ZIP on a worker thread; a partial file from an earlier try is resumed."""
+        path = filedialog.asksaveasfilename(title="Export library", defaultextension=".zip",
+                                            initialfile="library.zip",
+                                            filetypes=[("ZIP archive", "*.zip")])
+        if not path:
+            return
+        popup = tk.Toplevel(self)
+        popup.title("Export library")
+        popup.config(bg="white")
+        status = tk.Label(popup, text="Starting…", fg="black", bg="white", width=40)
+        status.pack(padx=20, pady=(15, 5))
+        state = {"done": 0, "total": 0, "cancel": False, "finished": False, "ok": False, "error": None}
+        tk.Button(popup, text="Cancel", relief="raised", bd=1,
+                  command=lambda: state.update(cancel=True)).pack(pady=(5, 15))
+
+        def work():
+            try:
+                state["ok"] = api.download_export(
+                    path, progress=lambda done, total: state.update(done=done, total=total),
+                    cancelled=lambda: state["cancel"])
+            except Exception as e:
+                state["error"] = e
+            state["finished"] = True
+
+        def poll():
+            if not popup.winfo_exists():
+                state["cancel"] = True
+                return
+            if state["total"]:
+                status.config(text=f"{state['done'] / 1e6:,.0f} of {state['total'] / 1e6:,.0f} MB "
+                                   f"({100 * state['done'] // state['total']}%)")
+            if not state["finished"]:
+                popup.after(200, poll)
+                return
+            popup.destroy()
+            if state["ok"]:
+                messagebox.showinfo("Export library", f"Saved to {path}")
+            elif state["error"] is not None:
+                messagebox.showerror("Export failed",
+                                     f"{state['error']}\n\nExport again to the same file to resume.")
+
+        threading.Thread(target=work, name="export", daemon=True).start()
+        poll()
 
     def _build_tab_buttons(self):
         self.tabs = tk.Frame(self, bg="white")
@@ -227,6 +280,7 @@ class ProfileFeed(tk.Frame):
             self.tab_labels[name] = lbl
 
     def _change_tab(self, name):
+        api.prefetcher.cancel()
         self.tab_selected = name
         for n, lbl in self.tab_labels.items():
             lbl.config(fg="black" if n == name else "gray")
@@ -240,6 +294,7 @@ class ProfileFeed(tk.Frame):
             if self.grid_frame:
                 self.grid_frame.destroy()
                 self.grid_frame = None
+                self.tiles = None
             self._build_album_view()
 
     def _build_image_grid(self, endpoint):
@@ -247,66 +302,245 @@ class ProfileFeed(tk.Frame):
             self.grid_frame.destroy()
         self.grid_frame = tk.Frame(self, bg="white")
         self.grid_frame.pack(pady=10, anchor="w", padx=40)
+        self.select_mode = False
+        self.selected = {}
+        self.tiles = None
+        self.grid_cells = {}
 
         resp = api.api_get(endpoint, auth=True)
         images = resp.json() if resp.ok else []
+        self.visible_images = self.posts = images
+        api.prefetch_route("/api/albums", HIGH)      # the other tab
         if not images:
             tk.Label(self.grid_frame, text="No photos yet.", fg="gray", bg="white")\
               .pack(pady=20)
             return
 
-        row = col = 0
-        for img_data in images:
-            tr = api.api_get(f"/uploads/{img_data['filename']}")
-            if tr.status_code != 200:
-                continue
-            try:
-                pil = Image.open(io.BytesIO(tr.content))
-            except UnidentifiedImageError:
-                continue
-
-            w, h = pil.size
-            s = min(w, h)
-            pil = pil.crop(((w-s)//2,(h-s)//2,(w+s)//2,(h+s)//2))
-            pil = pil.resize((THUMB_SIZE, THUMB_SIZE), Image.LANCZOS)
+        self._build_selection_bar()
+        self.tiles = tk.Frame(self.grid_frame, bg="white")
+        self.tiles.pack(anchor="w")
 
-            tk_img = ImageTk.PhotoImage(pil)
-            self.thumbs.append(tk_img)
-
-            ctr = tk.Frame(self.grid_frame, bg="white")
-            ctr.grid(row=row, column=col, padx=GAP, pady=GAP)
-
-            lbl = tk.Label(ctr, image=tk_img, bg="white", cursor="hand2")
-            lbl.pack()
-            lbl.bind("<Button-1>", lambda e, d=img_data: self._open_image_detail(d))
+        for img_data in images:
+            self.grid_cells[img_data["filename"]] = self._grid_cell(img_data, self._preview(img_data))
+        self._place(self.grid_cells, images)
+        for img_data in images[:COLS * 2]:
+            api.prefetch_image(img_data["filename"])
+        self._fill_thumbs(endpoint, images, self.grid_cells)
+
+    def _grid_cell(self, img_data, pil):
+        ctr = tk.Frame(self.tiles, bg="white", highlightthickness=3, highlightbackground="white")
+        lbl = ctr.thumb = tk.Label(ctr, bg="white", cursor="hand2")
+        self._set_thumb(lbl, pil)
+        lbl.pack()
+        lbl.bind("<Button-1>", lambda e, d=img_data, c=ctr: self._on_tile_click(d, c))
+
+        # Only show description, not date/location
+        tk.Label(ctr, text=img_data.get("description","No description"),
+                 fg="black", bg="white", font=("Arial",9)).pack(pady=(2,0))
+        return ctr
+
+    @staticmethod
+    def _preview(item):
+        return gallery.preview(item, THUMB_SIZE, THUMB_SIZE, crop=True)
+
+    @staticmethod
+    def _set_thumb(lbl, pil):
+        lbl.image = ImageTk.PhotoImage(pil)     # the label holds the reference Tk needs
+        lbl.config(image=lbl.image)
+
+    def _fill_thumbs(self, endpoint, photos, cells):
+        """
+        Swaps the previews in `cells` for thumbnails as they arrive. The
+        whole page is painted from the listing first, so it has its layout
+        and colours before the first image is fetched.
+        """
+        self.update_idletasks()
+        for p, pil in gallery.grid_tiles(endpoint, photos, THUMB_SIZE):
+            cell = cells.get(p["filename"])
+            if pil is not None and cell is not None:
+                self._set_thumb(cell.thumb, pil)
+                self.update_idletasks()
+
+    @staticmethod
+    def _place(cells, photos):
+        for i, p in enumerate(photos):
+            cells[p["filename"]].grid(row=i // COLS, column=i % COLS, padx=GAP, pady=GAP)
+
+    def on_data_changed(self, routes):
+        """Called by MainView when background sync brought new data for `routes`."""
+        if "/api/profile" in routes:
+            self.refresh()
+            return
+        for aid in list(self.album_popups):
+            if f"/api/albums/{aid}/images" in routes:
+                self._fill_album(aid)
+        if "/api/images" in routes:
+            self._refresh_post_count()
+            if self.tab_selected == "POSTS" and not self.select_mode:
+                self._build_image_grid("/api/images")
+        if "/api/albums" in routes and self.tab_selected == "ALBUMS":
+            self._build_album_view()
 
-            # Only show description, not date/location
-            tk.Label(ctr, text=img_data.get("description","No description"),
-                     fg="black", bg="white", font=("Arial",9)).pack(pady=(2,0))
+    # —— live updates ——
 
-            col += 1
-            if col == COLS:
-                col = 0
-                row += 1
+    def on_event(self, event):
+        """Patches the grid and open albums for an event pushed by the server (see MainView)."""
+        kind, data = event["type"], event["data"]
+        if kind == "reset":         # events were missed; reload what is shown
+            self._refresh_post_count()
+            self.on_data_changed({"/api/images", "/api/albums"})
+            for aid in list(self.album_popups):
+                self._fill_album(aid)
+        elif kind == "image_added" and data["album_id"] is None:
+            self.post_names.add(data["image"]["filename"])
+            self._show_post_count()
+            self._insert_post(data["image"])
+        elif kind == "image_added":
+            self._insert_album_photo(data["album_id"], data["image"])
+        elif kind == "images_deleted" and data["album_id"] is None:
+            self.post_names.difference_update(data["filenames"])
+            self._show_post_count()
+            self._remove_posts(set(data["filenames"]))
+        elif kind == "images_deleted":
+            self._remove_album_photos(data["album_id"], set(data["filenames"]))
+        elif kind in ("album_created", "album_deleted"):
+            popup = self.album_popups.get(data.get("album_id"))
+            if popup:
+                popup["frame"].winfo_toplevel().destroy()
+            if self.tab_selected == "ALBUMS":
+                self._build_album_view()
 
+    def _insert_post(self, img_data):
+        if self.tab_selected != "POSTS" or img_data["filename"] in self.grid_cells:
+            return
+        if self.tiles is None:      # "No photos yet." until now
+            self._build_image_grid("/api/images")
+            return
+        ctr = self.grid_cells[img_data["filename"]] = self._grid_cell(img_data, self._preview(img_data))
+        self.posts.insert(0, img_data)
+        self._place(self.grid_cells, self.posts)
+        self.update_idletasks()
+        pil = gallery.thumbnail(img_data["filename"], THUMB_SIZE)
+        if pil is not None:
+            self._set_thumb(ctr.thumb, pil)
+
+    def _remove_posts(self, names):
+        if self.tiles is None or not names & self.grid_cells.keys():
+            return
+        for name in names:
+            ctr = self.grid_cells.pop(name, None)
+            if ctr:
+                ctr.destroy()
+            self.selected.pop(name, None)
+        self.posts = [p for p in self.posts if p["filename"] not in names]
+        if not self.posts:
+            self._build_image_grid("/api/images")
+            return
+        self._place(self.grid_cells, self.posts)
+        self._update_selection_bar()
 
-    def _open_image_detail(self, img_data):
+    def _insert_album_photo(self, aid, photo):
+        shown = self.album_popups.get(aid)
+        if not shown or photo["filename"] in shown["cells"]:
+            return
+        if not shown["photos"]:
+            for w in shown["frame"].winfo_children():
+                w.destroy()
+        cont = shown["cells"][photo["filename"]] = self._album_cell(shown["frame"], photo, self._preview(photo), aid)
+        shown["photos"].insert(0, photo)
+        self._place(shown["cells"], shown["photos"])
+        self.update_idletasks()
+        pil = gallery.thumbnail(photo["filename"], THUMB_SIZE)
+        if pil is not None:
+            self._set_thumb(cont.thumb, pil)
+
+    def _remove_album_photos(self, aid, names):
+        shown = self.album_popups.get(aid)
+        if not shown:
+            return
+        for name in names:
+            cont = shown["cells"].pop(name, None)
+            if cont:
+                cont.destroy()
+        shown["photos"] = [p for p in shown["photos"] if p["filename"] not in names]
+        if not shown["photos"]:
+            self._fill_album(aid)
+        else:
+            self._place(shown["cells"], shown["photos"])
+
+    def _build_selection_bar(self):
+        bar = tk.Frame(self.grid_frame, bg="white")
+        bar.pack(anchor="w", padx=GAP, pady=(0, 6))
+        self.select_btn = tk.Button(bar, text="Select", relief="raised", bd=1,
+                                    command=self._toggle_select_mode)
+        self.select_btn.pack(side="left")
+        self.delete_selected_btn = tk.Button(bar, text="Delete selected", relief="raised", bd=1,
+                                             state="disabled", command=self._delete_selected)
+        self.delete_selected_btn.pack(side="left", padx=8)
+
+    def _toggle_select_mode(self):
+        self.select_mode = not self.select_mode
+        if not self.select_mode:
+            for ctr in self.selected.values():
+                ctr.config(highlightbackground="white")
+            self.selected = {}
+        self.select_btn.config(text="Cancel" if self.select_mode else "Select")
+        self._update_selection_bar()
+
+    def _update_selection_bar(self):
+        n = len(self.selected)
+        self.delete_selected_btn.config(text=f"Delete selected ({n})" if n else "Delete selected",
+                                        state="normal" if n else "disabled")
+
+    def _on_tile_click(self, img_data, ctr):
+        if not self.select_mode:
+            self._open_image_detail(img_data)
+            return
+        name = img_data["filename"]
+        if name in self.selected:
+            del self.selected[name]
+            ctr.config(highlightbackground="white")
+        else:
+            self.selected[name] = ctr
+            ctr.config(highlightbackground="#0095f6")
+        self._update_selection_bar()
+
+    def _delete_selected(self):
+        names = list(self.selected)
+        if not names or not messagebox.askyesno(
+                "Delete Photos", f"Delete {len(names)} selected photo(s)?"):
+            return
+        r = api.api_send("POST", "/api/images/delete", json={"filenames": names})
+        if api.is_queued(r):
+            gone = set(names)
+            api.edit_mirror(lambda photos: [p for p in photos if p["filename"] not in gone],
+                            "/api/images", *(f"/api/albums/{aid}/images" for aid in self.album_popups))
+            for aid in list(self.album_popups):
+                self._remove_album_photos(aid, gone)
+            messagebox.showinfo("Offline", "Saved offline – the photos will be deleted when you're back online.")
+        elif not r.ok:
+            try:
+                err = r.json().get("error", r.text)
+            except:
+                err = r.text or f"Status {r.status_code}"
+            messagebox.showerror("Delete Failed", err)
+            return
+        self._build_image_grid("/api/images")
+        self._refresh_post_count()
+
+    def _open_image_detail(self, img_data, album_id=None):
+        names = [d["filename"] for d in self.visible_images]
+        if img_data["filename"] in names:
+            i = names.index(img_data["filename"])
+            for neighbour in names[i + 1:i + 2] + names[max(i - 1, 0):i]:
+                api.prefetch_image(neighbour, HIGH)
         popup = tk.Toplevel(self)
         popup.title("Photo Details")
         popup.config(bg="white")
 
-        tr = api.api_get(f"/uploads/{img_data['filename']}")
-        if tr.status_code == 200:
-            try:
-                pil = Image.open(io.BytesIO(tr.content))
-            except UnidentifiedImageError:
-                pil = Image.new("RGB", (300,300), "#ccc")
-        else:
-            pil = Image.new("RGB", (300,300), "#ccc")
-
         max_w = int(popup.winfo_screenwidth()*0.6)
         max_h = int(popup.winfo_screenheight()*0.6)
-        pil.thumbnail((max_w, max_h), Image.LANCZOS)
+        pil = gallery.detail(img_data['filename'], max_w, max_h) or gallery.preview(img_data, max_w, max_h)
         photo = ImageTk.PhotoImage(pil)
 
         img_lbl = tk.Label(popup, image=photo, bg="white")
@@ -334,24 +568,45 @@ class ProfileFeed(tk.Frame):
         tk.Label(popup, text=f"Location: {city}", fg="gray", bg="white", font=("Arial",10))\
           .pack(padx=10, pady=(0,5))
 
-        def delete_photo():
-            if not messagebox.askyesno("Delete Photo", "Are you sure you want to delete this photo?"):
-                return
-            r = requests.delete(
-                f"{api.API_URL}/api/images/{img_data['filename']}",
-                headers={"Authorization": f"Bearer {api.TOKEN}"}
-            )
-            if r.ok:
-                popup.destroy()
+        def after_change():
+            popup.destroy()
+            if album_id in self.album_popups:
+                self._fill_album(album_id)
+            if self.tab_selected == "POSTS":
                 self._build_image_grid("/api/images")
-                self._refresh_post_count()
-            else:
+            self._refresh_post_count()
+
+        def without_photo(photos):
+            return [p for p in photos if p["filename"] != img_data["filename"]]
+
+        def send(method, route, failed_title, *mirrored):
+            r = api.api_send(method, route)
+            if api.is_queued(r):
+                # `mirrored` are the listings the photo leaves; show that before it syncs
+                api.edit_mirror(without_photo, *mirrored)
+                messagebox.showinfo("Offline", "Saved offline – the change will sync when you're back online.",
+                                    parent=popup)
+            elif not r.ok:
                 try:
                     err = r.json().get("error", r.text)
                 except:
                     err = r.text or f"Status {r.status_code}"
-                messagebox.showerror("Delete Failed", err)
+                messagebox.showerror(failed_title, err)
+                return
+            after_change()
 
+        def delete_photo():
+            if not messagebox.askyesno("Delete Photo", "Delete this photo from your posts and all albums?"):
+                return
+            send("DELETE", f"/api/images/{img_data['filename']}", "Delete Failed",
+                 "/api/images", *(f"/api/albums/{aid}/images" for aid in {album_id, *self.album_popups} - {None}))
+
+        if album_id is not None and "id" in img_data:
+            # only the album entry goes; the photo stays wherever else it is
+            tk.Button(popup, text="Remove from album", relief="raised", bd=1,
+                      command=lambda: send("DELETE", f"/api/albums/{album_id}/media/{img_data['id']}",
+                                           "Remove Failed", f"/api/albums/{album_id}/images"))\
+              .pack(pady=(10,0))
         tk.Button(popup, text="Delete Photo", fg="black", bg="#d00",
                   relief="raised", bd=1, command=delete_photo)\
           .pack(pady=(10,15))
@@ -361,6 +616,8 @@ class ProfileFeed(tk.Frame):
         popup.focus_set()
 
     def _build_album_view(self):
+        if self.albums_frame:
+            self.albums_frame.destroy()
         self.albums_frame = tk.Frame(self, bg="white")
         self.albums_frame.pack(fill="both", expand=True, pady=10, padx=40)
 
@@ -371,6 +628,10 @@ class ProfileFeed(tk.Frame):
 
         resp = api.api_get("/api/albums", auth=True)
         albums = resp.json() if resp.ok else []
+        # opening an album should find its listing and first sprite page already here
+        for i, alb in enumerate([a for a in albums if a["id"] is not None][:PREFETCH_ALBUMS]):
+            api.prefetch_sprite(f"/api/albums/{alb['id']}/images", THUMB_SIZE, priority=HIGH + i)
+        api.prefetch_sprite("/api/images", THUMB_SIZE, priority=LOW)
         if not albums:
             tk.Label(self.albums_frame, text="No albums yet.", fg="gray", bg="white")\
               .pack(pady=20)
@@ -391,9 +652,33 @@ class ProfileFeed(tk.Frame):
             tk.Label(fr, text=created, fg="gray", bg="white",
                      font=("Arial",10)).grid(row=1, column=0, sticky="w")
 
+            if alb['id'] is None:       # created offline, not synced yet
+                tk.Label(fr, text="Waiting to sync", fg="gray", bg="white",
+                         font=("Arial",10)).grid(row=0, column=1, rowspan=2, padx=10)
+                continue
             tk.Button(fr, text="Open", relief="raised", bd=1,
                       command=lambda a=alb: self._open_album(a))\
               .grid(row=0, column=1, rowspan=2, padx=10)
+            tk.Button(fr, text="Delete", relief="raised", bd=1,
+                      command=lambda a=alb: self._delete_album(a))\
+              .grid(row=0, column=2, rowspan=2)
+
+    def _delete_album(self, album):
+        if not messagebox.askyesno("Delete Album",
+                                   f"Delete album \"{album['name']}\" and all its photos?"):
+            return
+        r = api.api_send("DELETE", f"/api/albums/{album['id']}")
+        if api.is_queued(r):
+            api.edit_mirror(lambda albums: [a for a in albums if a["id"] != album["id"]], "/api/albums")
+            messagebox.showinfo("Offline", "Saved offline – the album will be deleted when you're back online.")
+        elif not r.ok:
+            try:
+                err = r.json().get("error", r.text)
+            except:
+                err = r.text or f"Status {r.status_code}"
+            messagebox.showerror("Delete Failed", err)
+            return
+        self._build_album_view()
 
     def _create_album_dialog(self):
         popup = tk.Toplevel(self)
@@ -411,20 +696,24 @@ class ProfileFeed(tk.Frame):
             if not name:
                 return messagebox.showwarning("Create Album", "Please enter a name for your album.")
 
-            resp = requests.post(
-                f"{api.API_URL}/api/albums",
-                json={"name": name, "description": desc_ent.get("1.0","end").strip()},
-                headers={"Authorization": f"Bearer {api.TOKEN}"}
-            )
-            if resp.ok:
-                popup.destroy()
-                self._build_album_view()
-            else:
+            desc = desc_ent.get("1.0","end").strip()
+            resp = api.api_send("POST", "/api/albums", json={"name": name, "description": desc})
+            if api.is_queued(resp):
+                # no id until the server creates it: listed, but not openable yet
+                pending = {"id": None, "name": name, "description": desc,
+                           "created_at": datetime.utcnow().isoformat()}
+                api.edit_mirror(lambda albums: [pending] + albums, "/api/albums")
+                messagebox.showinfo("Offline", "Saved offline – the album will be created when you're back online.",
+                                    parent=popup)
+            elif not resp.ok:
                 try:
                     err = resp.json().get("error","")
                 except:
                     err = resp.text or ""
                 messagebox.showerror("Create Album Failed", err or "Could not create album.")
+                return
+            popup.destroy()
+            self._build_album_view()
 
         tk.Button(popup, text="Create", command=save,
                   font=("Arial",10), relief="raised", bd=1).pack(pady=10)
@@ -443,68 +732,129 @@ class ProfileFeed(tk.Frame):
         tk.Label(popup, text=album.get('description',''), fg="gray", bg="white",
                  wraplength=400, justify="left").pack(pady=(0,10))
 
-        tk.Button(popup, text="+ Add Photo", relief="raised", bd=1,
+        buttons = tk.Frame(popup, bg="white"); buttons.pack()
+        tk.Button(buttons, text="+ Add Photo", relief="raised", bd=1,
                   command=lambda a=album, p=popup: self._add_photo_to_album(a, p))\
-          .pack()
+          .pack(side="left")
+        tk.Button(buttons, text="+ From posts", relief="raised", bd=1,
+                  command=lambda a=album, p=popup: self._add_posts_to_album(a, p))\
+          .pack(side="left", padx=6)
 
         frame = tk.Frame(popup, bg="white"); frame.pack(pady=10, padx=10)
-        resp = api.api_get(f"/api/albums/{album['id']}/images", auth=True)
+        aid = album['id']
+        self.album_popups[aid] = {"frame": frame, "photos": [], "cells": {}}
+        popup.bind("<Destroy>", lambda e: e.widget is popup and self.album_popups.pop(aid, None))
+        self._fill_album(aid)
+
+        popup.transient(self)
+        popup.grab_set()
+        popup.focus_set()
+
+    def _fill_album(self, aid):
+        shown = self.album_popups[aid]
+        frame = shown["frame"]
+        for w in frame.winfo_children():
+            w.destroy()
+        resp = api.api_get(f"/api/albums/{aid}/images", auth=True)
         photos = resp.json() if resp.ok else []
+        self.visible_images = shown["photos"] = photos
+        shown["cells"] = {}
+        for p in photos[:COLS * 2]:
+            api.prefetch_image(p["filename"])
         if not photos:
             tk.Label(frame, text="No photos yet.", fg="gray", bg="white")\
               .pack(pady=20)
-        else:
-            r = c = 0
-            for p in photos:
-                tr = api.api_get(f"/uploads/{p['filename']}")
-                if tr.status_code != 200:
-                    continue
-                try:
-                    pil = Image.open(io.BytesIO(tr.content))
-                except UnidentifiedImageError:
-                    continue
-
-                w, h = pil.size
-                s = min(w, h)
-                pil = pil.crop(((w-s)//2,(h-s)//2,(w+s)//2,(h+s)//2))
-                pil = pil.resize((THUMB_SIZE, THUMB_SIZE), Image.LANCZOS)
-                tk_img = ImageTk.PhotoImage(pil)
-                self.thumbs.append(tk_img)
-
-                cont = tk.Frame(frame, bg="white")
-                cont.grid(row=r, column=c, padx=GAP, pady=GAP)
+            return
+        for p in photos:
+            shown["cells"][p["filename"]] = self._album_cell(frame, p, self._preview(p), aid)
+        self._place(shown["cells"], photos)
+        self._fill_thumbs(f"/api/albums/{aid}/images", photos, shown["cells"])
+
+    def _album_cell(self, frame, p, pil, aid):
+        cont = tk.Frame(frame, bg="white")
+        lbl = cont.thumb = tk.Label(cont, bg="white", cursor="hand2")
+        self._set_thumb(lbl, pil)
+        lbl.pack()
+        lbl.bind("<Button-1>", lambda e, data=p: self._open_image_detail(data, aid))
+
+        tk.Label(cont, text=p.get("description",""),
+                 fg="black", bg="white", font=("Arial",9)).pack(pady=(2,0))
+
+        ds = p.get("taken_at") or p["uploaded_at"]
+        try:
+            fmt = "%Y-%m-%d %H:%M:%S" if len(ds)>16 else "%Y-%m-%d %H:%M"
+            dt = datetime.strptime(ds, fmt) + timedelta(hours=UTC_OFFSET_HOURS)
+            ds_fmt = dt.strftime("%d %b %Y %H:%M")
+        except:
+            ds_fmt = "Unknown date"
+        tk.Label(cont, text=ds_fmt, fg="gray", bg="white", font=("Arial",8)).pack()
+
+        loc = p.get("location","")
+        if not loc and self.device_lat is not None:
+            loc = f"{self.device_lat},{self.device_lon}"
+        city = self._loc_to_city(loc)
+        tk.Label(cont, text=f"Location: {city}", fg="gray", bg="white", font=("Arial",8))\
+          .pack()
+        return cont
 
-                lbl = tk.Label(cont, image=tk_img, bg="white", cursor="hand2")
-                lbl.pack()
-                lbl.bind("<Button-1>", lambda e, data=p: self._open_image_detail(data))
+    def _add_posts_to_album(self, album, parent_popup):
+        """Picks existing posts for the album; only their ids are sent, nothing is uploaded again."""
+        aid = album["id"]
+        resp = api.api_get("/api/images", auth=True)
+        shown = self.album_popups.get(aid, {}).get("cells", {})
+        posts = [p for p in (resp.json() if resp.ok else []) if "id" in p and p["filename"] not in shown]
+        if not posts:
+            messagebox.showinfo("Add from posts", "No posts to add.", parent=parent_popup)
+            return
 
-                tk.Label(cont, text=p.get("description",""),
-                         fg="black", bg="white", font=("Arial",9)).pack(pady=(2,0))
+        popup = tk.Toplevel(parent_popup)
+        popup.title(f"Add to {album['name']}")
+        popup.config(bg="white")
+        grid = tk.Frame(popup, bg="white"); grid.pack(padx=10, pady=10)
+        chosen = {}         # image id -> tile frame
+        add_btn = tk.Button(popup, text="Add selected", state="disabled", relief="raised", bd=1)
 
-                ds = p.get("taken_at") or p["uploaded_at"]
+        def toggle(p, cell):
+            if chosen.pop(p["id"], None):
+                cell.config(highlightbackground="white")
+            else:
+                chosen[p["id"]] = cell
+                cell.config(highlightbackground="#0095f6")
+            add_btn.config(text=f"Add selected ({len(chosen)})" if chosen else "Add selected",
+                           state="normal" if chosen else "disabled")
+
+        def add():
+            r = api.api_send("POST", f"/api/albums/{aid}/media", json={"ids": list(chosen)})
+            if api.is_queued(r):
+                messagebox.showinfo("Offline", "Saved offline – the photos will be added when you're back online.")
+            elif not r.ok:
                 try:
-                    fmt = "%Y-%m-%d %H:%M:%S" if len(ds)>16 else "%Y-%m-%d %H:%M"
-                    dt = datetime.strptime(ds, fmt) + timedelta(hours=UTC_OFFSET_HOURS)
-                    ds_fmt = dt.strftime("%d %b %Y %H:%M")
+                    err = r.json().get("error", r.text)
                 except:
-                    ds_fmt = "Unknown date"
-                tk.Label(cont, text=ds_fmt, fg="gray", bg="white", font=("Arial",8)).pack()
-
-                loc = p.get("location","")
-                if not loc and self.device_lat is not None:
-                    loc = f"{self.device_lat},{self.device_lon}"
-                city = self._loc_to_city(loc)
-                tk.Label(cont, text=f"Location: {city}", fg="gray", bg="white", font=("Arial",8))\
-                  .pack()
-
-                c += 1
-                if c == COLS:
-                    c = 0
-                    r += 1
+                    err = r.text or f"Status {r.status_code}"
+                messagebox.showerror("Error", err, parent=popup)
+                return
+            popup.destroy()
+            if aid in self.album_popups:
+                self._fill_album(aid)
+                parent_popup.grab_set()
+
+        cells = {}
+        for p in posts:
+            cell = tk.Frame(grid, bg="white", highlightthickness=3, highlightbackground="white")
+            lbl = cell.thumb = tk.Label(cell, bg="white", cursor="hand2")
+            self._set_thumb(lbl, self._preview(p))
+            lbl.pack()
+            lbl.bind("<Button-1>", lambda e, p=p, c=cell: toggle(p, c))
+            cells[p["filename"]] = cell
+        self._place(cells, posts)
+        add_btn.config(command=add)
+        add_btn.pack(pady=(0, 10))
 
-        popup.transient(self)
+        popup.transient(parent_popup)
         popup.grab_set()
         popup.focus_set()
+        self._fill_thumbs("/api/images", posts, cells)
 
     def _add_photo_to_album(self, album, parent_popup):
         path = filedialog.askopenfilename(
@@ -552,20 +902,19 @@ class ProfileFeed(tk.Frame):
         desc = simpledialog.askstring("Description", "Photo description:", parent=parent_popup)
         if desc is None:
             return
+        if not confirm_not_duplicate(path, parent_popup):
+            return
+
+        resp = api.api_send("POST", f"/api/albums/{album['id']}/images", file_path=path, data={
+            "description": desc,
+            "taken_at": taken_at,
+            "location": location
+        })
 
-        with open(path, "rb") as f:
-            resp = requests.post(
-                f"{api.API_URL}/api/albums/{album['id']}/images",
-                files={"file": (os.path.basename(path), f)},
-                data={
-                    "description": desc,
-                    "taken_at": taken_at,
-                    "location": location
-                },
-                headers={"Authorization": f"Bearer {api.TOKEN}"}
-            )
-
-        if resp.status_code in (200, 201):
+        if api.is_queued(resp):
+            messagebox.showinfo("Offline", "Saved offline – the photo will be added when you're back online.")
+            parent_popup.destroy()
+        elif resp.status_code in (200, 201):
             parent_popup.destroy()
             self._open_album(album)
             self._refresh_post_count()
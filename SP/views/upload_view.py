@@ -1,8 +1,27 @@
 import tkinter as tk
-import os
-import requests
 from tkinter import filedialog, messagebox
 import api_utils as api
+import phash
+
+DUPLICATE_DISTANCE = 6    # max dHash hamming distance treated as "same photo"
+
+
+def confirm_not_duplicate(path, parent=None):
+    """Warns if the library already holds a near-duplicate of `path`; True = go ahead."""
+    try:
+        h = phash.to_hex(phash.dhash_file(path))
+        resp = api.api_get(f"/api/images/similar?hash={h}&k={DUPLICATE_DISTANCE}", auth=True, timeout=5)
+        matches = resp.json() if resp.ok else []
+    except Exception:
+        return True     # the check is best-effort; never block an upload on it
+    if not matches:
+        return True
+    described = [m["description"] for m in matches if m.get("description")]
+    detail = f" (e.g. \"{described[0]}\")" if described else ""
+    return messagebox.askyesno(
+        "Possible duplicate",
+        f"You already have {len(matches)} very similar photo(s){detail}.\nUpload anyway?",
+        parent=parent)
 
 def open_upload_dialog(root, refresh_cb):
     if not api.TOKEN:
@@ -27,14 +46,20 @@ def open_upload_dialog(root, refresh_cb):
     entry = tk.Entry(win, width=40, bg="white", fg="black", insertbackground="black")
     entry.pack(pady=5)
 
+    warn_dupes = tk.BooleanVar(value=True)
+    tk.Checkbutton(win, text="Warn about duplicates", variable=warn_dupes,
+                   bg="white", fg="black").pack()
+
     # Send logic
     def send():
-        with open(path, "rb") as f:
-            resp = requests.post(f"{api.API_URL}/api/upload",
-                files={"file": (os.path.basename(path), f)},
-                data={"description": entry.get()},
-                headers={"Authorization": f"Bearer {api.TOKEN}"})
-        if resp.status_code == 200:
+        if warn_dupes.get() and not confirm_not_duplicate(path, win):
+            return
+        resp = api.api_send("POST", "/api/upload", file_path=path,
+                            data={"description": entry.get()})
+        if api.is_queued(resp):
+            messagebox.showinfo("Offline", "Saved offline – it will upload when you're back online.")
+            win.destroy()
+        elif resp.status_code == 200:
             messagebox.showinfo("OK", "Uploaded")
             win.destroy()
             refresh_cb()